@@ -0,0 +1,180 @@
+# answer_cache.py
+# 语义回答缓存：意思相同、检索到的知识库条目也相同的问题，直接返回之前生成的回答
+# 缓存的问题向量保存在一个 numpy 矩阵中，查找时一次矩阵乘法算出与全部缓存问题的余弦相似度；
+# 没有问题向量的请求（不为缓存单独调用嵌入API）按规范化后的问题文本精确匹配
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def context_signature(contexts, mode=""):
+    """
+    检索结果的签名：由各文本块内容的哈希组成（与顺序无关）。
+    mode 用于区分没有检索结果时的不同回答方式（如"无需检索"和"未检索到"）。
+    """
+    chunk_hashes = sorted(hashlib.sha1(context.encode("utf-8")).hexdigest() for context in contexts)
+    return hashlib.sha1((mode + "|" + ",".join(chunk_hashes)).encode("utf-8")).hexdigest()
+
+
+def normalize_question(question):
+    """精确匹配用的问题文本：忽略大小写、多余空白和末尾的标点"""
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip("?？。.!！~～ ")
+
+
+class AnswerCache:
+    """
+    语义回答缓存。
+    - 命中条件：问题向量与某个缓存问题的余弦相似度 >= similarity_threshold，且检索签名相同；
+      问题向量为None时按签名精确匹配（调用方把规范化后的问题文本放进签名）
+    - 容量满时淘汰最久未使用的条目（LRU），超过 ttl_seconds 的条目视为过期
+    - 构建标记文件（build_vector_db.py 重建数据库时更新）变化后清空缓存，避免返回旧知识库的回答
+    - 记录命中率等统计
+    """
+
+    def __init__(self, max_items=2048, ttl_seconds=24 * 3600, similarity_threshold=0.9, stamp_file=None):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.stamp_file = stamp_file
+
+        self._lock = threading.Lock()
+        self._stamp = self._read_stamp()
+        self._matrix = None # (max_items, 向量维度) 的单位向量矩阵，第一次写入时按维度分配
+        self._reset()
+        self._exact = OrderedDict() # 签名 -> (回答, 写入时间)，按最近使用排序
+
+        self.stats = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def _reset(self):
+        self._signatures = [None] * self.max_items
+        self._answers = [None] * self.max_items
+        self._valid = np.zeros(self.max_items, dtype=bool)
+        self._created_at = np.zeros(self.max_items, dtype=np.float64)
+        self._last_used = np.zeros(self.max_items, dtype=np.float64)
+
+    def _read_stamp(self):
+        if not self.stamp_file or not os.path.exists(self.stamp_file):
+            return None
+        return os.path.getmtime(self.stamp_file)
+
+    def _invalidate_if_rebuilt(self):
+        """在持有锁的情况下调用：知识库重建后清空缓存"""
+        stamp = self._read_stamp()
+        if stamp != self._stamp:
+            self._stamp = stamp
+            if self._valid.any() or self._exact:
+                self._reset()
+                self._exact.clear()
+                self.stats["invalidations"] += 1
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _expire(self, now):
+        expired = self._valid & (now - self._created_at > self.ttl_seconds)
+        count = int(expired.sum())
+        if count:
+            self._valid &= ~expired
+            for slot in np.flatnonzero(expired):
+                self._answers[slot] = self._signatures[slot] = None
+            self.stats["expired"] += count
+
+    def _find(self, vector, signature):
+        """返回与 vector 足够相似且签名相同的最佳条目位置，没有时返回None"""
+        if self._matrix is None or not self._valid.any() or len(vector) != self._matrix.shape[1]:
+            return None
+        similarities = self._matrix @ vector
+        similarities[~self._valid] = -1.0
+        candidates = np.flatnonzero(similarities >= self.similarity_threshold)
+        for slot in candidates[np.argsort(-similarities[candidates])]:
+            if self._signatures[slot] == signature:
+                return slot
+        return None
+
+    def _get_exact(self, signature, now):
+        """（持有锁）按签名精确查找，过期的条目直接删除"""
+        entry = self._exact.get(signature)
+        if entry is not None and now - entry[1] > self.ttl_seconds:
+            del self._exact[signature]
+            self.stats["expired"] += 1
+            entry = None
+        if entry is None:
+            return None
+        self._exact.move_to_end(signature)
+        return entry[0]
+
+    def get(self, embedding, signature):
+        """查找缓存的回答，未命中返回None；embedding 为None时按签名精确匹配"""
+        now = time.time()
+        with self._lock:
+            self._invalidate_if_rebuilt()
+            if embedding is None:
+                answer = self._get_exact(signature, now)
+            else:
+                self._expire(now)
+                slot = self._find(self._normalize(embedding), signature)
+                answer = None if slot is None else self._answers[slot]
+                if slot is not None:
+                    self._last_used[slot] = now
+            if answer is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return answer
+
+    def put(self, embedding, signature, answer):
+        """写入回答；已有几乎相同的问题时覆盖该条目"""
+        now = time.time()
+        with self._lock:
+            self._invalidate_if_rebuilt()
+            if embedding is None:
+                self._exact[signature] = (answer, now)
+                self._exact.move_to_end(signature)
+                if len(self._exact) > self.max_items:
+                    self._exact.popitem(last=False)
+                    self.stats["evictions"] += 1
+                self.stats["puts"] += 1
+                return
+
+            vector = self._normalize(embedding)
+            if self._matrix is None or self._matrix.shape[1] != len(vector):
+                # 第一次写入，或者更换了嵌入模型（维度变化）
+                self._matrix = np.zeros((self.max_items, len(vector)), dtype=np.float32)
+                self._reset()
+
+            slot = self._find(vector, signature)
+            if slot is None:
+                free = np.flatnonzero(~self._valid)
+                if len(free):
+                    slot = free[0]
+                else:
+                    slot = int(np.argmin(self._last_used))
+                    self.stats["evictions"] += 1
+
+            self._matrix[slot] = vector
+            self._signatures[slot] = signature
+            self._answers[slot] = answer
+            self._valid[slot] = True
+            self._created_at[slot] = self._last_used[slot] = now
+            self.stats["puts"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            self._exact.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["items"] = int(self._valid.sum()) + len(self._exact)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
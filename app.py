@@ -1,95 +1,427 @@
 # app.py
+import asyncio
 import os
-import re
+import threading
+import time
 from dotenv import load_dotenv
-import chromadb
 import dashscope
-from dashscope import Generation, TextEmbedding
 from dashscope import Generation
+from retriever import RetrievalService
+from numpy_store import NumpyRetrievalService
+from embedding_cache import EmbeddingCache
+from command_index import CommandIndex
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from gating import classify_question
+from gating_model import GatingModel, train_gating_model
+from conversation_memory import ConversationMemory
+from answer_cache import AnswerCache, context_signature, normalize_question
+from prompt_builder import build_messages, format_prompt_stats
+from dashscope_async import AsyncDashScopeClient, DashScopeAPIError
+from tracing import Tracer, start_metrics_server
+from snapshot import SnapshotPointer, SnapshotRetrievalService
+from embedders import DashScopeEmbedder, create_local_embedder
 
 # ============ 加载环境变量 ============
 load_dotenv()
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
 # ====================================================
 
-dashscope.base_http_api_url = 'https://dashscope.aliyuncs.com/api/v1' # 为API请求提供地址
+# 为API请求提供地址；设置 DASHSCOPE_HTTP_BASE_URL 可以指向本地模拟服务（见mock_dashscope.py）
+dashscope.base_http_api_url = os.getenv("DASHSCOPE_HTTP_BASE_URL", 'https://dashscope.aliyuncs.com/api/v1')
 
 # ========== 配置项 (请与build_vector_db.py保持一致) ==========
 KNOWLEDGE_BASE_DIR = "knowledge_base"
 CHROMA_DB_DIR = "db/chroma_db"
 COLLECTION_NAME = "linux_commands"
+RETRIEVAL_BACKEND = "numpy" # 检索后端："numpy"（内存精确检索，适合小知识库）或 "chroma"（适合大知识库）
+VECTOR_STORE_DIR = "db/vector_store" # numpy 后端的向量库，由build_vector_db.py生成
+VECTOR_STORE_DTYPE = "float32" # 向量库不存在时从Chroma导出所用的存储类型：float32 / float16 / int8
+BUILD_STAMP_FILE = "db/build_stamp" # 数据库重建完成后由build_vector_db.py更新
+SNAPSHOT_DIR = "db/snapshots" # build_vector_db.py发布的只读快照；存在时numpy后端、命令名索引、关键词索引和判断模型都从当前快照加载
+COMMAND_INDEX_FILE = "db/command_index.json" # 命令名索引，由build_vector_db.py生成
+BM25_INDEX_DIR = "db/bm25_index" # 关键词检索（BM25）索引，由build_vector_db.py生成
+HYBRID_CANDIDATES = 10 # 混合检索时向量检索和关键词检索各取的候选数
+RRF_K = 60 # 倒数排名融合的平滑常数，越大则排名靠后的结果权重下降得越慢
+EMBEDDING_MODEL = "text-embedding-v3" # 嵌入模型，更换后查询向量缓存自动失效
+EMBEDDING_CACHE_PATH = "db/embedding_cache.sqlite3" # 查询向量缓存文件
+EMBEDDING_CACHE_MEMORY_ITEMS = 1024 # 内存LRU容量
+EMBEDDING_CACHE_DISK_ITEMS = 50000 # 磁盘缓存容量
+EMBEDDING_CACHE_TTL = 30 * 24 * 3600 # 缓存有效期（秒）
+
+# ========== 嵌入模型配置 ==========
+EMBEDDING_BACKEND = "dashscope" # 查询嵌入："dashscope"（远程 text-embedding-v3，失败时退回本地模型）或 "local"（只用本地模型，不访问网络）
+EMBEDDING_TIMEOUT = 2 # 远程查询嵌入的超时（秒），超时后本次检索改用本地模型
+EMBEDDING_COOLDOWN = 30 # 远程嵌入超时或临时错误后，这段时间内直接使用本地模型（秒）
+LOCAL_EMBEDDER = "hashing" # 本地嵌入模型（请与build_vector_db.py保持一致）："hashing"（只做关键词匹配，退路等同于只用BM25）、"onnx:<模型目录>"、"sentence-transformers:<模型名>"；None 表示不使用
+LOCAL_VECTOR_STORE_DIR = "db/vector_store_local" # 本地嵌入模型的向量库，由build_vector_db.py生成
+
+# ========== 检索判断配置 ==========
+GATING_MODEL_FILE = "db/gating_model.npz" # 本地检索判断模型，与向量数据库一起构建
+GATING_CONFIDENCE_CUTOFF = 0.8 # 本地模型置信度达到该值时直接采用其判断，否则交给大模型
+JUDGE_MODEL = "qwen3-max" # 判断是否需要检索的模型，可改为更快的小模型（如 qwen-turbo、qwen-flash）
+SPECULATIVE_RETRIEVAL = True # 大模型判断的同时预先检索，判断结果为"不需要"时丢弃检索结果
+
+# ========== 并发配置 ==========
+MODEL_CONCURRENCY_LIMITS = {"qwen3-max": 16, "text-embedding-v3": 32} # 每个模型同时进行的请求数上限
+UPSTREAM_MAX_CONNECTIONS = 100 # 到DashScope的连接池大小
+UPSTREAM_TIMEOUT = 60 # 单次请求超时（秒）
+UPSTREAM_MAX_RETRIES = 3 # 超时或临时错误时的重试次数
+GRADIO_CONCURRENCY_LIMIT = 64 # Gradio同时处理的对话数
+GRADIO_QUEUE_SIZE = 256 # Gradio排队的最大请求数
+
+# ============ 对话记忆配置 ============
+HISTORY_KEEP_TURNS = 3 # 原样保留的最近对话轮数，更早的对话压缩成摘要
+HISTORY_TOKEN_BUDGET = 1500 # 提示词中历史对话（摘要+最近几轮）的token上限
+SUMMARY_MODEL = "qwen3-max" # 生成对话摘要的模型（在后台运行，可改为更便宜的小模型）
+SUMMARY_MAX_TOKENS = 300 # 摘要的最大长度
+PROMPT_TOKEN_BUDGET = 6000 # 整个提示词（系统提示词+历史对话+参考信息+问题）的token上限
+
+# ============ 回答缓存配置 ============
+ANSWER_CACHE_ENABLED = True # 相同意思、相同检索结果且没有历史对话的问题直接返回缓存的回答
+ANSWER_CACHE_SIMILARITY = 0.9 # 问题向量的余弦相似度阈值
+ANSWER_CACHE_MAX_ITEMS = 2048 # 缓存的回答数上限（超出时淘汰最久未使用的）
+ANSWER_CACHE_TTL = 24 * 3600 # 回答的有效期（秒）
+
+# ============ 性能追踪配置 ============
+TRACE_LOG = True # 每个请求结束时打印一行各阶段耗时
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9861")) # 指标接口端口（/metrics 为Prometheus格式，/metrics.json 为JSON），可用环境变量 METRICS_PORT 修改，设为0不启动
+
+# 当前快照的位置（快照切换后自动读取新版本）
+snapshots = SnapshotPointer(SNAPSHOT_DIR)
+
+# 创建检索后端
+def create_retrieval_service(backend=RETRIEVAL_BACKEND):
+    """
+    按配置创建检索后端。两种后端接口相同（见 retriever.RetrievalBackend），查询结果格式一致。
+    numpy 后端在发布过快照时从快照加载，快照切换后自动重新加载。
+    """
+    if backend == "chroma":
+        return RetrievalService(CHROMA_DB_DIR, COLLECTION_NAME, stamp_file=BUILD_STAMP_FILE)
+    if backend == "numpy" and snapshots.exists():
+        return SnapshotRetrievalService(snapshots)
+    if backend == "numpy":
+        return NumpyRetrievalService(
+            VECTOR_STORE_DIR,
+            stamp_file=BUILD_STAMP_FILE,
+            chroma_db_dir=CHROMA_DB_DIR,
+            collection_name=COLLECTION_NAME,
+            dtype=VECTOR_STORE_DTYPE
+        )
+    raise ValueError(f"未知的检索后端: {backend}")
+
+# 本地嵌入模型的向量库
+def create_local_retrieval_service():
+    """
+    本地嵌入模型的向量库（numpy 后端，从快照或 LOCAL_VECTOR_STORE_DIR 加载）。
+    向量空间与远程模型不同，不从 Chroma 导出。
+    """
+    if snapshots.exists():
+        service = SnapshotRetrievalService(snapshots, subdir="vector_store_local")
+    else:
+        service = NumpyRetrievalService(LOCAL_VECTOR_STORE_DIR, stamp_file=BUILD_STAMP_FILE)
+    service.name = "本地向量库"
+    return service
+
+# 进程内共享的检索服务，整个进程只打开一次数据库；只用本地嵌入模型时直接检索本地向量库
+local_retrieval_service = create_local_retrieval_service()
+retrieval_service = local_retrieval_service if EMBEDDING_BACKEND == "local" else create_retrieval_service()
+
+# 查询向量缓存，重复或近似重复的问题不再调用嵌入API
+embedding_cache = EmbeddingCache(
+    EMBEDDING_CACHE_PATH,
+    model=EMBEDDING_MODEL,
+    max_memory_items=EMBEDDING_CACHE_MEMORY_ITEMS,
+    max_disk_items=EMBEDDING_CACHE_DISK_ITEMS,
+    ttl_seconds=EMBEDDING_CACHE_TTL
+)
+
+# 异步DashScope客户端，Web界面的所有请求共享一个连接池
+async_client = AsyncDashScopeClient(
+    DASHSCOPE_API_KEY,
+    dashscope.base_http_api_url,
+    concurrency_limits=MODEL_CONCURRENCY_LIMITS,
+    max_connections=UPSTREAM_MAX_CONNECTIONS,
+    request_timeout=UPSTREAM_TIMEOUT,
+    max_retries=UPSTREAM_MAX_RETRIES
+)
+
+# 远程嵌入：超时或临时错误后进入冷却期，期间检索直接使用本地嵌入模型
+remote_embedder = DashScopeEmbedder(
+    DASHSCOPE_API_KEY,
+    EMBEDDING_MODEL,
+    timeout=EMBEDDING_TIMEOUT,
+    cooldown=EMBEDDING_COOLDOWN,
+    async_client=async_client
+)
+
+# 本地嵌入模型（首次使用时加载）
+local_embedder = None
+local_embedder_lock = threading.Lock()
+
+# 对话记忆：历史对话按token预算裁剪，较早的对话在后台压缩成摘要（call_summary_api 在下方定义）
+conversation_memory = ConversationMemory(
+    lambda prompt: call_summary_api(prompt),
+    keep_turns=HISTORY_KEEP_TURNS,
+    token_budget=HISTORY_TOKEN_BUDGET,
+    summary_max_tokens=SUMMARY_MAX_TOKENS
+)
+
+# 语义回答缓存，知识库重建（构建标记文件更新）后自动清空
+answer_cache = AnswerCache(
+    max_items=ANSWER_CACHE_MAX_ITEMS,
+    ttl_seconds=ANSWER_CACHE_TTL,
+    similarity_threshold=ANSWER_CACHE_SIMILARITY,
+    stamp_file=BUILD_STAMP_FILE
+)
+
+# 分阶段耗时追踪：每个请求记录判断、检索、嵌入、生成等阶段的耗时，并按阶段统计 p50/p95/p99
+tracer = Tracer(log_traces=TRACE_LOG)
+
+# 以下索引首次使用时加载，*_key 为加载时的（文件路径, 修改时间），变化后重新加载
+# 命令名 -> 知识库条目 的精确索引
+command_index = None
+command_index_key = None
+
+# 关键词检索索引（以内存映射方式加载）
+bm25_index = None
+bm25_index_key = None
+bm25_index_lock = threading.Lock()
+
+# 本地检索判断模型及其使用统计
+gating_model = None
+gating_model_key = None
+gating_model_lock = threading.Lock()
+gating_stats = {"local_decisions": 0, "llm_fallbacks": 0}
+
+# 流式生成的统计：首字延迟（TTFT）和生成速度（tokens/s）
+generation_stats = {
+    "requests": 0,
+    "ttft_ms_total": 0.0,
+    "ttft_ms_last": 0.0,
+    "tokens_per_sec_last": 0.0,
+    "output_tokens_total": 0,
+    "generate_seconds_total": 0.0,
+}
+generation_stats_lock = threading.Lock()
+
+# 提示词统计：每次请求的提示词token数（估计值）及参考信息裁剪节省的token数
+prompt_stats = {"requests": 0, "prompt_tokens_total": 0, "context_tokens_saved": 0}
 
 
 # ====================================================
-# 解析提问
-def get_embeddings(texts):
+# 加载本地嵌入模型
+def get_local_embedder():
     """
-    使用阿里云 text-embedding-v3 模型批量获取文本嵌入向量。
+    返回本地嵌入模型（ONNX/sentence-transformers 模型加载较慢，只加载一次）。
     """
-    if not isinstance(texts, list):
-        texts = [texts]
-        
-    response = TextEmbedding.call(
-        model='text-embedding-v3',
-        input=texts,
-        api_key=DASHSCOPE_API_KEY
-    )
-    
-    if response.status_code == 200:
-        # 'dense' 是默认的向量类型
-        embeddings = [item['embedding'] for item in response.output['embeddings']]
-        return embeddings
-    else:
-        raise Exception(f"嵌入API调用失败: {response.code}, {response.message}")
+    global local_embedder
 
-# 检索数据库
-def retrieve_context(query, n_results=3):
+    with local_embedder_lock:
+        if local_embedder is None:
+            local_embedder = create_local_embedder(LOCAL_EMBEDDER)
+    return local_embedder
+
+# 本地向量库是否可用
+def local_store_ready():
     """
-    根据用户查询，从向量数据库中检索最相关的上下文文本块。
-    使用阿里云 text-embedding-v3 进行查询。
+    本地向量库存在，并且由当前配置的本地嵌入模型生成。
     """
+    if not LOCAL_EMBEDDER:
+        return False
     try:
-        # 1. 为查询文本生成嵌入
-        query_embedding = get_embeddings(query)[0] # get_embeddings 返回列表，取第一个
-        
-        # 2. 连接到数据库并查询
-        client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
-        collection = client.get_collection(name=COLLECTION_NAME)
-        
-        results = collection.query(
-            query_embeddings=[query_embedding], # 注意这里是 query_embeddings
-            n_results=n_results
-        )
-        return results['documents'][0] if results['documents'] else []
-        
-    except Exception as e:
-        print(f"检索时出错: {e}")
-        return []
+        local_retrieval_service.open()
+        local_retrieval_service.reload_if_rebuilt()
+    except Exception:
+        return False
+    return local_retrieval_service.meta.get("model") == LOCAL_EMBEDDER
 
-# 获取模型回答
-def call_qwen_api(prompt, model='qwen3-max'):
+# 本地嵌入模型是否只做关键词匹配
+def local_embedder_is_lexical():
     """
-    调用通义千问API生成回答。
+    本地嵌入模型只做关键词匹配（如哈希嵌入，见 Embedder.lexical）时，它与BM25是同一种信号，
+    检索时直接使用BM25，不再把两路关键词检索的结果融合。
     """
-    # 设置API Key
-    Generation.api_key = DASHSCOPE_API_KEY
+    return bool(LOCAL_EMBEDDER) and get_local_embedder().lexical
 
+# 加载命令名索引
+def get_command_index():
+    """
+    返回命令名索引。
+    优先读取build_vector_db.py生成的索引文件（文件更新后自动重新加载）；
+    索引文件不存在时（旧版本构建的数据库），用向量数据库中的文本块现场构建。
+    有快照时从快照中以内存映射方式加载。
+    """
+    global command_index, command_index_key
+
+    snapshot_dir = snapshots.current()
+    if snapshot_dir is not None:
+        # 快照目录发布后不再修改，目录变化即版本切换
+        if command_index is None or command_index_key != snapshot_dir:
+            command_index = CommandIndex.load_mapped(os.path.join(snapshot_dir, "command_index"))
+            command_index_key = snapshot_dir
+    elif os.path.exists(COMMAND_INDEX_FILE):
+        key = (COMMAND_INDEX_FILE, os.path.getmtime(COMMAND_INDEX_FILE))
+        if command_index is None or key != command_index_key:
+            command_index = CommandIndex.load(COMMAND_INDEX_FILE)
+            command_index_key = key
+    elif command_index is None:
+        command_index = CommandIndex.from_chunks(retrieval_service.get_documents())
+    return command_index
+
+# 加载关键词检索索引
+def get_bm25_index():
+    """
+    返回关键词检索索引。索引文件更新后自动重新加载；
+    索引不存在时（旧版本构建的数据库），用向量数据库中的文本块在内存中构建。
+    索引文件只由build_vector_db.py生成，这里不写入磁盘（快照目录发布后不再修改）。
+    """
+    global bm25_index, bm25_index_key
+
+    with bm25_index_lock:
+        snapshot_dir = snapshots.current()
+        index_dir = os.path.join(snapshot_dir, "bm25_index") if snapshot_dir is not None else BM25_INDEX_DIR
+        meta_file = os.path.join(index_dir, "meta.json")
+        if os.path.exists(meta_file):
+            key = (index_dir, os.path.getmtime(meta_file))
+            if bm25_index is None or key != bm25_index_key:
+                bm25_index = BM25Index.load(index_dir)
+                bm25_index_key = key
+        elif bm25_index is None or bm25_index_key != (index_dir, None):
+            print("关键词检索索引不存在，已在内存中临时构建；请运行 build_vector_db.py 生成索引文件")
+            bm25_index = BM25Index.build(*retrieval_service.get_records())
+            bm25_index_key = (index_dir, None)
+        return bm25_index
+
+# 加载本地检索判断模型
+def get_gating_model():
+    """
+    返回本地检索判断模型。模型文件更新后自动重新加载；
+    模型文件不存在时（旧版本构建的数据库），用命令名索引在内存中训练一次。
+    模型文件只由build_vector_db.py生成，这里不写入磁盘（快照目录发布后不再修改）。
+    """
+    global gating_model, gating_model_key
+
+    with gating_model_lock:
+        snapshot_dir = snapshots.current()
+        model_file = os.path.join(snapshot_dir, "gating_model.npz") if snapshot_dir is not None else GATING_MODEL_FILE
+        if os.path.exists(model_file):
+            key = (model_file, os.path.getmtime(model_file))
+            if gating_model is None or key != gating_model_key:
+                gating_model = GatingModel.load(model_file)
+                gating_model_key = key
+        elif gating_model is None or gating_model_key != (model_file, None):
+            print("检索判断模型不存在，已在内存中临时训练；请运行 build_vector_db.py 生成模型文件")
+            gating_model = train_gating_model(get_command_index())
+            gating_model_key = (model_file, None)
+        return gating_model
+
+# 本地模型判断是否需要检索
+def local_judge(user_question):
+    """
+    用本地模型判断是否需要检索。
+    置信度达到 GATING_CONFIDENCE_CUTOFF 时返回True/False，否则返回None（交给大模型判断）。
+    """
     try:
-        response = Generation.call(
-            api_key=DASHSCOPE_API_KEY,
-            model=model,
-            prompt=prompt,
-            max_tokens=1024,
-            temperature=0.5,  # 降低随机性，让回答更稳定
-        )
+        with tracer.span("local_judge"):
+            need, confidence = get_gating_model().predict(user_question)
+    except Exception as e:
+        tracer.record_error("local_judge", e)
+        need, confidence = None, 0.0
 
-        if response.status_code == 200:
-            return response.output.choices[0].message.content
-        else:
-            return f"❌ API调用失败: {response.code}, {response.message}"
+    if confidence >= GATING_CONFIDENCE_CUTOFF:
+        gating_stats["local_decisions"] += 1
+        return need
+    gating_stats["llm_fallbacks"] += 1
+    return None
 
+# 混合检索
+def hybrid_search(query, query_embedding, n_results=3, service=None):
+    """
+    向量检索和BM25关键词检索各取 HYBRID_CANDIDATES 个候选，用倒数排名融合（RRF）合并。
+    向量检索擅长语义相近的问法，关键词检索擅长精确的参数名和术语，两者互补。
+    service 为查询向量所属的向量库，默认为 retrieval_service。
+    """
+    service = service or retrieval_service
+    with tracer.span("vector_query"):
+        results = service.query(query_embedding, n_results=HYBRID_CANDIDATES)
+    vector_ids = results['ids'][0] if results['ids'] else []
+    documents = dict(zip(vector_ids, results['documents'][0])) if vector_ids else {}
+
+    try:
+        with tracer.span("bm25"):
+            lexical_ids = [doc_id for doc_id, _ in get_bm25_index().search(query, HYBRID_CANDIDATES)]
     except Exception as e:
-        return f"❌ 发生错误: {str(e)}"
+        # 关键词检索只是补充，出错时退回纯向量检索
+        tracer.record_error("bm25", e)
+        lexical_ids = []
+
+    fused_ids = reciprocal_rank_fusion([vector_ids, lexical_ids], k=RRF_K)[:n_results]
+    # 只由关键词检索召回的块，再按ID从数据库取出文本
+    documents.update(service.get_documents_by_ids([i for i in fused_ids if i not in documents]))
+    return [documents[i] for i in fused_ids if i in documents]
+
+# 纯关键词检索
+def lexical_search(query, n_results=3):
+    """
+    只用BM25关键词检索（向量检索不可用时的最后退路）。
+    """
+    with tracer.span("bm25"):
+        ids = [doc_id for doc_id, _ in get_bm25_index().search(query, n_results)]
+    documents = retrieval_service.get_documents_by_ids(ids)
+    return [documents[i] for i in ids if i in documents]
+
+# 本地检索
+def local_search(query, n_results=3):
+    """
+    用本地嵌入模型和本地向量库做混合检索，不访问网络；
+    本地向量库不可用，或本地模型只做关键词匹配时，使用纯关键词检索。
+    """
+    if not local_embedder_is_lexical() and local_store_ready():
+        try:
+            with tracer.span("embed_local"):
+                query_embedding = get_local_embedder().embed([query])[0]
+            return hybrid_search(query, query_embedding, n_results, service=local_retrieval_service)
+        except Exception as e:
+            tracer.record_error("local_search", e)
+    return lexical_search(query, n_results)
+
+# 生成对话摘要
+def call_summary_api(prompt):
+    """
+    调用大模型把较早的对话压缩成摘要（在后台线程中执行）。
+    失败时抛出异常，不把错误信息当作摘要缓存。
+    """
+    response = Generation.call(
+        api_key=DASHSCOPE_API_KEY,
+        model=SUMMARY_MODEL,
+        prompt=prompt,
+        max_tokens=SUMMARY_MAX_TOKENS,
+        temperature=0.3,
+        result_format='message'
+    )
+    if response.status_code != 200:
+        raise Exception(f"摘要API调用失败: {response.code}, {response.message}")
+    return response.output.choices[0].message.content
+
+# 记录生成统计
+def record_generation_stats(start, first_token_time, end, output_tokens):
+    """
+    记录一次流式生成的首字延迟和生成速度。
+    """
+    ttft_ms = (first_token_time - start) * 1000
+    generate_seconds = end - first_token_time
+    tokens_per_sec = output_tokens / generate_seconds if generate_seconds > 0 else 0.0
+
+    with generation_stats_lock:
+        generation_stats["requests"] += 1
+        generation_stats["ttft_ms_total"] += ttft_ms
+        generation_stats["ttft_ms_last"] = ttft_ms
+        generation_stats["tokens_per_sec_last"] = tokens_per_sec
+        generation_stats["output_tokens_total"] += output_tokens
+        generation_stats["generate_seconds_total"] += generate_seconds
+    tracer.observe("ttft", ttft_ms)
+
+    print(f"生成完成：首字延迟 {ttft_ms:.0f} ms，{output_tokens} tokens，{tokens_per_sec:.1f} tokens/s")
 
 # 获取判断是否需要检索的提问词
 def get_retrieve_prompt(user_question):
@@ -110,179 +442,331 @@ def get_retrieve_prompt(user_question):
 请严格按照要求回答，只能回答"需要"或"不需要"，不能添加其他内容。
 """
 
-# 判断是否需要从数据库中检索信息
-def is_need_retrieve(user_question):
-    """
-    通过多重判断来决定是否需要去检索数据库
-    判断一：检查是否包含Linux命令关键词
-    判断二：检查是否包含"命令"、"指令"、"用法"、"语法"、"参数"等关键词
-    判断三：检查是否存在社交或设置请求
-    """
-
-    # 设置硬性规则过滤
-    user_question = user_question.strip().lower()
-
-    result = None # 默认为空
-
-    # 判断一：检查是否包含Linux命令关键词
-    linux_commands = [
-    "man", "help", "info", "shutdown", "reboot", "halt", "poweroff", "pwd", 
-    "cd", "tree", "mkdir", "touch", "ls", "cp", "mv", "rm", "rmdir", "ln", 
-    "readlink", "find", "xargs", "rename", "basename", "dirname", "chattr",
-    "lsattr", "file", "md5sum", "chown", "chmod", "chgrp", "umask", "cat",
-    "tac", "more", "less", "head", "tail", "tailf", "cut", "split", "paste",
-    "sort", "join", "uniq", "wc", "iconv", "dos2unix", "diff", "vimdiff", 
-    "rev", "tr", "od", "tee", "vi", "vim", "grep", "sed", "awk", "uname", 
-    "hostname", "demsg", "stat", "du", "date", "echo", "watch", "which", 
-    "whereis", "locate", "updatedb", "tar", "gzip", "zip", "unzip", "scp", 
-    "rsync", "useradd", "usermod", "userdel", "groupadd", "groupdel", "passwd", 
-    "chage", "chpasswd", "su", "visudo", "sudo", "id", "w", "who", "users", 
-    "whoami", "last", "lastb", "latslog", "fdisk", "partprobe", "tune2fs", 
-    "parted", "mkfs", "dumpe2fs", "resize2fs", "fsck", "dd", "mount", 
-    "umount", "df", "mkswap", "swapon", "swapoff", "sync", "ps", 
-    "pstree", "pgrep", "kill", "killall", "pkill", "top", "nice", 
-    "renice", "nohup", "strace", "ltrace", "runlevel", "init", "service",
-    "ifconfig", "ifup", "ifdown", "route", "arp", "ip", "netstat", "ss", 
-    "ping", "traceroute", "arping", "telnet", "curl", "nc", "ssh", "wget", 
-    "mail", "mailq", "nslookup", "dig", "host", "nmap", "tcpdump", "lsof", 
-    "uptime", "free", "iftop", "vmstat", "mpstat", "iostat", "iotop", "sar", 
-    "chkconfig", "ntsysv", "setup", "ethtool", "mii-tool", "dmidecode", 
-    "lspci", "ipcs", "ipcrm", "rpm", "yum", ":", "source", "test", "alias", 
-    "unalias", "bg", "fg", "jobs", "break", "continue", "eval", "exit", 
-    "logout", "export", "history", "read", "type", "ulimit", "unset"]
-
-    words = re.findall(r'\b[a-zA-Z]+\b', user_question) # 用正则表达式提取所有单词
-    if any(cmd in words for cmd in linux_commands):
-        return true
-
-    # 判断二：检查是否包含"命令"、"指令"、"用法"、"语法"等关键词
-    keywords = ["命令", "指令", "用法", "语法", "参数"]
-    if any(keyword in user_question for keyword in keywords):
-        return True
-    
-    # 判断三：检查是否存在社交或设置请求
-    social_keywords = ["你好", "称呼", "名字", "hi", "hello", "早上好", "晚上好", "再见", "bye"]
-    if any(keyword in user_question for keyword in social_keywords):
-        return False
-    
-    # 无法判断则返回None，交给大模型判断
-    return None
+# 解析大模型的判断结果
+def judge_says_retrieve(judge_text):
+    """
+    大模型回答"需要"时返回True。注意"不需要"中也包含"需要"，需要先排除。
+    """
+    return "需要" in judge_text and "不需要" not in judge_text
 
-# 获取答案
-def get_answer(user_question, history_tuples=None):
+
+# 构造最终提示词
+def compose_answer_messages(user_question, contexts, judge_response, history_tuples=None, history_summary=""):
     """
-    主函数：结合RAG和LLM，给出最终答案。
+    结合检索结果和对话历史，构造发送给大模型的 messages（见 prompt_builder.build_messages）。
     支持：
-    - 从知识库检索（RAG）
+    - 从知识库检索（RAG），参考信息按问题裁剪字段
     - 使用对话历史作为上下文（记忆）
     - 混合模式：有知识库就用知识库，没有就用通用能力
+    每次请求记录并打印提示词各部分的token数。
     """
-    if history_tuples is None:
-        history_tuples = []
+    messages, stats = build_messages(
+        user_question, contexts, judge_response,
+        history_tuples, history_summary, token_budget=PROMPT_TOKEN_BUDGET
+    )
+    with generation_stats_lock:
+        prompt_stats["requests"] += 1
+        prompt_stats["prompt_tokens_total"] += stats["total_tokens"]
+        prompt_stats["context_tokens_saved"] += stats["context_tokens_untrimmed"] - stats["context_tokens"]
+    print(format_prompt_stats(stats))
+    return messages
+
+# 回答缓存的键
+def answer_signature(contexts, judge_response):
+    """
+    检索签名：同样的检索结果、同样的回答方式才能共用一个回答。
+    """
+    if contexts:
+        mode = "rag"
+    elif judge_response is False:
+        mode = "general"
+    else:
+        mode = "not_found"
+    return context_signature(contexts, mode)
+
+def answer_cache_key(user_question, contexts, judge_response):
+    """
+    回答缓存的键 (问题向量, 检索签名)，不会为了缓存单独调用嵌入API：
+    - 经过向量检索的问题，检索时已经生成的问题向量（在向量缓存中）用于语义匹配
+    - 命令名索引、无需检索等没有生成问题向量的路径，按规范化后的问题文本精确匹配（问题向量为None）。
+      同一命令的不同问题（如"tar 怎么解压"和"tar 怎么压缩"）检索签名相同，不能按语义相似度共用回答
+    """
+    signature = answer_signature(contexts, judge_response)
+    if (judge_response is not False and EMBEDDING_BACKEND != "local"
+            and not get_command_index().find_commands(user_question)):
+        embedding = embedding_cache.get_many([user_question])[0]
+        if embedding is not None:
+            return embedding, signature
+    return None, signature + "|" + normalize_question(user_question)
+
+def store_answer(cache_key, answer):
+    """
+    把生成的回答写入回答缓存（出错的回答不缓存）。
+    """
+    if cache_key is not None and answer and "❌" not in answer:
+        answer_cache.put(*cache_key, answer)
+
+# 各组件的统计信息
+def get_service_stats():
+    """
+    汇总检索后端、向量缓存、回答缓存、对话记忆、检索判断、生成和提示词的统计信息（供指标接口使用）。
+    """
+    with generation_stats_lock:
+        generation = dict(generation_stats)
+        prompt = dict(prompt_stats)
+    return {
+        "retrieval": retrieval_service.get_stats(),
+        "embedding_cache": embedding_cache.get_stats(),
+        "answer_cache": answer_cache.get_stats(),
+        "conversation_memory": conversation_memory.get_stats(),
+        "gating": dict(gating_stats),
+        "embedding": {
+            "backend": EMBEDDING_BACKEND,
+            "remote_available": remote_embedder.available(),
+            "remote_failures": remote_embedder.failures,
+            "local_embedder": LOCAL_EMBEDDER,
+        },
+        "generation": generation,
+        "prompt": prompt,
+    }
+
+# =================== 请求管道 ===================
+# 请求管道只有异步实现：Web界面、多进程服务直接使用，命令行和评测脚本通过 asyncio.run 调用。
+# 网络请求不占用Gradio的工作线程，一个进程可以同时处理大量对话
+
+# 解析提问
+async def get_embeddings_async(texts):
+    """
+    使用阿里云 text-embedding-v3 模型批量获取文本嵌入向量（EMBEDDING_BACKEND 为 "local" 时使用本地模型）。
+    先查询向量缓存，只有未命中的文本才调用嵌入API；超时或出错时抛出异常，由调用方改用本地检索。
+    """
+    if not isinstance(texts, list):
+        texts = [texts]
+    if EMBEDDING_BACKEND == "local":
+        with tracer.span("embed_local"):
+            return await get_local_embedder().embed_async(texts)
+
+    embeddings = embedding_cache.get_many(texts)
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if not missing:
+        return embeddings
+
+    with tracer.span("embed"):
+        new_embeddings = await remote_embedder.embed_async([texts[i] for i in missing])
+
+    for i, embedding in zip(missing, new_embeddings):
+        embeddings[i] = embedding
+        embedding_cache.put(texts[i], embedding)
+    return embeddings
+
+# 检索数据库
+async def retrieve_context_async(query, n_results=3, commands=None):
+    """
+    根据用户查询，从向量数据库中检索最相关的上下文文本块。
+    问题中直接提到命令名时走命令名索引，不调用嵌入API；
+    其他自由提问使用阿里云 text-embedding-v3 向量检索与BM25关键词检索的混合检索，
+    远程嵌入不可用时改用本地嵌入模型或纯关键词检索（见 semantic_search_async）。
+    只是作为普通英文单词出现的命令名（如 "how do I find which process uses port 80" 中的 find），
+    对应条目与混合检索的结果融合，不替代混合检索。
+    commands 为判断阶段已经匹配到的命令名，传入后不再重复匹配。
+    """
+    try:
+        # 0. 问题中提到了知识库中的命令，直接返回对应条目
+        with tracer.span("command_index"):
+            index = get_command_index()
+            mentions = []
+            if commands is None:
+                commands, mentions = index.match_commands(query)
+            sections = index.lookup(commands, limit=n_results)
+        if sections:
+            return sections
+
+        # 1. 生成查询嵌入，使用共享的检索服务做混合检索（检索放到线程池中执行）
+        results = await semantic_search_async(query, n_results)
+
+        # 2. 仅被提及的命令的条目作为另一路结果融合（已包含在检索结果中的条目不再重复）
+        if mentions:
+            mentioned = [section for section in index.lookup(mentions, limit=n_results)
+                         if not any(section in document for document in results)]
+            results = reciprocal_rank_fusion([results, mentioned], k=RRF_K)[:n_results]
+        return results
+
+    except Exception as e:
+        tracer.record_error("retrieve", e)
+        return []
+
+# 向量检索（带退路）
+async def semantic_search_async(query, n_results=3):
+    """
+    为查询生成嵌入并做混合检索。嵌入或向量检索失败（例如远程嵌入超时）时退回本地检索，
+    只用本地模型时退回纯关键词检索；只用本地模型、且本地模型只做关键词匹配时直接使用纯关键词检索。
+    """
+    if EMBEDDING_BACKEND == "local" and local_embedder_is_lexical():
+        return await asyncio.to_thread(lexical_search, query, n_results)
+    try:
+        query_embedding = (await get_embeddings_async(query))[0] # 返回列表，取第一个
+        return await asyncio.to_thread(hybrid_search, query, query_embedding, n_results)
+    except Exception as e:
+        tracer.record_error("vector_search", e)
+    fallback = lexical_search if EMBEDDING_BACKEND == "local" else local_search
+    return await asyncio.to_thread(fallback, query, n_results)
+
+# 获取模型回答
+async def call_qwen_api_async(prompt, model='qwen3-max'):
+    """
+    调用通义千问API生成回答。prompt 可以是字符串或 messages 列表。
+    """
+    try:
+        return await async_client.generate(prompt, model=model, max_tokens=1024, temperature=0.5)
+    except DashScopeAPIError as e:
+        return f"❌ API调用失败: {e.code}, {e.message}"
+    except Exception as e:
+        return f"❌ 发生错误: {str(e)}"
+
+# 流式获取模型回答
+async def call_qwen_api_stream_async(prompt, model='qwen3-max'):
+    """
+    以流式方式调用通义千问API，逐段产出新生成的文本（增量输出）。prompt 可以是字符串或 messages 列表。
+    同时记录首字延迟和生成速度到 generation_stats。
+    """
+    start = time.perf_counter()
+    first_token_time = None
+    output_tokens = 0
 
-    # ============ 1. 构造对话历史上下文 ============
-    history_context = ""
-    if history_tuples:
-        # 将历史对话转换为自然语言文本，作为上下文
-        history_lines = []
-        for user_msg, ai_msg in history_tuples:
-            history_lines.append(f"用户：{user_msg}")
-            history_lines.append(f"AI：{ai_msg}")
-        history_context = "\n\n".join(history_lines)
-        history_context = f"【过往对话】\n{history_context}\n\n"
+    try:
+        async for content, usage in async_client.generate_stream(
+                prompt, model=model, max_tokens=1024, temperature=0.5):
+            output_tokens = usage.get("output_tokens", output_tokens)
+            if content:
+                if first_token_time is None:
+                    first_token_time = time.perf_counter()
+                yield content
+    except DashScopeAPIError as e:
+        yield f"❌ API调用失败: {e.code}, {e.message}"
+        return
+    except Exception as e:
+        yield f"❌ 发生错误: {str(e)}"
+        return
 
-    # ============ 2. 判断是否需要检索数据库 ============
+    if first_token_time is not None:
+        record_generation_stats(start, first_token_time, time.perf_counter(), output_tokens)
 
-    # 调用大模型进行判断
-    judge_response = is_need_retrieve(user_question)
+# 判断是否需要检索并获取知识库上下文
+async def select_contexts_async(user_question):
+    """
+    判断是否需要检索数据库，需要时检索知识库。
+    返回 (contexts, judge_response)，judge_response 为最终的判断结果：
+    True 已检索（contexts 为空表示知识库中没有找到），False 判断为不需要检索（问题与Linux命令无关）。
+    """
+    # 硬性规则判断，同时得到问题中提到的命令名
+    with tracer.span("gating"):
+        judge_response, commands = classify_question(user_question)
 
-    # 在需要时检索数据库
     if judge_response == True:
-        contexts = retrieve_context(user_question, n_results=2)
+        contexts = await retrieve_context_async(user_question, n_results=2, commands=commands)
     elif judge_response == False:
         contexts = []
+    elif (local_need := await asyncio.to_thread(local_judge, user_question)) is not None:
+        # 本地判断模型足够确定，直接采用其结果，不再调用大模型（在线程中判断，首次使用时加载模型不阻塞事件循环）
+        judge_response = local_need
+        contexts = await retrieve_context_async(user_question, n_results=2) if local_need else []
     else:
         #获取提示词
         judge_prompt = get_retrieve_prompt(user_question)
-        judge_response2 = call_qwen_api(judge_prompt)
-        if "需要" in judge_response2:
-            contexts = retrieve_context(user_question, n_results=2)
+        if SPECULATIVE_RETRIEVAL:
+            # 判断与检索同时进行，总耗时取两者中较慢的一个；判断结果为"不需要"时取消检索
+            retrieve_task = asyncio.create_task(retrieve_context_async(user_question, n_results=2))
+            with tracer.span("judge"):
+                judge_response = judge_says_retrieve(await call_qwen_api_async(judge_prompt, model=JUDGE_MODEL))
+            if judge_response:
+                contexts = await retrieve_task
+            else:
+                retrieve_task.cancel()
+                contexts = []
         else:
-            contexts = []
+            with tracer.span("judge"):
+                judge_response = judge_says_retrieve(await call_qwen_api_async(judge_prompt, model=JUDGE_MODEL))
+            contexts = await retrieve_context_async(user_question, n_results=2) if judge_response else []
+    return contexts, judge_response
 
-    # ============ 3. 构造最终Prompt ============
-    if contexts:
-        # 有知识库信息：使用RAG模式（高准确）
-        context_str = "\n\n".join(contexts)
-        final_prompt = f"""你是一个专业的Linux命令学习助手，专门为用户学习Linux命令提供帮助。以下是根据用户查询从知识库中检索到的相关信息：
-
-【参考信息】
-{context_str}
-
-{history_context}  # ← 注入历史上下文！
-
-请根据以上提供的知识库内容，为用户解答问题。要求：
-1. 严格基于知识库中的信息回答，不要添加知识库中没有的内容
-2. 回答要清晰、简洁、专业，适合Linux学习者理解
-3. 如果知识库中包含命令示例，请完整展示并解释每个参数的作用
-4. 如果知识库中包含多个相关信息，请整合成一个完整的回答
-5. 在回答末尾标注信息来源（如：根据Linux命令手册/根据知识库文档）
-6. 如果用户询问的命令有安全风险或需要注意事项，请特别提醒
-7. 保持教育性和实用性，帮助用户真正理解命令的使用方法和注意事项
-8. 遵守用户在历史对话中提出的要求
-【当前问题】
-{user_question}
-
-现在请基于知识库内容给出专业解答："""
-    else:
-        if judge_response == None:
-            retrieve_prompt = "结果检索，知识库中没有找到与用户问题相关的具体信息。"
-        else:
-            retrieve_prompt = "用户的问题似乎与Linux命令无关，将基于通用知识进行回答。"
-        # 没有知识库信息：使用通用问答模式
-        final_prompt = f"""你是一个专业的Linux命令学习助手，专门为用户学习Linux命令提供帮助。{retrieve_prompt}
-{history_context}  # ← 注入历史上下文！
-
-<system_info>
-- 当前是通用知识回答模式
-- 请基于你的训练知识回答Linux相关问题
-- 重点回答技术准确性，避免猜测不确定的信息
-- 如果问题超出Linux范围，请友好引导回Linux主题
-- 保持专业、教育性的语气
-</system_info>
-
-请根据你的通用知识为用户解答问题。要求：
-1. 仅回答与Linux命令、系统管理、Shell脚本相关的技术问题
-2. 确保技术细节的准确性，特别是命令语法、参数和使用场景
-3. 提供实用的示例代码，并解释关键部分
-4. 明确标注这是基于通用知识的回答，而非来自特定知识库
-5. 如果对某些细节不确定，请说明并建议用户查阅官方文档
-6. 对于复杂命令，分步骤解释使用方法
-7. 提醒用户在生产环境中使用命令前要充分测试
-
-【当前问题】
-{user_question}
-
-现在请基于你的通用Linux知识给出专业解答，并在开头说明"{retrieve_prompt}以下基于通用Linux知识解答："："""
-
-    # ============ 4. 调用大模型 ============
-    answer = call_qwen_api(final_prompt)
-    return answer
-
-
-# =================== 运行测试 ===================
-try:
+# 构造最终提示词
+async def prepare_answer_async(user_question, history_tuples=None, session_id=None):
+    """
+    检索知识库并构造最终提示词（messages），返回 (提示词, 缓存的回答, 回答缓存的键)。
+    - 没有历史对话时先查回答缓存，命中则提示词为None，不需要再调用大模型
+    - 历史对话经过对话记忆裁剪，不会随对话轮数无限增长（摘要在后台线程生成，这里不会等待）
+    """
+    contexts, judge_response = await select_contexts_async(user_question)
+
+    cache_key = None
+    if ANSWER_CACHE_ENABLED and not history_tuples:
+        try:
+            cache_key = answer_cache_key(user_question, contexts, judge_response)
+            with tracer.span("answer_cache"):
+                cached_answer = answer_cache.get(*cache_key)
+            if cached_answer is not None:
+                return None, cached_answer, cache_key
+        except Exception as e:
+            tracer.record_error("answer_cache", e)
+            cache_key = None
+
+    with tracer.span("prompt"):
+        history_summary, recent_turns = conversation_memory.build(history_tuples or [], session_id)
+        final_prompt = compose_answer_messages(user_question, contexts, judge_response, recent_turns, history_summary)
+    return final_prompt, None, cache_key
+
+# 获取答案
+async def get_answer_async(user_question, history_tuples=None, session_id=None):
+    """
+    主函数：结合RAG和LLM，给出最终答案。
+    """
+    with tracer.trace("answer"):
+        final_prompt, cached_answer, cache_key = await prepare_answer_async(user_question, history_tuples, session_id)
+        if cached_answer is not None:
+            return cached_answer
+        with tracer.span("generate"):
+            answer = await call_qwen_api_async(final_prompt)
+        store_answer(cache_key, answer)
+        return answer
+
+# 流式获取答案
+async def get_answer_stream_async(user_question, history_tuples=None, session_id=None):
+    """
+    get_answer_async 的流式版本：每收到新的文本就产出一次当前已生成的完整回答。
+    """
+    with tracer.trace("answer"):
+        final_prompt, cached_answer, cache_key = await prepare_answer_async(user_question, history_tuples, session_id)
+        if cached_answer is not None:
+            yield cached_answer
+            return
+        answer = ""
+        with tracer.span("generate"):
+            async for delta in call_qwen_api_stream_async(final_prompt):
+                answer += delta
+                yield answer
+        store_answer(cache_key, answer)
+
+# =================== Web界面 ===================
+def create_demo(answer_stream=None):
+    """
+    创建Gradio界面。answer_stream 为流式回答函数（参数与 get_answer_stream_async 相同），
+    默认在本进程中回答；多进程服务（serve.py）传入把问题转发给工作进程的函数。
+    """
     import gradio as gr
+    answer_stream = answer_stream or get_answer_stream_async
 
-    def chat_interface(user_input, history_messages=None):
+    async def chat_interface(user_input, history_messages=None, request: gr.Request = None):
         """
         Gradio界面的处理函数，使用openai-style messages 格式
+        以生成器方式流式更新聊天记录，回答边生成边显示
+        request 由Gradio自动传入，用其会话ID缓存该会话的历史摘要
         """
         if history_messages is None:
             history_messages = []
 
         if not user_input.strip():
-            return "", history_messages, history_messages
+            yield "", history_messages, history_messages
+            return
         
         # 将 history_messages 从字典格式转换为元组格式
         history_tuples = []
@@ -292,15 +776,17 @@ try:
                 ai_msg = history_messages[i+1]["content"]
                 history_tuples.append((user_msg, ai_msg))
         
-        # 获取AI回答 (确保 get_answer 支持 messages 格式的历史)
-        ai_response = get_answer(user_input, history_tuples)
-        
-        # 将用户输入和AI回答添加到历史
+        # 先把用户输入和一条空的AI回答添加到历史，立即显示
         history_messages.append({"role": "user", "content": user_input})
-        history_messages.append({"role": "assistant", "content": ai_response})
-        
-        # 返回值：清空输入框，更新聊天历史，更新状态
-        return "", history_messages, history_messages
+        history_messages.append({"role": "assistant", "content": ""})
+        yield "", history_messages, history_messages
+
+        # 流式获取AI回答，每收到新内容就刷新一次
+        session_id = request.session_hash if request is not None else None
+        async for partial_answer in answer_stream(user_input, history_tuples, session_id):
+            history_messages[-1]["content"] = partial_answer
+            # 返回值：清空输入框，更新聊天历史，更新状态
+            yield "", history_messages, history_messages
 
     # 创建Gradio界面
     with gr.Blocks(theme=gr.themes.Soft()) as demo:
@@ -333,11 +819,32 @@ try:
             outputs=[user_input, chatbot, history_state]
         )
 
-    # 启动应用（仅当直接运行此脚本时）
-    if __name__ == "__main__":
-        print("\n🚀 启动Web界面...")
-        demo.launch(server_name="127.0.0.1", server_port=7860, share=False)
-
-except ImportError:
-
-    print("\n Gradio未安装。如需Web界面，请运行: pip install gradio")
+    # 处理函数是异步的，不再占用工作线程，可以放开并发数
+    demo.queue(default_concurrency_limit=GRADIO_CONCURRENCY_LIMIT, max_size=GRADIO_QUEUE_SIZE)
+    return demo
+
+# 启动时打开数据库并预热索引，避免第一个问题承担加载开销
+def warm_up():
+    retrieval_service.open()
+    get_command_index()
+    get_bm25_index()
+    get_gating_model()
+    if local_embedder_is_lexical():
+        print(f"本地嵌入模型 {LOCAL_EMBEDDER} 只做关键词匹配，远程嵌入失败时使用关键词检索")
+    elif local_store_ready():
+        get_local_embedder().embed(["预热"])
+    elif LOCAL_EMBEDDER:
+        print(f"本地向量库不可用（未构建或不是由 {LOCAL_EMBEDDER} 生成），远程嵌入失败时只能使用关键词检索")
+
+# 启动应用（仅当直接运行此脚本时）
+if __name__ == "__main__":
+    try:
+        demo = create_demo()
+    except ImportError:
+        print("\n Gradio未安装。如需Web界面，请运行: pip install gradio")
+        raise SystemExit(1)
+    warm_up()
+    if METRICS_PORT:
+        start_metrics_server(tracer, port=METRICS_PORT, extra_stats=get_service_stats)
+    print("\n🚀 启动Web界面...")
+    demo.launch(server_name="127.0.0.1", server_port=7860, share=False)
@@ -0,0 +1,127 @@
+# benchmarks/bench_backends.py
+# 对比检索后端：Chroma 与 numpy（float32 / float16 / int8）的查询延迟 p50/p99、批量查询耗时和进程内存（RSS）
+# 每个后端在独立的子进程中测试，内存占用互不影响；查询向量取库中已有的向量加噪声，不调用嵌入API
+# 后端RSS为打开后端并完成查询后增加的内存，进程RSS为整个子进程的内存（numpy 后端的子进程不导入chromadb）
+# 运行方式（在项目根目录）：python -m benchmarks.bench_backends [--queries 1000] [--batch 32]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+CHROMA_DB_DIR = "db/chroma_db"
+COLLECTION_NAME = "linux_commands"
+N_RESULTS = 10
+BACKENDS = ("chroma", "numpy-float32", "numpy-float16", "numpy-int8")
+
+
+def rss_mb():
+    """当前进程的常驻内存（MB）"""
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def percentile(timings, q):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * q))]
+
+
+def prepare(store_root, queries_count, seed=0):
+    """
+    在主进程中准备测试数据：导出三种存储类型的向量库，
+    并把库中已有的向量加上高斯噪声作为查询向量保存下来（子进程直接读取，不需要导入chromadb）
+    """
+    import chromadb
+    from numpy_store import export_chroma_collection
+
+    for dtype in ("float32", "float16", "int8"):
+        export_chroma_collection(CHROMA_DB_DIR, COLLECTION_NAME, os.path.join(store_root, dtype), dtype)
+
+    client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
+    result = client.get_collection(name=COLLECTION_NAME).get(include=["embeddings"])
+    base = np.asarray(result["embeddings"], dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    picks = base[rng.integers(0, len(base), size=queries_count)]
+    np.save(os.path.join(store_root, "queries.npy"), (picks + rng.normal(0, 0.01, size=picks.shape)).astype(np.float32))
+
+
+def run_backend(backend, batch_size, store_root):
+    """在子进程中执行：打开后端、逐条查询和批量查询，返回结果"""
+    queries = np.load(os.path.join(store_root, "queries.npy"))
+    if backend == "chroma":
+        from retriever import RetrievalService
+        service = RetrievalService(CHROMA_DB_DIR, COLLECTION_NAME)
+    else:
+        from numpy_store import NumpyRetrievalService
+        service = NumpyRetrievalService(os.path.join(store_root, backend.split("-", 1)[1]))
+    rss_base = rss_mb()
+
+    start = time.perf_counter()
+    service.open()
+    open_ms = (time.perf_counter() - start) * 1000
+
+    timings = []
+    top1_ids = []
+    for query in queries:
+        start = time.perf_counter()
+        result = service.query(query.tolist(), n_results=N_RESULTS)
+        timings.append((time.perf_counter() - start) * 1000)
+        top1_ids.append(result["ids"][0][0])
+
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        service.query(queries[i:i + batch_size].tolist(), n_results=N_RESULTS)
+    batch_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        "backend": backend,
+        "open_ms": open_ms,
+        "p50_ms": percentile(timings, 0.5),
+        "p99_ms": percentile(timings, 0.99),
+        "batch_ms_per_query": batch_ms / len(queries),
+        "rss_mb": rss_mb() - rss_base,
+        "rss_total_mb": rss_mb(),
+        "top1_ids": top1_ids,
+    }
+
+
+def main(queries_count, batch_size):
+    results = []
+    with tempfile.TemporaryDirectory() as store_root:
+        prepare(store_root, queries_count)
+        for backend in BACKENDS:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_backends", "--worker", backend,
+                 "--batch", str(batch_size), "--store-root", store_root],
+                capture_output=True, text=True, check=True
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    # 以 numpy float32 的精确结果为准，计算其他后端 top-1 结果的一致率
+    reference = next(r["top1_ids"] for r in results if r["backend"] == "numpy-float32")
+    print(f"{len(reference)} 次查询，每次取 top-{N_RESULTS}，批量查询每批 {batch_size} 个")
+    print(f"{'后端':<15}{'打开ms':>9}{'p50ms':>9}{'p99ms':>9}{'批量ms/条':>11}{'后端RSS MB':>12}{'进程RSS MB':>12}{'top1一致':>9}")
+    for r in results:
+        agreement = sum(a == b for a, b in zip(r["top1_ids"], reference)) / len(reference)
+        print(f"{r['backend']:<15}{r['open_ms']:9.1f}{r['p50_ms']:9.3f}{r['p99_ms']:9.3f}"
+              f"{r['batch_ms_per_query']:11.3f}{r['rss_mb']:12.1f}{r['rss_total_mb']:12.1f}{agreement:9.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比检索后端的延迟和内存")
+    parser.add_argument("--queries", type=int, default=1000, help="查询次数")
+    parser.add_argument("--batch", type=int, default=32, help="批量查询时每批的查询数")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--store-root", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(run_backend(args.worker, args.batch, args.store_root)))
+    else:
+        main(args.queries, args.batch)
@@ -0,0 +1,111 @@
+# benchmarks/bench_chunker.py
+# 对比旧版切分（整体读入 + 逐字符拼接句子）与 chunker.py 在大语料上的耗时
+# 运行方式（在项目根目录）：python -m benchmarks.bench_chunker [--copies 100]
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from chunker import chunk_file
+
+SOURCE_FILE = "knowledge_base/cman.txt"
+SEPARATOR = "-----------------------------------------------------------------"
+
+
+def legacy_chunk_text(text):
+    """旧版 load_and_chunk_documents 的切分逻辑（不含 unstructured 解析），仅用于对比"""
+    chunks = []
+    for section in text.split(SEPARATOR):
+        section = section.strip()
+        if not section:
+            continue
+        if len(section) > 7500:
+            paragraphs = section.split('\n\n')
+            current_chunk = ""
+            for paragraph in paragraphs:
+                if len(current_chunk) + len(paragraph) < 7500:
+                    current_chunk += paragraph + "\n\n"
+                else:
+                    if current_chunk:
+                        chunks.append(current_chunk.strip())
+                    if len(paragraph) > 7500:
+                        sentences = []
+                        current_sentence = ""
+                        for char in paragraph:
+                            current_sentence += char
+                            if char in '.!?。！？' and len(current_sentence) > 100:
+                                sentences.append(current_sentence.strip())
+                                current_sentence = ""
+                        if current_sentence:
+                            sentences.append(current_sentence.strip())
+                        current_sentence_chunk = ""
+                        for sentence in sentences:
+                            if len(current_sentence_chunk) + len(sentence) < 7500:
+                                current_sentence_chunk += sentence + " "
+                            else:
+                                if current_sentence_chunk:
+                                    chunks.append(current_sentence_chunk.strip())
+                                current_sentence_chunk = sentence + " "
+                        if current_sentence_chunk:
+                            chunks.append(current_sentence_chunk.strip())
+                        current_chunk = ""
+                    else:
+                        current_chunk = paragraph + "\n\n"
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+        else:
+            chunks.append(section)
+    return chunks
+
+
+def legacy_chunk_file(file_path):
+    with open(file_path, "r", encoding="utf-8") as f:
+        return legacy_chunk_text(f.read())
+
+
+def write_corpus(path, copies, long_paragraph):
+    """生成合成语料：cman.txt 重复 copies 次；long_paragraph 时再追加一个没有空行的超长条目"""
+    with open(SOURCE_FILE, "r", encoding="utf-8") as f:
+        text = f.read()
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(copies):
+            f.write(text)
+        if long_paragraph:
+            sentence = "这是一个用于测试句子级切分的很长的句子，它会被重复很多次以构造超长段落。" * 3
+            f.write(f"\n{SEPARATOR}\n【命令】longtest\n【说明】" + sentence * (copies * 200) + "\n")
+
+
+def bench(name, func, path):
+    start = time.perf_counter()
+    chunks = func(path)
+    seconds = time.perf_counter() - start
+    print(f"  {name:<8} {seconds * 1000:10.1f} ms  {len(chunks):6d} 个块")
+
+
+def bench_unstructured_import():
+    """旧版对 .txt 也要经过 unstructured.partition，单是导入就很慢（在子进程中计时）"""
+    code = "import time; s = time.perf_counter(); import unstructured.partition.auto; print(time.perf_counter() - s)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        print("unstructured 未安装，跳过导入耗时测试")
+        return
+    print(f"旧版额外开销：导入 unstructured.partition {float(result.stdout.strip()) * 1000:.0f} ms（还不含解析）")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="切分性能对比")
+    parser.add_argument("--copies", type=int, default=100, help="cman.txt 重复的次数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for long_paragraph in (False, True):
+            path = os.path.join(tmp, "corpus.txt")
+            write_corpus(path, args.copies, long_paragraph)
+            size_mb = os.path.getsize(path) / 1024 / 1024
+            label = "含超长段落" if long_paragraph else "普通条目"
+            print(f"{args.copies} x cman.txt（{label}，{size_mb:.1f} MB）")
+            bench("旧版", legacy_chunk_file, path)
+            bench("chunker", chunk_file, path)
+    bench_unstructured_import()
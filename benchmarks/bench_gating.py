@@ -0,0 +1,68 @@
+# benchmarks/bench_gating.py
+# 对比旧版 is_need_retrieve（每次重建列表并线性扫描）与预编译匹配器的耗时
+# 运行方式（在项目根目录）：python -m benchmarks.bench_gating
+import re
+import timeit
+
+from gating import classify_question
+
+QUESTIONS = [
+    "ls 怎么显示隐藏文件", "tar 怎么解压", "mii-tool 是干什么的", "怎么查看磁盘空间",
+    "你好", "以后叫我小明", "grep 的参数有哪些", "怎么查找大文件", "linux是什么", "谢谢",
+]
+ROUNDS = 2000
+
+
+def legacy_is_need_retrieve(user_question):
+    """旧版实现（仅用于对比）：每次调用都重建命令列表，并对列表逐个扫描"""
+    user_question = user_question.strip().lower()
+    linux_commands = [
+    "man", "help", "info", "shutdown", "reboot", "halt", "poweroff", "pwd",
+    "cd", "tree", "mkdir", "touch", "ls", "cp", "mv", "rm", "rmdir", "ln",
+    "readlink", "find", "xargs", "rename", "basename", "dirname", "chattr",
+    "lsattr", "file", "md5sum", "chown", "chmod", "chgrp", "umask", "cat",
+    "tac", "more", "less", "head", "tail", "tailf", "cut", "split", "paste",
+    "sort", "join", "uniq", "wc", "iconv", "dos2unix", "diff", "vimdiff",
+    "rev", "tr", "od", "tee", "vi", "vim", "grep", "sed", "awk", "uname",
+    "hostname", "demsg", "stat", "du", "date", "echo", "watch", "which",
+    "whereis", "locate", "updatedb", "tar", "gzip", "zip", "unzip", "scp",
+    "rsync", "useradd", "usermod", "userdel", "groupadd", "groupdel", "passwd",
+    "chage", "chpasswd", "su", "visudo", "sudo", "id", "w", "who", "users",
+    "whoami", "last", "lastb", "latslog", "fdisk", "partprobe", "tune2fs",
+    "parted", "mkfs", "dumpe2fs", "resize2fs", "fsck", "dd", "mount",
+    "umount", "df", "mkswap", "swapon", "swapoff", "sync", "ps",
+    "pstree", "pgrep", "kill", "killall", "pkill", "top", "nice",
+    "renice", "nohup", "strace", "ltrace", "runlevel", "init", "service",
+    "ifconfig", "ifup", "ifdown", "route", "arp", "ip", "netstat", "ss",
+    "ping", "traceroute", "arping", "telnet", "curl", "nc", "ssh", "wget",
+    "mail", "mailq", "nslookup", "dig", "host", "nmap", "tcpdump", "lsof",
+    "uptime", "free", "iftop", "vmstat", "mpstat", "iostat", "iotop", "sar",
+    "chkconfig", "ntsysv", "setup", "ethtool", "mii-tool", "dmidecode",
+    "lspci", "ipcs", "ipcrm", "rpm", "yum", ":", "source", "test", "alias",
+    "unalias", "bg", "fg", "jobs", "break", "continue", "eval", "exit",
+    "logout", "export", "history", "read", "type", "ulimit", "unset"]
+    words = re.findall(r'\b[a-zA-Z]+\b', user_question)
+    if any(cmd in words for cmd in linux_commands):
+        return True
+    keywords = ["命令", "指令", "用法", "语法", "参数"]
+    if any(keyword in user_question for keyword in keywords):
+        return True
+    social_keywords = ["你好", "称呼", "名字", "hi", "hello", "早上好", "晚上好", "再见", "bye"]
+    if any(keyword in user_question for keyword in social_keywords):
+        return False
+    return None
+
+
+def bench(name, func):
+    seconds = timeit.timeit(lambda: [func(q) for q in QUESTIONS], number=ROUNDS)
+    per_call_us = seconds / (ROUNDS * len(QUESTIONS)) * 1e6
+    print(f"{name:<8} 每次调用 {per_call_us:8.2f} us")
+    return per_call_us
+
+
+if __name__ == "__main__":
+    for question in QUESTIONS:
+        print(f"{question:<20} 旧版: {legacy_is_need_retrieve(question)!s:<6} 新版: {classify_question(question)}")
+    old = bench("旧版", legacy_is_need_retrieve)
+    new = bench("预编译", classify_question)
+    print(f"加速 {old / new:.1f} 倍")
@@ -0,0 +1,121 @@
+# benchmarks/bench_pipeline.py
+# 完整回答管道的压测：启动本地模拟 DashScope 服务（延迟可配置），用问题集按指定并发重放，
+# 输出各阶段（判断、检索、嵌入、生成等）耗时的 p50/p95/p99，不消耗真实的API额度
+# 模拟服务返回的嵌入向量是随机的，检索结果没有意义，这里只看耗时
+# 运行方式（在项目根目录）：
+#   python -m benchmarks.bench_pipeline [--concurrency 16] [--repeat 3] [--first-token-delay 0.2] [--stream]
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from mock_dashscope import start_in_thread
+
+DEFAULT_QUESTION_FILES = ["data/retrieval_eval.jsonl", "data/gating_eval.jsonl"]
+
+
+def load_questions(paths):
+    """读取问题集（每行一个JSON，字段 question），去掉重复的问题"""
+    questions, seen = [], set()
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                question = json.loads(line)["question"]
+                if question not in seen:
+                    seen.add(question)
+                    questions.append(question)
+    return questions
+
+
+async def replay(app, questions, concurrency, stream):
+    """按并发数重放全部问题，返回 (回答数, 出错数, 总耗时秒)"""
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def answer(question):
+        nonlocal errors
+        async with semaphore:
+            if stream:
+                result = ""
+                async for result in app.get_answer_stream_async(question):
+                    pass
+            else:
+                result = await app.get_answer_async(question)
+            if result.startswith("❌"):
+                errors += 1
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(answer(question) for question in questions))
+    finally:
+        await app.async_client.close()
+    return len(questions), errors, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用本地模拟 DashScope 服务压测完整回答管道")
+    parser.add_argument("--questions", nargs="+", default=DEFAULT_QUESTION_FILES, help="问题集文件（JSONL，字段 question）")
+    parser.add_argument("--repeat", type=int, default=1, help="问题集重放次数")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时进行的请求数")
+    parser.add_argument("--stream", action="store_true", help="使用流式生成（与Web界面相同）")
+    parser.add_argument("--answer-cache", action="store_true", help="启用回答缓存（默认关闭，每个问题都走完整管道）")
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="模拟服务的首个token延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="模拟服务每个token之间的延迟（秒）")
+    parser.add_argument("--embedding-delay", type=float, default=0.05, help="模拟服务的嵌入请求延迟（秒）")
+    parser.add_argument("--embedding-error-rate", type=float, default=0.0, help="嵌入请求返回429限流错误的概率")
+    parser.add_argument("--verbose", action="store_true", help="输出每个请求的运行日志和阶段耗时")
+    parser.add_argument("--json", help="把各阶段统计写入该文件（JSON）")
+    args = parser.parse_args()
+
+    server, base_url = start_in_thread(
+        first_token_delay=args.first_token_delay,
+        token_delay=args.token_delay,
+        embedding_delay=args.embedding_delay,
+        embedding_error_rate=args.embedding_error_rate,
+    )
+    # app 在导入时读取服务地址，必须先设置环境变量
+    os.environ["DASHSCOPE_HTTP_BASE_URL"] = base_url
+    os.environ.setdefault("DASHSCOPE_API_KEY", "mock")
+    import app
+    from embedding_cache import EmbeddingCache
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # 模拟的嵌入向量写入临时缓存，不污染真实的查询向量缓存
+        app.embedding_cache = EmbeddingCache(os.path.join(tmp_dir, "embedding_cache.sqlite3"), model=app.EMBEDDING_MODEL)
+        app.ANSWER_CACHE_ENABLED = args.answer_cache
+        app.tracer.log_traces = args.verbose
+
+        # 预先加载数据库和索引，不计入请求耗时
+        app.retrieval_service.open()
+        app.get_command_index()
+        app.get_bm25_index()
+        app.get_gating_model()
+        app.tracer.reset()
+
+        questions = load_questions(args.questions) * max(1, args.repeat)
+        print(f"重放 {len(questions)} 个问题，并发 {args.concurrency}，"
+              f"{'流式' if args.stream else '非流式'}生成，回答缓存{'开启' if args.answer_cache else '关闭'}")
+        print(f"模拟延迟：首个token {args.first_token_delay}s，每个token {args.token_delay}s，"
+              f"嵌入 {args.embedding_delay}s，嵌入限流概率 {args.embedding_error_rate}")
+
+        # 每个请求的运行日志默认不输出，只看最后的汇总
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            count, errors, seconds = asyncio.run(replay(app, questions, max(1, args.concurrency), args.stream))
+
+    server.shutdown()
+    print(f"\n完成 {count} 个问题（出错 {errors}），耗时 {seconds:.1f} 秒，吞吐 {count / seconds:.1f} 问/秒\n")
+    print(app.tracer.format_table())
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"questions": count, "errors": errors, "seconds": seconds, "stages": app.tracer.snapshot()},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# benchmarks/bench_retrieval.py
+# 对比“每个问题重新打开数据库”与“共享检索服务”的查询耗时
+# 旧做法在同一进程内重复打开同一路径时，Chroma 会复用缓存的 System，“重新打开”一行即旧代码的实际耗时；
+# “冷启动”一行在每次打开前清理该缓存，只相当于进程首次打开数据库，不是旧代码每个问题的耗时
+# 运行方式（在项目根目录）：python -m benchmarks.bench_retrieval
+import time
+
+import chromadb
+from chromadb.api.client import SharedSystemClient
+
+from retriever import RetrievalService
+
+CHROMA_DB_DIR = "db/chroma_db"
+COLLECTION_NAME = "linux_commands"
+ROUNDS = 50
+
+
+def load_sample_embeddings(limit=10):
+    """直接使用库中已有的向量作为查询，不调用嵌入API"""
+    client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
+    collection = client.get_collection(name=COLLECTION_NAME)
+    sample = collection.get(limit=limit, include=["embeddings"])
+    return [list(e) for e in sample["embeddings"]]
+
+
+def bench_reopen(embeddings, cold=False):
+    """旧做法：每次查询都新建客户端并获取集合（cold=True 时先清理 Chroma 的缓存，模拟冷启动）"""
+    SharedSystemClient.clear_system_cache()
+    timings = []
+    for i in range(ROUNDS):
+        if cold:
+            SharedSystemClient.clear_system_cache()
+        start = time.perf_counter()
+        client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
+        collection = client.get_collection(name=COLLECTION_NAME)
+        collection.query(query_embeddings=[embeddings[i % len(embeddings)]], n_results=2)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def bench_service(embeddings):
+    """新做法：共享的检索服务，只打开一次"""
+    SharedSystemClient.clear_system_cache()
+    service = RetrievalService(CHROMA_DB_DIR, COLLECTION_NAME)
+    service.open()
+    timings = []
+    for i in range(ROUNDS):
+        start = time.perf_counter()
+        service.query(embeddings[i % len(embeddings)], n_results=2)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, service.get_stats()
+
+
+def summarize(name, timings):
+    timings = sorted(timings)
+    p50 = timings[len(timings) // 2]
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    # 中文每个字占两列宽
+    print(f"{name:<{12 - len(name)}} 平均 {sum(timings) / len(timings):8.2f} ms  p50 {p50:8.2f} ms  p99 {p99:8.2f} ms")
+
+
+if __name__ == "__main__":
+    embeddings = load_sample_embeddings()
+    summarize("冷启动", bench_reopen(embeddings, cold=True))
+    summarize("重新打开", bench_reopen(embeddings))
+    timings, stats = bench_service(embeddings)
+    summarize("共享服务", timings)
+    print(f"共享服务：打开 {stats['open_ms']:.1f} ms，预热 {stats['warmup_ms']:.1f} ms（仅启动时一次）")
@@ -0,0 +1,54 @@
+# benchmarks/check_command_matcher.py
+# 检查命令名匹配：同时是常见英文单词的命令名（find、which、read、file 等）只有在确实指命令时才走命令名索引，
+# 出现在英文句子中时仍做混合检索，命令条目只与检索结果融合；带连字符的词只整体匹配（mii-tool 匹配，e-mail 不会匹配 mail）。
+# 不调用嵌入API（混合检索用固定结果代替）
+# 运行方式（在项目根目录）：python -m benchmarks.check_command_matcher
+import asyncio
+import sys
+
+import app
+from gating import COMMAND_MATCHER
+
+# (问题, 确实在问的命令名, 仅被提及的命令名)
+CASES = [
+    ("how do I find which process uses port 80", [], ["find", "which"]),
+    ("what is the best way to read a file", [], ["read", "file"]),
+    ("can you help me", [], ["help"]),
+    ("which 命令怎么用", ["which"], []),
+    ("用 find 查找大文件", ["find"], []),
+    ("find -name 怎么用", ["find"], []),
+    ("`sort` 怎么倒序", ["sort"], []),
+    ("how to use the top command", ["top"], []),
+    ("tar 怎么解压", ["tar"], []),
+    ("mii-tool 是干什么的", ["mii-tool"], []),
+    ("e-mail 怎么配置", [], []),
+    ("re-read the file", [], ["file"]),
+]
+HYBRID_RESULT = "混合检索结果"
+
+
+async def fake_semantic_search(query, n_results=3):
+    return [HYBRID_RESULT]
+
+
+def check(name, ok):
+    print(f"  {'✅' if ok else '❌'} {name}")
+    return not ok
+
+
+if __name__ == "__main__":
+    app.tracer.log_traces = False
+    failures = 0
+    print("命令名匹配：")
+    for question, commands, mentions in CASES:
+        actual = COMMAND_MATCHER.match(question)
+        failures += check(f"{question}：{actual}", actual == (commands, mentions))
+
+    print("检索：")
+    app.semantic_search_async = fake_semantic_search
+    contexts = asyncio.run(app.retrieve_context_async("how do I find which process uses port 80", n_results=2))
+    failures += check("英文句子中的 find/which 仍做混合检索，命令条目排在检索结果之后",
+                      len(contexts) == 2 and contexts[0] == HYBRID_RESULT and contexts[1].startswith("【命令】find"))
+    contexts = asyncio.run(app.retrieve_context_async("find -name 怎么用", n_results=2))
+    failures += check("find -name 直接取命令条目", HYBRID_RESULT not in contexts and contexts[0].startswith("【命令】find"))
+    sys.exit(1 if failures else 0)
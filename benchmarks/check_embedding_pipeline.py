@@ -0,0 +1,58 @@
+# benchmarks/check_embedding_pipeline.py
+# 检查嵌入流水线的重试与拆分：持续限流（429）时整个批次只按重试次数调用，不再对半拆分；
+# 不可重试的错误（400）才拆分批次，只有出错的块记为失败。不调用嵌入API
+# 运行方式（在项目根目录）：python -m benchmarks.check_embedding_pipeline
+import sys
+
+from embedding_pipeline import EmbeddingAPIError, EmbeddingPipeline
+
+MAX_RETRIES = 5
+BATCH_SIZE = 10
+
+
+def make_records(count):
+    return [{"id": f"chunk_{i}", "document": f"文本块 {i}"} for i in range(count)]
+
+
+def run(embed_func):
+    """用一个批次运行流水线，返回 (嵌入函数调用次数, 失败的块数)"""
+    calls = []
+
+    def counted(texts):
+        calls.append(len(texts))
+        return embed_func(texts)
+
+    pipeline = EmbeddingPipeline(counted, workers=1, max_batch_size=BATCH_SIZE, requests_per_second=1000,
+                                 max_retries=MAX_RETRIES, backoff_base=0.0)
+    report = pipeline.run(make_records(BATCH_SIZE), lambda records, embeddings: None)
+    return len(calls), len(report["failed"])
+
+
+def always_throttled(texts):
+    raise EmbeddingAPIError(429, "Throttling.RateQuota", "Requests rate limit exceeded")
+
+
+def one_bad_chunk(texts):
+    if "文本块 3" in texts:
+        raise EmbeddingAPIError(400, "InvalidParameter", "bad input")
+    return [[1.0, 0.0]] * len(texts)
+
+
+def check(name, actual, expected):
+    ok = actual == expected
+    print(f"  {'✅' if ok else '❌'} {name}：{actual}（期望 {expected}）")
+    return not ok
+
+
+if __name__ == "__main__":
+    failures = 0
+    calls, failed = run(always_throttled)
+    print(f"持续限流（{BATCH_SIZE} 个块，最多重试 {MAX_RETRIES} 次）：")
+    failures += check("嵌入调用次数", calls, MAX_RETRIES + 1)
+    failures += check("失败的块", failed, BATCH_SIZE)
+
+    calls, failed = run(one_bad_chunk)
+    print("一个块不可重试地出错：")
+    failures += check("失败的块", failed, 1)
+    print(f"  拆分后共调用 {calls} 次")
+    sys.exit(1 if failures else 0)
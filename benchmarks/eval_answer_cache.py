@@ -0,0 +1,46 @@
+# benchmarks/eval_answer_cache.py
+# 检查回答缓存不会把同一命令的不同问题当成同一个问题（它们检索到的条目相同，检索签名也相同），
+# 以及只有标点、大小写不同的问题能够命中。只走命令名索引，不调用嵌入API和大模型
+# 运行方式（在项目根目录）：python -m benchmarks.eval_answer_cache
+import asyncio
+import sys
+
+import app
+
+# 检索签名相同、但必须分别回答的问题
+DISTINCT_PAIRS = [
+    ("tar 怎么解压", "tar 怎么压缩"),
+    ("rm 怎么删除目录", "rm -rf 有什么风险"),
+    ("chmod 怎么加执行权限", "chmod 怎么去掉写权限"),
+]
+# 应该共用一个回答的问题
+SAME_PAIRS = [
+    ("tar 怎么解压", "TAR 怎么解压？"),
+    ("ls 用法", "ls 用法 "),
+]
+
+
+def cache_key(question):
+    contexts, judge_response = asyncio.run(app.select_contexts_async(question))
+    return app.answer_cache_key(question, contexts, judge_response)
+
+
+def check(pairs, expect_hit):
+    failures = 0
+    for first, second in pairs:
+        app.answer_cache.clear()
+        app.answer_cache.put(*cache_key(first), f"回答：{first}")
+        hit = app.answer_cache.get(*cache_key(second)) is not None
+        ok = hit == expect_hit
+        failures += not ok
+        print(f"  {'✅' if ok else '❌'} {first} / {second}：{'命中' if hit else '未命中'}")
+    return failures
+
+
+if __name__ == "__main__":
+    app.tracer.log_traces = False
+    print("不同的问题（不应命中）：")
+    failures = check(DISTINCT_PAIRS, expect_hit=False)
+    print("相同的问题（应该命中）：")
+    failures += check(SAME_PAIRS, expect_hit=True)
+    sys.exit(1 if failures else 0)
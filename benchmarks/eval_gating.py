@@ -0,0 +1,63 @@
+# benchmarks/eval_gating.py
+# 离线评估本地检索判断模型：准确率，以及能省掉多少次大模型判断调用
+# 运行方式（在项目根目录）：python -m benchmarks.eval_gating [--cutoff 0.8]
+import argparse
+import json
+
+import app
+from gating import is_need_retrieve
+
+EVAL_FILE = "data/gating_eval.jsonl"
+
+
+def load_eval_set(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(samples, cutoff):
+    model = app.get_gating_model()
+    rule_decided = rule_correct = 0
+    ambiguous = confident = confident_correct = model_correct = 0
+    errors = []
+
+    for sample in samples:
+        question, expected = sample["question"], sample["need"]
+        rule_result = is_need_retrieve(question)
+        if rule_result is not None:
+            rule_decided += 1
+            rule_correct += rule_result == expected
+            continue
+
+        # 硬性规则无法判断的问题，原本每一个都要调用大模型
+        ambiguous += 1
+        need, confidence = model.predict(question)
+        model_correct += need == expected
+        if confidence >= cutoff:
+            confident += 1
+            confident_correct += need == expected
+            if need != expected:
+                errors.append((question, expected, confidence))
+
+    total = len(samples)
+    print(f"样本数：{total}（硬性规则判断 {rule_decided}，需要进一步判断 {ambiguous}）")
+    if rule_decided:
+        print(f"硬性规则准确率：{rule_correct / rule_decided:.1%}")
+    if ambiguous:
+        print(f"本地模型在模糊问题上的准确率（不设阈值）：{model_correct / ambiguous:.1%}")
+        print(f"置信度 >= {cutoff} 的比例（省掉的大模型判断调用）：{confident / ambiguous:.1%}")
+    if confident:
+        print(f"置信度 >= {cutoff} 的判断准确率：{confident_correct / confident:.1%}")
+    # 假设大模型判断总是正确，估算整个判断流程的准确率
+    overall = rule_correct + confident_correct + (ambiguous - confident)
+    print(f"整体判断准确率（假设大模型判断正确）：{overall / total:.1%}")
+    for question, expected, confidence in errors:
+        print(f"  误判：{question}（期望 {'需要' if expected else '不需要'}，置信度 {confidence:.2f}）")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="评估本地检索判断模型")
+    parser.add_argument("--data", default=EVAL_FILE, help="标注数据（JSONL，字段 question/need）")
+    parser.add_argument("--cutoff", type=float, default=app.GATING_CONFIDENCE_CUTOFF, help="置信度阈值")
+    args = parser.parse_args()
+    evaluate(load_eval_set(args.data), args.cutoff)
@@ -0,0 +1,96 @@
+# benchmarks/eval_retrieval.py
+# 离线评估检索召回率：纯向量检索、纯关键词检索（BM25）和两者融合后的混合检索
+# 标注数据中每个问题对应一个或多个相关命令，检索结果中包含其中任一命令的条目即视为命中
+# 运行方式（在项目根目录）：python -m benchmarks.eval_retrieval [--lexical-only]
+# 向量检索需要调用嵌入API（问题向量会写入缓存）；--lexical-only 只评估关键词检索，可完全离线运行
+import argparse
+import asyncio
+import json
+
+import app
+from bm25_index import reciprocal_rank_fusion
+from command_index import COMMAND_HEADER_PATTERN, parse_command_names
+
+EVAL_FILE = "data/retrieval_eval.jsonl"
+K_VALUES = (1, 3, 5)
+
+
+def load_eval_set(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def commands_in(document):
+    """文本块中包含的全部命令名"""
+    names = set()
+    for header in COMMAND_HEADER_PATTERN.findall(document):
+        names.update(parse_command_names(header))
+    return names
+
+
+def rank_of_first_hit(ranked_ids, relevant_ids):
+    """第一个相关结果的名次（从1开始），没有命中返回None"""
+    for rank, doc_id in enumerate(ranked_ids, start=1):
+        if doc_id in relevant_ids:
+            return rank
+    return None
+
+
+async def embed_questions(questions):
+    """获取全部问题的向量（命中向量缓存的不再调用嵌入API）"""
+    try:
+        return [(await app.get_embeddings_async(question))[0] for question in questions]
+    finally:
+        await app.async_client.close()
+
+
+def evaluate(samples, lexical_only=False):
+    ids, documents = app.retrieval_service.get_records()
+    chunk_commands = {doc_id: commands_in(document) for doc_id, document in zip(ids, documents)}
+    bm25 = app.get_bm25_index()
+    depth = max(app.HYBRID_CANDIDATES, max(K_VALUES))
+
+    methods = ["关键词"] if lexical_only else ["向量", "关键词", "混合"]
+    if not lexical_only:
+        query_embeddings = asyncio.run(embed_questions([sample["question"] for sample in samples]))
+    first_hits = {method: [] for method in methods}
+    skipped = 0
+
+    for i, sample in enumerate(samples):
+        expected = set(sample["commands"])
+        relevant = {doc_id for doc_id, names in chunk_commands.items() if names & expected}
+        if not relevant:
+            # 知识库中没有对应条目，无法评估
+            skipped += 1
+            continue
+
+        lexical_ids = [doc_id for doc_id, _ in bm25.search(sample["question"], depth)]
+        rankings = {"关键词": lexical_ids}
+        if not lexical_only:
+            results = app.retrieval_service.query(query_embeddings[i], n_results=depth)
+            vector_ids = results["ids"][0] if results["ids"] else []
+            rankings["向量"] = vector_ids
+            rankings["混合"] = reciprocal_rank_fusion([vector_ids, lexical_ids], k=app.RRF_K)
+
+        for method in methods:
+            first_hits[method].append(rank_of_first_hit(rankings[method], relevant))
+
+    evaluated = len(samples) - skipped
+    print(f"样本数：{len(samples)}（知识库中找不到相关条目而跳过 {skipped}），文本块数：{len(ids)}")
+    if not evaluated:
+        return
+    header = "方法".ljust(6) + "".join(f"recall@{k}".rjust(11) for k in K_VALUES) + "MRR".rjust(8)
+    print(header)
+    for method in methods:
+        ranks = first_hits[method]
+        recalls = [sum(1 for r in ranks if r is not None and r <= k) / evaluated for k in K_VALUES]
+        mrr = sum(1.0 / r for r in ranks if r is not None) / evaluated
+        print(method.ljust(6) + "".join(f"{recall:11.1%}" for recall in recalls) + f"{mrr:8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="评估检索召回率")
+    parser.add_argument("--data", default=EVAL_FILE, help="标注数据（JSONL，字段 question/commands）")
+    parser.add_argument("--lexical-only", action="store_true", help="只评估关键词检索（不调用嵌入API）")
+    args = parser.parse_args()
+    evaluate(load_eval_set(args.data), args.lexical_only)
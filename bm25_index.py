@@ -0,0 +1,154 @@
+# bm25_index.py
+# 关键词检索（BM25）索引：与向量检索互补，精确匹配参数名（如 -rf、--exclude）和中文关键词
+# 索引以 numpy 数组保存在磁盘上，加载时使用内存映射，不需要把整个索引读入内存
+import json
+import os
+import re
+
+import numpy as np
+
+# 参数（-rf、--exclude）、英文/数字词、连续的中文
+TOKEN_PATTERN = re.compile(r"--?[a-z0-9][a-z0-9_-]*|[a-z0-9][a-z0-9_.]*|[一-鿿]+")
+
+
+def tokenize(text):
+    """
+    分词：参数和英文词整体作为一个词，中文按字符二元组（单字时用单字）切分。
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        if "一" <= token[0] <= "鿿":
+            if len(token) == 1:
+                tokens.append(token)
+            else:
+                tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            tokens.append(token.rstrip("."))
+    return tokens
+
+
+def _write_atomic(path, write, mode):
+    """写入临时文件后替换目标文件（传入文件对象，np.save 不会给临时文件名补 .npy 后缀）"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode, encoding=None if "b" in mode else "utf-8") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+class BM25Index:
+    """
+    倒排索引 + BM25 打分。
+    磁盘格式（一个目录）：
+    - meta.json：文档ID列表、词表（词 -> 词ID）、参数
+    - offsets.npy：每个词的倒排表在 postings 中的起止位置（int64，长度为词数+1）
+    - doc_ids.npy / tfs.npy：倒排表中的文档序号（int32）和词频（float32）
+    - doc_lens.npy：每个文档的词数（float32）
+    """
+
+    def __init__(self, ids, vocab, offsets, doc_ids, tfs, doc_lens, k1=1.5, b=0.75):
+        self.ids = ids
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lens = doc_lens
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_len = float(doc_lens.mean()) if len(doc_lens) else 0.0
+        document_freqs = np.diff(offsets).astype(np.float32)
+        self.idf = np.log(1.0 + (len(ids) - document_freqs + 0.5) / (document_freqs + 0.5))
+
+    @classmethod
+    def build(cls, ids, documents, k1=1.5, b=0.75):
+        """由文档构建索引"""
+        postings = {}
+        doc_lens = np.zeros(len(documents), dtype=np.float32)
+        for doc_index, document in enumerate(documents):
+            tokens = tokenize(document)
+            doc_lens[doc_index] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, []).append((doc_index, count))
+
+        vocab = {}
+        offsets = [0]
+        doc_ids, tfs = [], []
+        for term_id, (token, entries) in enumerate(sorted(postings.items())):
+            vocab[token] = term_id
+            for doc_index, count in entries:
+                doc_ids.append(doc_index)
+                tfs.append(count)
+            offsets.append(len(doc_ids))
+
+        return cls(
+            list(ids), vocab,
+            np.asarray(offsets, dtype=np.int64),
+            np.asarray(doc_ids, dtype=np.int32),
+            np.asarray(tfs, dtype=np.float32),
+            doc_lens, k1, b
+        )
+
+    def save(self, directory):
+        """
+        每个文件先写临时文件再替换：正在内存映射旧文件的进程继续读旧文件，不会读到写了一半的数据。
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name, array in (("offsets.npy", self.offsets), ("doc_ids.npy", self.doc_ids),
+                            ("tfs.npy", self.tfs), ("doc_lens.npy", self.doc_lens)):
+            _write_atomic(os.path.join(directory, name), lambda f, array=array: np.save(f, array), "wb")
+        # meta.json 最后写入，读取方以它的修改时间判断索引是否更新
+        meta = {"ids": self.ids, "vocab": self.vocab, "k1": self.k1, "b": self.b}
+        _write_atomic(os.path.join(directory, "meta.json"), lambda f: json.dump(meta, f, ensure_ascii=False), "w")
+
+    @classmethod
+    def load(cls, directory):
+        """加载索引，数组部分使用内存映射"""
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        def load_array(name):
+            return np.load(os.path.join(directory, name), mmap_mode="r")
+
+        return cls(
+            meta["ids"], meta["vocab"],
+            load_array("offsets.npy"), load_array("doc_ids.npy"),
+            load_array("tfs.npy"), load_array("doc_lens.npy"),
+            meta["k1"], meta["b"]
+        )
+
+    def search(self, query, n_results=10):
+        """返回得分最高的 [(文档ID, 得分)]，只包含得分大于0的文档"""
+        if not self.ids:
+            return []
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for token in set(tokenize(query)):
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lens[docs] / self.avg_doc_len)
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + norm)
+
+        n_results = min(n_results, len(scores))
+        top = np.argpartition(-scores, n_results - 1)[:n_results]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top if scores[i] > 0]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    倒数排名融合：每个结果在各个排序中得分 1/(k+名次)，按总分排序后返回ID列表。
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
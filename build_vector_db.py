@@ -1,9 +1,19 @@
 # build_vector_db.py (V2 - 使用阿里云 text-embedding-v3)
+import hashlib
+import json
 import os
+import shutil
+import time
 import chromadb
-from unstructured.partition.auto import partition
-from dashscope import TextEmbedding
 from dotenv import load_dotenv
+from chunker import chunk_file
+from command_index import COMMAND_HEADER_PATTERN, CommandIndex, parse_command_names
+from gating_model import train_gating_model
+from bm25_index import BM25Index
+from numpy_store import export_chroma_collection, save_vector_store
+from embedders import DashScopeEmbedder, create_local_embedder
+from snapshot import publish_snapshot, read_current
+from embedding_pipeline import EmbeddingPipeline
 
 # ========== 加载环境变量 ==========
 load_dotenv()
@@ -15,88 +25,63 @@ if not DASHSCOPE_API_KEY:
 KNOWLEDGE_BASE_DIR = "knowledge_base" # 知识库路径
 CHROMA_DB_DIR = "db/chroma_db" # 向量数据库路径
 COLLECTION_NAME = "linux_commands" # 数据库中的集合名称
+EMBEDDING_MODEL = "text-embedding-v3" # 嵌入模型，更换后会重建整个集合
+MANIFEST_FILE = "db/manifest.json" # 记录知识库文件的修改时间和哈希，用于增量构建
+COMMAND_INDEX_FILE = "db/command_index.json" # 命令名 -> 条目 的精确索引
+GATING_MODEL_FILE = "db/gating_model.npz" # 本地检索判断模型
+BM25_INDEX_DIR = "db/bm25_index" # 关键词检索（BM25）索引目录
+VECTOR_STORE_DIR = "db/vector_store" # numpy 检索后端使用的向量库目录
+VECTOR_STORE_DTYPE = "float32" # 向量库的存储类型：float32 / float16（体积减半）/ int8（体积为四分之一）
+LOCAL_EMBEDDER = "hashing" # 本地嵌入模型："hashing"（无需模型文件，只做关键词匹配，检索时等同于只用BM25）、"onnx:<模型目录>"、"sentence-transformers:<模型名>"；None 表示不构建本地向量库
+LOCAL_VECTOR_STORE_DIR = "db/vector_store_local" # 本地嵌入模型的向量库，远程嵌入不可用时app.py用它检索
+SNAPSHOT_DIR = "db/snapshots" # 只读快照目录，多进程服务（serve.py）共享内存映射的快照文件
+SNAPSHOT_KEEP = 3 # 保留的快照版本数
+BUILD_STAMP_FILE = "db/build_stamp" # 构建完成标记，app.py检测到变化后会重新加载数据库
+CHECKPOINT_FILE = "db/build_checkpoint.jsonl" # 嵌入检查点，构建中断后重新运行会从这里恢复
+
+# ========== 嵌入并发配置 ==========
+EMBEDDING_WORKERS = 4 # 并发请求数
+EMBEDDING_MAX_BATCH = 10 # 每次请求的最大文本条数（text-embedding-v3 的上限为10）
+EMBEDDING_MAX_BATCH_CHARS = 80000 # 每次请求的最大总字符数
+EMBEDDING_REQUESTS_PER_SECOND = 10 # 整体请求速率上限
+EMBEDDING_MAX_RETRIES = 5 # 临时错误（限流、超时、服务端错误）的最大重试次数
 # ====================================================
 
+def list_knowledge_files():
+    """
+    返回知识库目录下的所有文件路径（按文件名排序）。
+    """
+    return [
+        os.path.join(KNOWLEDGE_BASE_DIR, filename)
+        for filename in sorted(os.listdir(KNOWLEDGE_BASE_DIR))
+        if os.path.isfile(os.path.join(KNOWLEDGE_BASE_DIR, filename))
+    ]
+
+def load_and_chunk_file(file_path):
+    """
+    加载单个文档，并将其分割成小块。
+    按每个命令条目进行分割，确保每个块包含完整的命令信息（详见chunker.py）。
+    """
+    try:
+        return chunk_file(file_path)
+    except Exception as e:
+        print(f"处理文件 {os.path.basename(file_path)} 时出错: {e}")
+        return []
+
 def load_and_chunk_documents():
     """
     从指定目录加载所有文档，并将其分割成小块。
-    按每个命令条目进行分割，确保每个块包含完整的命令信息。
     """
     chunks = []
-    for filename in os.listdir(KNOWLEDGE_BASE_DIR):
-        file_path = os.path.join(KNOWLEDGE_BASE_DIR, filename)
-        if not os.path.isfile(file_path):
-            continue
-            
-        try:
-            elements = partition(filename=file_path)
-            text = "\n".join([str(el) for el in elements])
-            
-            # 按命令条目分割，每个"-----------------------------------------------------------------"分隔符表示一个新命令
-            command_sections = text.split('-----------------------------------------------------------------')
-            
-            # 处理每个命令条目
-            for section in command_sections:
-                # 清理空白字符
-                section = section.strip()
-                if not section:
-                    continue
-                    
-                # 如果单个命令条目太长，进一步分割（限制在7500字符以内以确保安全余量）
-                if len(section) > 7500:
-                    # 按段落分割
-                    paragraphs = section.split('\n\n')
-                    current_chunk = ""
-                    
-                    for paragraph in paragraphs:
-                        if len(current_chunk) + len(paragraph) < 7500:
-                            current_chunk += paragraph + "\n\n"
-                        else:
-                            if current_chunk:
-                                chunks.append(current_chunk.strip())
-                            # 如果单个段落就很长，进行句子级分割
-                            if len(paragraph) > 7500:
-                                # 按句子分割（以句号、感叹号、问号为分隔符）
-                                sentences = []
-                                current_sentence = ""
-                                for char in paragraph:
-                                    current_sentence += char
-                                    if char in '.!?。！？' and len(current_sentence) > 100:
-                                        sentences.append(current_sentence.strip())
-                                        current_sentence = ""
-                                if current_sentence:
-                                    sentences.append(current_sentence.strip())
-                                
-                                # 组合句子到块中
-                                current_sentence_chunk = ""
-                                for sentence in sentences:
-                                    if len(current_sentence_chunk) + len(sentence) < 7500:
-                                        current_sentence_chunk += sentence + " "
-                                    else:
-                                        if current_sentence_chunk:
-                                            chunks.append(current_sentence_chunk.strip())
-                                        current_sentence_chunk = sentence + " "
-                                
-                                if current_sentence_chunk:
-                                    chunks.append(current_sentence_chunk.strip())
-                                current_chunk = ""
-                            else:
-                                current_chunk = paragraph + "\n\n"
-                    
-                    # 添加最后一个块
-                    if current_chunk:
-                        chunks.append(current_chunk.strip())
-                else:
-                    # 长度适中的命令条目直接作为一个块
-                    chunks.append(section)
-                    
-        except Exception as e:
-            print(f"处理文件 {filename} 时出错: {e}")
-            continue
+    for file_path in list_knowledge_files():
+        chunks.extend(load_and_chunk_file(file_path))
             
     print(f"成功加载并分块了 {len(chunks)} 个文本片段。")
     return chunks
 
+# 远程嵌入模型（不设超时和冷却，失败时抛出 EmbeddingAPIError 由流水线判断是否重试）
+remote_embedder = DashScopeEmbedder(DASHSCOPE_API_KEY, EMBEDDING_MODEL)
+
 def get_embeddings(texts):
     """
     使用阿里云 text-embedding-v3 模型批量获取文本嵌入向量。
@@ -115,54 +100,220 @@ def get_embeddings(texts):
         else:
             processed_texts.append(text)
         
-    response = TextEmbedding.call(
-        model='text-embedding-v3',
-        input=processed_texts,
-        api_key=DASHSCOPE_API_KEY
-    )
-    
-    if response.status_code == 200:
-        embeddings = [item['embedding'] for item in response.output['embeddings']]
-        return embeddings
-    else:
-        raise Exception(f"嵌入API调用失败: {response.code}, {response.message}")
+    # 超时和重试由嵌入流水线负责
+    return remote_embedder.embed(processed_texts)
+
+def chunk_id(chunk):
+    """
+    根据命令名和内容哈希生成稳定的块ID，例如 tar-3f2a9c0d1b7e4a56。
+    内容不变ID就不变，修改一个条目不会影响其他条目的ID。
+    """
+    match = COMMAND_HEADER_PATTERN.search(chunk)
+    names = parse_command_names(match.group(1)) if match else []
+    command = names[0] if names else "chunk"
+    content_hash = hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:16]
+    return f"{command}-{content_hash}"
+
+def build_chunk_records(chunks_by_file):
+    """
+    将每个文件的文本块转换为带ID和元数据的记录，内容完全相同的块只保留一个。
+    """
+    records = {}
+    for file_path, chunks in chunks_by_file.items():
+        for chunk in chunks:
+            record_id = chunk_id(chunk)
+            if record_id not in records:
+                records[record_id] = {
+                    "id": record_id,
+                    "document": chunk,
+                    "metadata": {"source": os.path.basename(file_path), "command": record_id.rsplit("-", 1)[0]},
+                }
+    return list(records.values())
+
+def file_sha256(file_path):
+    with open(file_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def load_manifest():
+    """
+    读取上一次构建的清单，不存在时返回空清单。
+    """
+    if not os.path.exists(MANIFEST_FILE):
+        return {"embedding_model": None, "files": {}}
+    with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest):
+    with open(MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
 
-def setup_vector_database(chunks):
+def find_changed_files(manifest):
     """
-    初始化ChromaDB，并使用阿里云嵌入模型将文本块存入。
+    对比清单，返回 (当前文件信息, 有变化的文件列表)。
+    修改时间没变的文件直接认为未变化；修改时间变了再比较内容哈希。
+    """
+    current = {}
+    changed = []
+    for file_path in list_knowledge_files():
+        filename = os.path.basename(file_path)
+        mtime = os.path.getmtime(file_path)
+        previous = manifest["files"].get(filename)
+        if previous and previous["mtime"] == mtime:
+            current[filename] = previous
+            continue
+        sha256 = file_sha256(file_path)
+        current[filename] = {"mtime": mtime, "sha256": sha256}
+        if not previous or previous["sha256"] != sha256:
+            changed.append(filename)
+    # 被删除的文件也算变化
+    changed.extend(name for name in manifest["files"] if name not in current)
+    return current, changed
+
+def setup_vector_database(records, rebuild=False):
+    """
+    增量同步ChromaDB：只为新增或修改过的块调用嵌入API，并删除已不存在的块。
+    rebuild=True 时删除整个集合后重新构建（例如更换了嵌入模型）。
+    返回处理失败的块数量。
     """
     client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
+    if rebuild and COLLECTION_NAME in [c.name for c in client.list_collections()]:
+        client.delete_collection(COLLECTION_NAME)
     
     # 创建一个不带嵌入函数的集合，我们将手动提供嵌入
     collection = client.get_or_create_collection(
         name=COLLECTION_NAME,
         metadata={"hnsw:space": "cosine"}
     )
+
+    # 与库中已有的块对比
+    existing_ids = set(collection.get(include=[])["ids"])
+    wanted_ids = {record["id"] for record in records}
+    new_records = [record for record in records if record["id"] not in existing_ids]
+    stale_ids = sorted(existing_ids - wanted_ids)
+    print(f"共 {len(records)} 个块：未变化 {len(records) - len(new_records)}，"
+          f"新增/修改 {len(new_records)}，删除 {len(stale_ids)}")
+
+    if stale_ids:
+        collection.delete(ids=stale_ids)
     
-    # 批量处理文本和嵌入，避免API调用次数过多
-    batch_size = 10
-    for i in range(0, len(chunks), batch_size):
-        batch_chunks = chunks[i:i+batch_size]
-        try:
-            batch_embeddings = get_embeddings(batch_chunks)
-            ids = [f"chunk_{i+j}" for j in range(len(batch_chunks))]
-            collection.add(
-                ids=ids,
-                embeddings=batch_embeddings, # 手动提供嵌入
-                documents=batch_chunks
-            )
-            print(f"已处理 {min(i+batch_size, len(chunks))} / {len(chunks)} 个块")
-        except Exception as e:
-            print(f"处理批次 {i} 时出错: {e}")
-            # 可以选择跳过或中断
-            continue
-    
-    print(f"向量数据库已构建完成！")
+    def write_batch(batch, batch_embeddings):
+        collection.upsert(
+            ids=[record["id"] for record in batch],
+            embeddings=batch_embeddings, # 手动提供嵌入
+            documents=[record["document"] for record in batch],
+            metadatas=[record["metadata"] for record in batch]
+        )
+
+    # 并发批量处理文本和嵌入，失败的块不会写入数据库，下次构建时会重新尝试
+    pipeline = EmbeddingPipeline(
+        get_embeddings,
+        workers=EMBEDDING_WORKERS,
+        max_batch_size=EMBEDDING_MAX_BATCH,
+        max_batch_chars=EMBEDDING_MAX_BATCH_CHARS,
+        requests_per_second=EMBEDDING_REQUESTS_PER_SECOND,
+        max_retries=EMBEDDING_MAX_RETRIES,
+        checkpoint_path=CHECKPOINT_FILE,
+        model=EMBEDDING_MODEL
+    )
+    report = pipeline.run(new_records, write_batch)
+
+    print(f"向量数据库已构建完成！嵌入 {report['embedded']} 个块（{report['batches']} 个批次，"
+          f"检查点恢复 {report['resumed']} 个），耗时 {report['seconds']:.1f} 秒，"
+          f"{report['chunks_per_sec']:.1f} 块/秒")
+    for failed_id, error in report["failed"]:
+        print(f"  ❌ 处理失败: {failed_id}: {error}")
+    return len(report["failed"])
+
+def local_vector_store_current():
+    """
+    本地向量库是否已用当前配置的本地嵌入模型构建。
+    """
+    meta_file = os.path.join(LOCAL_VECTOR_STORE_DIR, "meta.json")
+    if not os.path.exists(meta_file):
+        return False
+    with open(meta_file, "r", encoding="utf-8") as f:
+        return json.load(f).get("model") == LOCAL_EMBEDDER
+
+def build_local_vector_store(records):
+    """
+    用本地嵌入模型为全部文本块生成向量，保存为本地向量库。
+    本地模型的向量空间与远程模型不同，单独保存；本地计算不需要增量构建。
+    """
+    embedder = create_local_embedder(LOCAL_EMBEDDER)
+    start = time.perf_counter()
+    embeddings = embedder.embed([record["document"] for record in records])
+    save_vector_store(
+        LOCAL_VECTOR_STORE_DIR,
+        [record["id"] for record in records],
+        [record["document"] for record in records],
+        embeddings,
+        VECTOR_STORE_DTYPE,
+        model=LOCAL_EMBEDDER
+    )
+    print(f"本地向量库已构建：{len(records)} 个向量（{LOCAL_EMBEDDER}），耗时 {time.perf_counter() - start:.1f} 秒")
+
+def write_snapshot(directory, command_index):
+    """
+    把检索所需的全部文件写入快照目录（见 snapshot.py）。
+    """
+    os.makedirs(directory, exist_ok=True)
+    shutil.copytree(VECTOR_STORE_DIR, os.path.join(directory, "vector_store"))
+    shutil.copytree(BM25_INDEX_DIR, os.path.join(directory, "bm25_index"))
+    if LOCAL_EMBEDDER and os.path.exists(os.path.join(LOCAL_VECTOR_STORE_DIR, "meta.json")):
+        shutil.copytree(LOCAL_VECTOR_STORE_DIR, os.path.join(directory, "vector_store_local"))
+    command_index.save_mapped(os.path.join(directory, "command_index"))
+    shutil.copyfile(GATING_MODEL_FILE, os.path.join(directory, "gating_model.npz"))
+
+def touch_build_stamp():
+    """
+    更新构建标记文件，通知正在运行的app.py重新加载数据库。
+    """
+    with open(BUILD_STAMP_FILE, "w", encoding="utf-8") as f:
+        f.write(str(time.time()))
 
 if __name__ == "__main__":
-    document_chunks = load_and_chunk_documents()
+    manifest = load_manifest()
+    current_files, changed_files = find_changed_files(manifest)
+    model_changed = manifest["embedding_model"] not in (None, EMBEDDING_MODEL)
+    if (not changed_files and not model_changed and os.path.exists(COMMAND_INDEX_FILE)
+            and os.path.exists(os.path.join(BM25_INDEX_DIR, "meta.json"))
+            and os.path.exists(os.path.join(VECTOR_STORE_DIR, "meta.json"))
+            and read_current(SNAPSHOT_DIR) is not None
+            and (not LOCAL_EMBEDDER or local_vector_store_current())):
+        print("✅ 知识库没有变化，无需重新构建。")
+        raise SystemExit(0)
+    if changed_files:
+        print(f"有变化的文件: {', '.join(changed_files)}")
+
+    chunks_by_file = {file_path: load_and_chunk_file(file_path) for file_path in list_knowledge_files()}
+    document_chunks = [chunk for chunks in chunks_by_file.values() for chunk in chunks]
+    print(f"成功加载并分块了 {len(document_chunks)} 个文本片段。")
     if document_chunks:
-        setup_vector_database(document_chunks)
+        records = build_chunk_records(chunks_by_file)
+        failed = setup_vector_database(records, rebuild=model_changed)
+        # 全部成功时才更新清单，否则下次构建仍会重新检查这些文件
+        if failed == 0:
+            save_manifest({"embedding_model": EMBEDDING_MODEL, "files": current_files})
+        else:
+            print(f"⚠️ 有 {failed} 个块处理失败，请重新运行本程序补齐。")
+        # 用同一批文本块生成命令名索引，供app.py直接查找
+        command_index = CommandIndex.from_chunks(document_chunks)
+        command_index.save(COMMAND_INDEX_FILE)
+        # 用同一份索引训练本地检索判断模型
+        train_gating_model(command_index, GATING_MODEL_FILE)
+        # 关键词检索索引，与向量检索一起做混合检索
+        bm25_index = BM25Index.build([record["id"] for record in records], [record["document"] for record in records])
+        bm25_index.save(BM25_INDEX_DIR)
+        print(f"关键词检索索引已保存：{len(bm25_index.vocab)} 个词")
+        # 把集合中的向量导出为连续矩阵，供 numpy 检索后端内存映射加载
+        exported = export_chroma_collection(CHROMA_DB_DIR, COLLECTION_NAME, VECTOR_STORE_DIR, VECTOR_STORE_DTYPE)
+        print(f"向量库已导出：{exported} 个向量（{VECTOR_STORE_DTYPE}）")
+        if LOCAL_EMBEDDER:
+            build_local_vector_store(records)
+        # 发布只读快照：正在运行的服务在下一次查询时切换到新版本
+        version = publish_snapshot(SNAPSHOT_DIR, lambda directory: write_snapshot(directory, command_index), SNAPSHOT_KEEP)
+        print(f"快照已发布：{version}")
+        touch_build_stamp()
         print("✅ 向量数据库构建成功！")
     else:
         print("⚠️ 没有找到任何文本块，请检查 knowledge_base 文件夹。")
\ No newline at end of file
@@ -0,0 +1,148 @@
+# chunker.py
+# 知识库文本切分：针对 "-----" 分隔、【命令】开头的条目格式，逐行读取、线性时间切分
+import io
+import os
+import re
+
+MAX_CHUNK_CHARS = 7500 # 单个块的最大字符数（为嵌入接口的8192字符上限留出余量）
+MIN_SENTENCE_CHARS = 100 # 句子级切分时，句子至少达到该长度才在句末标点处切开
+READ_BLOCK_CHARS = 1 << 20 # 流式读取时每次读入的字符数
+
+# 条目分隔行，例如 "-----------------------------------------------------------------"
+# 以换行开头的字面前缀让正则引擎可以快速跳过普通文本
+SEPARATOR_PATTERN = re.compile(r"\n-{20,}[ \t]*(?=\n)")
+# 至少包含一行非注释内容（只由 # 注释行组成的部分，如文件开头的说明框，会被跳过）
+CONTENT_LINE_PATTERN = re.compile(r"^[ \t]*[^#\s]", re.MULTILINE)
+# 条目中的字段标题，例如 【命令】【说明】【常见用法】【注意事项】【其他】
+FIELD_PATTERN = re.compile(r"【([^】\n]{1,10})】")
+PARAGRAPH_PATTERN = re.compile(r"\n\s*\n")
+SENTENCE_END_PATTERN = re.compile(r"[.!?。！？]")
+
+# 用本模块直接处理的纯文本格式，其他格式交给 unstructured 解析
+TEXT_EXTENSIONS = {".txt", ".md"}
+
+
+def iter_sections(stream, block_chars=READ_BLOCK_CHARS):
+    """
+    分块流式读取文本，按分隔行产出条目文本（已去除首尾空白）。
+    每次只用正则切分已读入的完整行，未读完的最后一行留到下一块再处理。
+    """
+    carry = "\n" # 保证文件第一行是分隔行时也能匹配
+    while True:
+        block = stream.read(block_chars)
+        if not block:
+            break
+        buffer = carry + block
+        last_newline = buffer.rfind("\n")
+        if last_newline < 0:
+            carry = buffer
+            continue
+        pieces = SEPARATOR_PATTERN.split(buffer[:last_newline + 1])
+        carry = pieces.pop() + buffer[last_newline + 1:]
+        for piece in pieces:
+            section = _clean_section(piece)
+            if section:
+                yield section
+
+    section = _clean_section(carry)
+    if section:
+        yield section
+
+
+def _clean_section(text):
+    """去除首尾空白；跳过纯注释部分和没有任何内容的空模板"""
+    section = text.strip()
+    if not section or not CONTENT_LINE_PATTERN.search(section):
+        return ""
+    # 空模板一定很短，只检查短条目
+    if len(section) < 200 and not FIELD_PATTERN.sub("", section).strip():
+        return ""
+    return section
+
+
+def parse_fields(section):
+    """
+    解析条目中的结构化字段，返回 {字段名: 内容}。
+    例如 {"命令": "tar", "说明": "打包备份...", "常见用法": "1. -z ...", "注意事项": "...", "其他": ""}
+    """
+    fields = {}
+    matches = list(FIELD_PATTERN.finditer(section))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(section)
+        name = match.group(1)
+        content = section[match.end():end].strip()
+        # 同名字段（如一个块里包含多个命令）保留第一次出现的内容
+        if name not in fields:
+            fields[name] = content
+    return fields
+
+
+def split_sentences(paragraph, min_chars=MIN_SENTENCE_CHARS):
+    """按句末标点切分句子，句子不足 min_chars 时继续向后合并"""
+    sentences = []
+    start = 0
+    for match in SENTENCE_END_PATTERN.finditer(paragraph):
+        if match.end() - start > min_chars:
+            sentences.append(paragraph[start:match.end()].strip())
+            start = match.end()
+    if start < len(paragraph):
+        sentences.append(paragraph[start:].strip())
+    return [sentence for sentence in sentences if sentence]
+
+
+def _pack(pieces, separator, max_chars):
+    """把片段依次合并成不超过 max_chars 的块"""
+    chunks, current, length = [], [], 0
+    for piece in pieces:
+        if current and length + len(piece) >= max_chars:
+            chunks.append(separator.join(current).strip())
+            current, length = [], 0
+        current.append(piece)
+        length += len(piece) + len(separator)
+    if current:
+        chunks.append(separator.join(current).strip())
+    return chunks
+
+
+def split_long_section(section, max_chars=MAX_CHUNK_CHARS):
+    """
+    条目过长时先按段落合并成块；单个段落仍然过长时再按句子切分。
+    """
+    if len(section) <= max_chars:
+        return [section]
+
+    chunks, paragraphs = [], []
+    for paragraph in PARAGRAPH_PATTERN.split(section):
+        if len(paragraph) > max_chars:
+            chunks.extend(_pack(paragraphs, "\n\n", max_chars))
+            paragraphs = []
+            chunks.extend(_pack(split_sentences(paragraph), " ", max_chars))
+        else:
+            paragraphs.append(paragraph)
+    chunks.extend(_pack(paragraphs, "\n\n", max_chars))
+    return [chunk for chunk in chunks if chunk]
+
+
+def chunk_stream(stream, max_chars=MAX_CHUNK_CHARS):
+    """把文本流切分成块"""
+    chunks = []
+    for section in iter_sections(stream):
+        chunks.extend(split_long_section(section, max_chars))
+    return chunks
+
+
+def chunk_file(file_path, max_chars=MAX_CHUNK_CHARS):
+    """
+    切分单个知识库文件。
+    纯文本文件分块流式读取；其他格式（pdf、docx等）先用 unstructured 提取文本。
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in TEXT_EXTENSIONS:
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            return chunk_stream(f, max_chars)
+
+    # unstructured 导入很慢，只在需要时导入
+    from unstructured.partition.auto import partition
+    elements = partition(filename=file_path)
+    text = "\n".join(str(el) for el in elements)
+    return chunk_stream(io.StringIO(text), max_chars)
@@ -0,0 +1,249 @@
+# cli.py
+# 命令行入口：不启动Web界面，直接回答单个问题，或批量回答问题列表（FAQ预生成、回归测试）
+# 用法：
+#   python cli.py "tar 怎么解压"                              # 回答单个问题
+#   python cli.py --input questions.jsonl --output answers.jsonl  # 批量回答，中断后重新运行会跳过已完成的问题
+#   cat questions.txt | python cli.py --output answers.jsonl      # 从标准输入读取问题
+# 输入每行为一个问题：纯文本，或者 JSON（字段 question，可选 id）；输出每行一个 JSON 结果
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import time
+
+import app
+from embedders import DashScopeEmbedder
+from gating import classify_question
+
+EMBEDDING_BATCH_SIZE = 10 # 每次嵌入请求的问题数（text-embedding-v3 每次最多10条）
+EMBEDDING_BATCH_TIMEOUT = 30 # 每批嵌入请求的超时（秒）；批量嵌入不进入冷却期，不影响回答时的远程嵌入
+DEFAULT_PARALLEL = 8 # 同时生成回答的问题数
+
+
+def question_id(question):
+    """没有指定 id 时，用问题内容的哈希作为 id（输入文件调整顺序后仍能正确续传）"""
+    return hashlib.sha1(question.encode("utf-8")).hexdigest()[:12]
+
+
+def read_questions(stream):
+    """读取问题列表，返回 [{"id": ..., "question": ...}]，跳过空行和重复的 id"""
+    items, seen = [], set()
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        item = None
+        if line.startswith("{"):
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                pass
+        if isinstance(item, dict) and item.get("question"):
+            question, item_id = str(item["question"]).strip(), str(item.get("id") or "")
+        else:
+            question, item_id = line, ""
+        item_id = item_id or question_id(question)
+        if item_id in seen:
+            continue
+        seen.add(item_id)
+        items.append({"id": item_id, "question": question})
+    return items
+
+
+def load_done_ids(output_path):
+    """读取输出文件中已经成功回答的问题 id（出错的问题会重新回答）"""
+    done = set()
+    if not output_path or output_path == "-" or not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断时最后一行可能不完整
+                continue
+            if not result.get("error"):
+                done.add(result["id"])
+    return done
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def needs_embedding(question):
+    """
+    回答时可能走向量检索的问题才需要预先嵌入：
+    直接提到命令名的问题走命令名索引，判断为无需检索的问题不检索，都不会用到问题向量。
+    """
+    judge_response, _ = classify_question(question)
+    return judge_response is not False and not app.get_command_index().find_commands(question)
+
+
+async def embed_in_batches(questions):
+    """
+    批量获取问题向量并写入向量缓存：每次嵌入请求包含 EMBEDDING_BATCH_SIZE 个问题，
+    之后检索和回答缓存直接命中向量缓存，不再逐个调用嵌入API。返回嵌入的问题数。
+    批量请求使用单独的远程嵌入（超时为 EMBEDDING_BATCH_TIMEOUT，没有冷却期），
+    一批较慢或失败不会让回答阶段的检索进入冷却、改用本地模型。
+    """
+    if app.EMBEDDING_BACKEND == "local":
+        # 本地模型不经过向量缓存，回答时直接计算
+        return 0
+    questions = [question for question in dict.fromkeys(questions)
+                 if needs_embedding(question) and app.embedding_cache.get(question) is None]
+    embedder = DashScopeEmbedder(app.DASHSCOPE_API_KEY, app.EMBEDDING_MODEL, timeout=EMBEDDING_BATCH_TIMEOUT,
+                                 async_client=app.async_client)
+    for i in range(0, len(questions), EMBEDDING_BATCH_SIZE):
+        batch = questions[i:i + EMBEDDING_BATCH_SIZE]
+        try:
+            embeddings = await embedder.embed_async(batch)
+        except Exception as e:
+            # 嵌入失败不影响回答：需要向量的问题在回答时会再单独请求
+            print(f"批量嵌入失败（{len(batch)} 个问题）: {e}")
+            continue
+        for question, embedding in zip(batch, embeddings):
+            app.embedding_cache.put(question, embedding)
+    return len(questions)
+
+
+async def answer_one(item, semaphore):
+    """回答一个问题，返回结果（包含各阶段耗时）"""
+    async with semaphore:
+        start = time.perf_counter()
+        result = {"id": item["id"], "question": item["question"]}
+        try:
+            with app.tracer.trace("answer"):
+                final_prompt, cached_answer, cache_key = await app.prepare_answer_async(item["question"])
+                prepared = time.perf_counter()
+                if cached_answer is not None:
+                    answer = cached_answer
+                else:
+                    with app.tracer.span("generate"):
+                        answer = await app.call_qwen_api_async(final_prompt)
+                    app.store_answer(cache_key, answer)
+            end = time.perf_counter()
+            result.update({
+                "answer": answer,
+                "cached": cached_answer is not None,
+                "timings": {
+                    "prepare_ms": round((prepared - start) * 1000, 1), # 检索判断、检索、组装提示词
+                    "generate_ms": round((end - prepared) * 1000, 1),
+                    "total_ms": round((end - start) * 1000, 1),
+                },
+            })
+            if answer.startswith("❌"):
+                result["error"] = answer
+        except Exception as e:
+            result.update({"answer": "", "error": str(e),
+                           "timings": {"total_ms": round((time.perf_counter() - start) * 1000, 1)}})
+        return result
+
+
+async def run_batch(items, output, parallel):
+    """并发回答全部问题，每完成一个就写出一行结果，返回汇总信息"""
+    start = time.perf_counter()
+    embedded = await embed_in_batches([item["question"] for item in items])
+    embed_ms = (time.perf_counter() - start) * 1000
+
+    semaphore = asyncio.Semaphore(parallel)
+    results = []
+    try:
+        for future in asyncio.as_completed([answer_one(item, semaphore) for item in items]):
+            result = await future
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            results.append(result)
+            print(f"已完成 {len(results)} / {len(items)}" + (f"（出错: {result['error']}）" if result.get("error") else ""))
+    finally:
+        await app.async_client.close()
+
+    return {
+        "answered": len(results),
+        "errors": sum(1 for result in results if result.get("error")),
+        "cached": sum(1 for result in results if result.get("cached")),
+        "embedded": embedded,
+        "embed_ms": embed_ms,
+        "seconds": time.perf_counter() - start,
+        "stages": {
+            stage: [result["timings"][stage] for result in results if stage in result["timings"]]
+            for stage in ("prepare_ms", "generate_ms", "total_ms")
+        },
+    }
+
+
+def print_summary(summary, skipped):
+    print(f"\n完成 {summary['answered']} 个问题（跳过已完成 {skipped}，出错 {summary['errors']}，"
+          f"命中回答缓存 {summary['cached']}），耗时 {summary['seconds']:.1f} 秒")
+    print(f"批量嵌入 {summary['embedded']} 个问题，{summary['embed_ms']:.0f} ms")
+    for stage, values in summary["stages"].items():
+        if values:
+            print(f"{stage:<12} p50 {percentile(values, 0.5):8.0f} ms  p95 {percentile(values, 0.95):8.0f} ms  "
+                  f"最大 {max(values):8.0f} ms")
+    print("\n各阶段耗时：")
+    print(app.tracer.format_table())
+
+
+async def answer_questions(questions, output):
+    """直接回答命令行中给出的问题，流式输出"""
+    try:
+        for question in questions:
+            printed = ""
+            async for partial_answer in app.get_answer_stream_async(question):
+                output.write(partial_answer[len(printed):])
+                output.flush()
+                printed = partial_answer
+            output.write("\n")
+    finally:
+        await app.async_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Linux命令小助手命令行：回答单个问题或批量回答问题列表")
+    parser.add_argument("questions", nargs="*", help="直接回答的问题（不指定时进入批量模式）")
+    parser.add_argument("--input", help="问题文件（每行一个问题，纯文本或JSON），不指定时从标准输入读取")
+    parser.add_argument("--output", default="-", help="结果文件（JSONL），默认输出到标准输出")
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL, help="同时生成回答的问题数")
+    parser.add_argument("--no-resume", action="store_true", help="不跳过输出文件中已完成的问题，重新回答全部问题")
+    args = parser.parse_args()
+
+    if args.questions:
+        # 运行日志输出到标准错误，标准输出只留给回答
+        output = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            asyncio.run(answer_questions(args.questions, output))
+        return
+
+    if args.input:
+        with open(args.input, "r", encoding="utf-8") as f:
+            items = read_questions(f)
+    else:
+        items = read_questions(sys.stdin)
+
+    done = set() if args.no_resume else load_done_ids(args.output)
+    pending = [item for item in items if item["id"] not in done]
+
+    if args.output == "-":
+        output = sys.stdout
+    else:
+        output = open(args.output, "w" if args.no_resume else "a", encoding="utf-8")
+    try:
+        # 运行日志输出到标准错误，标准输出只留给结果
+        with contextlib.redirect_stdout(sys.stderr):
+            print(f"共 {len(items)} 个问题，已完成 {len(items) - len(pending)}，待回答 {len(pending)}")
+            if pending:
+                # 批量模式不逐个打印请求的阶段耗时，结束时输出汇总表
+                app.tracer.log_traces = False
+                summary = asyncio.run(run_batch(pending, output, max(1, args.parallel)))
+                print_summary(summary, len(items) - len(pending))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
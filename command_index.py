@@ -0,0 +1,228 @@
+# command_index.py
+# 命令名 -> 知识库条目 的精确索引，问题中直接提到命令时无需嵌入和向量检索
+import json
+import os
+import re
+from collections.abc import Mapping
+
+import numpy as np
+
+# 知识库中每个命令条目的标题，例如：【命令】reboot、halt、poweroff
+COMMAND_HEADER_PATTERN = re.compile(r"【命令】([^\n【]*)")
+# 合法的命令名：小写字母开头，可包含数字、下划线和连字符（如 mii-tool、dos2unix）
+COMMAND_NAME_PATTERN = re.compile(r"^[a-z][a-z0-9_-]*$")
+# 从问题中提取候选命令名；前面紧跟连字符的（如 -w、--help）是参数而不是命令；
+# 带连字符的词整体作为一个词（如 mii-tool），不拆开，避免 e-mail 被当成 mail
+QUESTION_TOKEN_PATTERN = re.compile(r"(?<![a-z0-9_-])[a-z][a-z0-9_-]*")
+# 同时是常见英文单词的命令名：出现在英文句子中时（如 "how do I find which process uses port 80"）不一定是在问这个命令
+COMMON_WORD_NAMES = frozenset({
+    "alias", "cat", "cut", "date", "dig", "echo", "exit", "export", "file", "find", "free", "halt", "head",
+    "help", "history", "host", "id", "info", "join", "kill", "last", "less", "locate", "mail", "man", "more",
+    "nice", "paste", "ping", "read", "sort", "source", "split", "tail", "test", "time", "top", "touch",
+    "type", "users", "w", "watch", "which", "who", "write", "yes",
+})
+# 命令名后面紧跟"命令"等关键词或参数（如 find -name、sort 命令、the top command）
+COMMAND_AFTER_PATTERN = re.compile(r"\s*(?:命令|指令|用法|语法|参数|command\b)|\s+--?[a-z0-9]")
+# 命令名前面是"命令"、"指令"（如 命令：which）
+COMMAND_BEFORE_PATTERN = re.compile(r"(?:命令|指令)[\s:：]*$")
+
+
+def parse_command_names(header):
+    """
+    解析命令标题中的命令名。
+    "reboot、halt、poweroff" -> ["reboot", "halt", "poweroff"]
+    "chkconfig 、管理开机服务" -> ["chkconfig"]
+    """
+    names = []
+    for part in re.split(r"[、,，/]", header):
+        name = part.strip().lower()
+        if COMMAND_NAME_PATTERN.match(name):
+            names.append(name)
+    return names
+
+
+def has_command_evidence(text, start, end):
+    """
+    text[start:end] 这个词确实是命令名的证据（text 已转成小写）：
+    后面紧跟"命令"等关键词或参数、前面是"命令"或"指令"、在反引号中，
+    或者前后都不是英文单词（中文问题中的英文词，如"用 find 查找文件"、"ls | sort"）。
+    """
+    if COMMAND_AFTER_PATTERN.match(text, end) or COMMAND_BEFORE_PATTERN.search(text, 0, start):
+        return True
+    if text.count("`", 0, start) % 2 == 1:
+        return True
+    before, after = text[:start].rstrip(), text[end:].lstrip()
+    return not (before and before[-1].isascii() and before[-1].isalnum()) and \
+        not (after and after[0].isascii() and after[0].isalnum())
+
+
+class CommandMatcher:
+    """
+    预编译的命令名匹配器：命令名存放在 frozenset 中，问题只需分词一次，
+    每个词做一次集合查找，不再对命令列表做线性扫描。
+    """
+
+    def __init__(self, names):
+        self.names = frozenset(names)
+
+    @classmethod
+    def from_knowledge_base(cls, knowledge_base_dir):
+        """从知识库文件的【命令】标题中读取命令名，保证与知识库内容一致"""
+        names = set()
+        for filename in sorted(os.listdir(knowledge_base_dir)):
+            file_path = os.path.join(knowledge_base_dir, filename)
+            if not os.path.isfile(file_path) or not filename.endswith(".txt"):
+                continue
+            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+                for line in f:
+                    match = COMMAND_HEADER_PATTERN.search(line)
+                    if match:
+                        names.update(parse_command_names(match.group(1)))
+        return cls(names)
+
+    def match(self, question):
+        """
+        按出现顺序返回 (命令名, 仅被提及的命令名)，均去重。
+        带连字符的词只整体匹配（如 mii-tool），e-mail、tar-xzvf 这样本身不是命令名的词不匹配。
+        同时是常见英文单词的命令名（见 COMMON_WORD_NAMES）要有证据（见 has_command_evidence）才算命令名，
+        否则只算被提及：如 "what is the best way to read a file" 中的 read 和 file，不能据此直接取命令条目。
+        """
+        text = question.lower()
+        commands, mentions = [], []
+        for token_match in QUESTION_TOKEN_PATTERN.finditer(text):
+            name = token_match.group()
+            if name not in self.names:
+                continue
+            explicit = has_command_evidence(text, *token_match.span())
+            found = commands if explicit or name not in COMMON_WORD_NAMES else mentions
+            if name not in found:
+                found.append(name)
+        return commands, [name for name in mentions if name not in commands]
+
+    def find(self, question):
+        """按出现顺序返回问题中确实在问的命令名（去重，见 match）"""
+        return self.match(question)[0]
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+
+class MappedSections(Mapping):
+    """
+    内存映射的 {命令名: [条目文本]}：全部条目文本以UTF-8拼接存放在一个数组中，查找时才解码，
+    多个进程共享同一份页缓存。与普通字典的只读接口相同。
+    """
+
+    def __init__(self, commands, data, offsets):
+        self.commands = commands
+        self.data = data
+        self.offsets = offsets
+
+    def section(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def __getitem__(self, name):
+        return [self.section(i) for i in self.commands[name]]
+
+    def __iter__(self):
+        return iter(self.commands)
+
+    def __len__(self):
+        return len(self.commands)
+
+
+class CommandIndex:
+    """
+    命令名到知识库条目文本的精确索引。
+    一个命令名可能对应多个条目（例如 help 同时出现在普通命令和内置命令中）。
+    """
+
+    def __init__(self, sections=None):
+        self.sections = sections or {}
+        self.matcher = CommandMatcher(self.sections)
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """
+        从文本块构建索引（与写入向量数据库的文本块相同）。
+        一个文本块中如果包含多个命令标题，按标题切分成多个条目。
+        """
+        sections = {}
+        for chunk in chunks:
+            headers = list(COMMAND_HEADER_PATTERN.finditer(chunk))
+            for i, header in enumerate(headers):
+                end = headers[i + 1].start() if i + 1 < len(headers) else len(chunk)
+                section = chunk[header.start():end].strip()
+                for name in parse_command_names(header.group(1)):
+                    entries = sections.setdefault(name, [])
+                    if section not in entries:
+                        entries.append(section)
+        return cls(sections)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f)["commands"])
+
+    def save(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"commands": self.sections}, f, ensure_ascii=False)
+
+    def save_mapped(self, directory):
+        """
+        保存为可内存映射的格式（见 MappedSections）：
+        sections.npy 为拼接后的条目文本，offsets.npy 为每个条目的起止位置，commands.json 为命令名到条目编号的映射
+        """
+        os.makedirs(directory, exist_ok=True)
+        positions, encoded = {}, []
+        commands = {}
+        for name, entries in self.sections.items():
+            ids = []
+            for section in entries:
+                if section not in positions:
+                    positions[section] = len(encoded)
+                    encoded.append(section.encode("utf-8"))
+                ids.append(positions[section])
+            commands[name] = ids
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(data) for data in encoded])
+        np.save(os.path.join(directory, "sections.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        np.save(os.path.join(directory, "offsets.npy"), offsets)
+        with open(os.path.join(directory, "commands.json"), "w", encoding="utf-8") as f:
+            json.dump({"commands": commands}, f, ensure_ascii=False)
+
+    @classmethod
+    def load_mapped(cls, directory):
+        with open(os.path.join(directory, "commands.json"), "r", encoding="utf-8") as f:
+            commands = json.load(f)["commands"]
+        data = np.load(os.path.join(directory, "sections.npy"), mmap_mode="r")
+        offsets = np.load(os.path.join(directory, "offsets.npy"))
+        return cls(MappedSections(commands, data, offsets))
+
+    def names(self):
+        return set(self.sections)
+
+    def find_commands(self, question):
+        """按出现顺序返回问题中确实在问的、且在索引中存在的命令名"""
+        return self.matcher.find(question)
+
+    def match_commands(self, question):
+        """返回 (命令名, 仅被提及的命令名)，见 CommandMatcher.match"""
+        return self.matcher.match(question)
+
+    def lookup(self, names, limit=None):
+        """返回命令名对应的条目文本（去重，最多 limit 条）"""
+        results = []
+        for name in names:
+            for section in self.sections.get(name, []):
+                if section not in results:
+                    results.append(section)
+        return results[:limit] if limit else results
+
+    def __len__(self):
+        return len(self.sections)
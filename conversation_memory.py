@@ -0,0 +1,183 @@
+# conversation_memory.py
+# 对话记忆：按token预算裁剪历史对话
+# 最近几轮原样保留，更早的对话由后台线程滚动压缩成摘要，摘要按会话缓存，不在请求路径上等待
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+CJK_PATTERN = re.compile(r"[一-鿿　-〿＀-￯]")
+
+SUMMARY_PROMPT = """请把下面的Linux命令学习对话压缩成一段简洁的摘要，供后续对话参考。
+要求：
+1. 保留用户提出的要求和偏好（如回答语言、格式、详细程度）
+2. 保留讨论过的命令、参数、文件路径和结论
+3. 省略寒暄和重复的解释，不超过{max_chars}字
+
+【已有摘要】
+{summary}
+
+【新增对话】
+{turns}
+
+请直接输出更新后的摘要："""
+
+
+def estimate_tokens(text):
+    """粗略估计token数：中文字符按1个token计，其他字符按4个字符1个token计"""
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    """把文本截断到大约 max_tokens 个token以内"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + "……（已截断）"
+
+
+def format_turns(turns):
+    return "\n\n".join(f"用户：{user_msg}\nAI：{ai_msg}" for user_msg, ai_msg in turns)
+
+
+def turns_digest(turns):
+    """对话内容的哈希，用于判断缓存的摘要覆盖的是否就是这些对话"""
+    digest = hashlib.sha1()
+    for user_msg, ai_msg in turns:
+        digest.update(user_msg.encode("utf-8") + b"\0" + ai_msg.encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+class ConversationMemory:
+    """
+    带token预算的对话记忆。
+    - 最近 keep_turns 轮原样保留（超出预算时从较早的一轮开始舍弃，最新一轮过长时截断回答）
+    - 更早的对话交给 summarize_func 在后台滚动压缩成摘要：新摘要 = 已有摘要 + 新滑出窗口的对话
+    - 摘要按会话缓存（记录覆盖的轮数和内容哈希），每轮对话不重复生成；会话数超过上限时淘汰最久未用的
+    - 摘要还没生成好时，用已有的旧摘要加上预算内能放下的较早对话，不等待摘要
+    """
+
+    def __init__(self, summarize_func, keep_turns=3, token_budget=1500, summary_max_tokens=300,
+                 max_sessions=1024, workers=2):
+        self.summarize_func = summarize_func
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.summary_max_tokens = summary_max_tokens
+        self.max_sessions = max_sessions
+
+        self._sessions = OrderedDict() # 会话ID -> (覆盖的轮数, 对话哈希, 摘要)
+        self._pending = {} # 正在生成摘要的会话 -> 生成期间收到的最新一次请求（没有时为None）
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="history-summary")
+
+        self.stats = {"summary_hits": 0, "summary_misses": 0, "summaries": 0, "summary_failures": 0}
+
+    @staticmethod
+    def session_key(session_id, history_tuples):
+        """没有会话ID时（如命令行调用），用第一轮对话的内容区分会话"""
+        if session_id:
+            return session_id
+        return "turns:" + turns_digest(history_tuples[:1])
+
+    def _cached_summary(self, key, older):
+        """返回缓存中与当前对话一致的 (覆盖的轮数, 摘要)，没有时返回 (0, "")"""
+        with self._lock:
+            state = self._sessions.get(key)
+            if state is None:
+                return 0, ""
+            self._sessions.move_to_end(key)
+        covered, digest, summary = state
+        if covered <= len(older) and turns_digest(older[:covered]) == digest:
+            return covered, summary
+        # 历史对话被修改过（如界面上清空后重新开始），缓存的摘要作废
+        return 0, ""
+
+    def build(self, history_tuples, session_id=None):
+        """
+        返回 (摘要, 原样保留的最近几轮对话)，两者合计不超过 token_budget。
+        """
+        if not history_tuples:
+            return "", []
+
+        key = self.session_key(session_id, history_tuples)
+        split = max(0, len(history_tuples) - self.keep_turns)
+        older, recent = history_tuples[:split], history_tuples[split:]
+
+        summary, covered = "", 0
+        if older:
+            covered, summary = self._cached_summary(key, older)
+            if covered == len(older):
+                self.stats["summary_hits"] += 1
+            else:
+                self.stats["summary_misses"] += 1
+                self._schedule(key, older)
+
+        budget = self.token_budget - estimate_tokens(summary)
+        # 摘要尚未覆盖的较早对话排在最近几轮之前，预算内尽量保留
+        candidates = older[covered:] + recent
+        kept = []
+        for user_msg, ai_msg in reversed(candidates):
+            cost = estimate_tokens(user_msg) + estimate_tokens(ai_msg)
+            if cost <= budget:
+                kept.append((user_msg, ai_msg))
+                budget -= cost
+            elif not kept:
+                # 最新一轮本身就超出预算时截断回答，至少保留用户的上一个问题
+                kept.append((user_msg, truncate_to_tokens(ai_msg, max(0, budget - estimate_tokens(user_msg)))))
+                break
+            else:
+                break
+        kept.reverse()
+        return summary, kept
+
+    def _schedule(self, key, older):
+        """同一会话同时只生成一个摘要；生成期间又有新请求时，完成后再用最新的对话补一次"""
+        with self._lock:
+            if key in self._pending:
+                self._pending[key] = list(older)
+                return
+            self._pending[key] = None
+        self._executor.submit(self._update_summary, key, list(older))
+
+    def _update_summary(self, key, older):
+        """在后台线程中把 older 中尚未摘要的对话并入摘要"""
+        try:
+            covered, summary = self._cached_summary(key, older)
+            new_turns = older[covered:]
+            if not new_turns:
+                return
+            prompt = SUMMARY_PROMPT.format(
+                max_chars=self.summary_max_tokens,
+                summary=summary or "（无）",
+                turns=format_turns(new_turns)
+            )
+            summary = truncate_to_tokens(self.summarize_func(prompt).strip(), self.summary_max_tokens)
+            with self._lock:
+                self._sessions[key] = (len(older), turns_digest(older), summary)
+                self._sessions.move_to_end(key)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self.stats["summaries"] += 1
+        except Exception as e:
+            # 摘要失败不影响回答，下一轮对话时会重试
+            self.stats["summary_failures"] += 1
+            print(f"生成对话摘要时出错: {e}")
+        finally:
+            with self._lock:
+                latest = self._pending.pop(key, None)
+            if latest is not None and len(latest) > len(older):
+                self._schedule(key, latest)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["sessions"] = len(self._sessions)
+        return stats
@@ -0,0 +1,181 @@
+# dashscope_async.py
+# 异步 DashScope 客户端：连接池复用、按模型限制并发、超时与指数退避重试
+import asyncio
+import json
+import random
+
+import aiohttp
+
+GENERATION_PATH = "/services/aigc/text-generation/generation"
+EMBEDDING_PATH = "/services/embeddings/text-embedding/text-embedding"
+
+# 这些状态码视为临时错误，可以重试
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class DashScopeAPIError(Exception):
+    """DashScope 接口返回错误"""
+
+    def __init__(self, status, code, message):
+        super().__init__(f"{code}, {message}")
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+class AsyncDashScopeClient:
+    """
+    基于 aiohttp 的异步 DashScope 客户端。
+    - 所有请求共享一个带连接池的 ClientSession（保持长连接）
+    - 每个模型一个信号量，限制同时发往该模型的请求数
+    - 请求超时或临时错误后按指数退避（带随机抖动）重试，退避等待期间不占用并发名额；流式请求只在收到数据前重试
+    """
+
+    def __init__(self, api_key, base_url, concurrency_limits=None, default_concurrency=8,
+                 max_connections=100, request_timeout=60, max_retries=3, backoff_base=0.5):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.concurrency_limits = concurrency_limits or {}
+        self.default_concurrency = default_concurrency
+        self.max_connections = max_connections
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+
+        self._session = None
+        self._session_loop = None
+        self._semaphores = {}
+
+    # ============ 连接与限流 ============
+    def _get_session(self):
+        """返回当前事件循环上的共享会话（不存在或已关闭时创建）"""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                }
+            )
+            self._session_loop = loop
+            self._semaphores = {}
+        return self._session
+
+    def _get_semaphore(self, model):
+        if model not in self._semaphores:
+            limit = self.concurrency_limits.get(model, self.default_concurrency)
+            self._semaphores[model] = asyncio.Semaphore(limit)
+        return self._semaphores[model]
+
+    async def _backoff(self, attempt):
+        delay = self.backoff_base * (2 ** attempt)
+        await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+    @staticmethod
+    async def _error_from_response(response):
+        """根据错误响应构造异常；代理返回的 HTML 等非JSON响应体以原文作为错误信息"""
+        text = await response.text(errors="replace")
+        try:
+            body = json.loads(text)
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            return DashScopeAPIError(response.status, f"HTTP{response.status}", text.strip()[:200])
+        return DashScopeAPIError(response.status, body.get("code"), body.get("message"))
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    # ============ 基础请求 ============
+    async def _post_json(self, path, payload, model):
+        """发送普通请求，返回解析后的JSON；临时错误自动重试"""
+        session = self._get_session()
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+        for attempt in range(self.max_retries + 1):
+            try:
+                # 只在请求期间占用并发名额
+                async with self._get_semaphore(model):
+                    async with session.post(self.base_url + path, json=payload, timeout=timeout) as response:
+                        if response.status == 200:
+                            return await response.json(content_type=None)
+                        error = await self._error_from_response(response)
+                if error.status not in RETRYABLE_STATUS or attempt == self.max_retries:
+                    raise error
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise DashScopeAPIError(None, type(e).__name__, str(e) or "请求超时") from e
+            await self._backoff(attempt)
+
+    # ============ 对外接口 ============
+    async def embed(self, texts, model="text-embedding-v3"):
+        """批量获取文本嵌入向量"""
+        body = await self._post_json(EMBEDDING_PATH, {"model": model, "input": {"texts": texts}}, model)
+        items = sorted(body["output"]["embeddings"], key=lambda item: item.get("text_index", 0))
+        return [item["embedding"] for item in items]
+
+    @staticmethod
+    def _generation_input(prompt):
+        """prompt 可以是字符串，也可以是 messages 列表"""
+        if isinstance(prompt, list):
+            return {"messages": prompt}
+        return {"prompt": prompt}
+
+    async def generate(self, prompt, model="qwen3-max", **parameters):
+        """非流式生成，返回完整回答"""
+        payload = {
+            "model": model,
+            "input": self._generation_input(prompt),
+            "parameters": dict(parameters, result_format="message"),
+        }
+        body = await self._post_json(GENERATION_PATH, payload, model)
+        return body["output"]["choices"][0]["message"]["content"]
+
+    async def generate_stream(self, prompt, model="qwen3-max", **parameters):
+        """
+        流式生成，逐条产出 (新增文本, usage)。
+        """
+        payload = {
+            "model": model,
+            "input": self._generation_input(prompt),
+            "parameters": dict(parameters, result_format="message", incremental_output=True),
+        }
+        session = self._get_session()
+        # 流式响应可能持续较久，只限制连接时间和两次数据之间的间隔
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.request_timeout,
+                                        sock_read=self.request_timeout)
+        headers = {"X-DashScope-SSE": "enable", "Accept": "text/event-stream"}
+
+        for attempt in range(self.max_retries + 1):
+            received = False
+            try:
+                # 只在请求期间占用并发名额
+                async with self._get_semaphore(model):
+                    async with session.post(self.base_url + GENERATION_PATH, json=payload,
+                                            headers=headers, timeout=timeout) as response:
+                        if response.status != 200:
+                            error = await self._error_from_response(response)
+                        else:
+                            event_type = None
+                            async for raw_line in response.content:
+                                line = raw_line.decode("utf-8").strip()
+                                if line.startswith("event:"):
+                                    event_type = line[len("event:"):].strip()
+                                elif line.startswith("data:"):
+                                    message = json.loads(line[len("data:"):])
+                                    if event_type == "error":
+                                        raise DashScopeAPIError(response.status, message.get("code"),
+                                                                message.get("message"))
+                                    choice = message["output"]["choices"][0]
+                                    received = True
+                                    yield choice["message"].get("content", ""), message.get("usage", {})
+                            return
+                if error.status not in RETRYABLE_STATUS or attempt == self.max_retries:
+                    raise error
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # 已经输出过内容时不能重试，否则回答会重复
+                if received or attempt == self.max_retries:
+                    raise DashScopeAPIError(None, type(e).__name__, str(e) or "请求超时") from e
+            await self._backoff(attempt)
@@ -0,0 +1,244 @@
+# embedders.py
+# 嵌入模型的统一接口：远程的 DashScope text-embedding-v3，以及在本机 CPU 上运行的本地嵌入模型
+# 本地模型单独构建自己的向量库（向量空间与远程模型不同，不能混用），远程嵌入超时或不可用时 app.py 退回本地模型
+import asyncio
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from bm25_index import tokenize
+from embedding_pipeline import EmbeddingAPIError
+
+
+class EmbeddingUnavailableError(Exception):
+    """远程嵌入在最近一次失败后的冷却期内，直接失败，不再等待超时"""
+
+
+class Embedder:
+    """
+    嵌入模型的公共接口：embed(texts) 返回向量列表，embed_async 为异步版本。
+    model 为模型标识，写入向量库的元数据，查询时用来确认向量库与模型一致。
+    lexical 为True表示向量只反映字面（词）匹配，没有语义能力，与BM25关键词检索是同一种信号。
+    """
+    name = "嵌入模型"
+    local = False
+    lexical = False
+
+    def __init__(self, model):
+        self.model = model
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+    async def embed_async(self, texts):
+        return await asyncio.to_thread(self.embed, texts)
+
+
+class DashScopeEmbedder(Embedder):
+    """
+    DashScope 远程嵌入。
+    - timeout：单次调用的超时（秒），None 表示不限制（构建数据库时由嵌入流水线负责重试）
+    - cooldown：超时或临时错误（限流、服务端错误）后的冷却时间（秒），期间直接抛出 EmbeddingUnavailableError，
+      调用方立即退回本地模型，不必每个请求都等待超时
+    - async_client：异步版本使用的 AsyncDashScopeClient
+    """
+    name = "DashScope嵌入"
+
+    def __init__(self, api_key, model="text-embedding-v3", timeout=None, cooldown=0.0, async_client=None):
+        super().__init__(model)
+        self.api_key = api_key
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self.async_client = async_client
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="remote-embed")
+        self._unavailable_until = 0.0
+        self.failures = 0
+
+    def available(self):
+        return time.monotonic() >= self._unavailable_until
+
+    def _check_available(self):
+        remaining = self._unavailable_until - time.monotonic()
+        if remaining > 0:
+            raise EmbeddingUnavailableError(f"远程嵌入暂不可用，{remaining:.0f} 秒后重试")
+
+    def _mark_failed(self):
+        self.failures += 1
+        self._unavailable_until = time.monotonic() + self.cooldown
+
+    def _call(self, texts):
+        from dashscope import TextEmbedding
+
+        response = TextEmbedding.call(model=self.model, input=texts, api_key=self.api_key)
+        if response.status_code != 200:
+            raise EmbeddingAPIError(response.status_code, response.code, response.message)
+        # 'dense' 是默认的向量类型
+        return [item['embedding'] for item in response.output['embeddings']]
+
+    def embed(self, texts):
+        self._check_available()
+        try:
+            if self.timeout is None:
+                return self._call(texts)
+            # 超时后调用线程仍在后台等待响应，但不再阻塞当前请求
+            return self._executor.submit(self._call, texts).result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self._mark_failed()
+            raise TimeoutError(f"嵌入API超时（{self.timeout} 秒）")
+        except EmbeddingAPIError as e:
+            if e.retryable:
+                self._mark_failed()
+            raise
+        except Exception:
+            # 网络错误等
+            self._mark_failed()
+            raise
+
+    async def embed_async(self, texts):
+        from dashscope_async import DashScopeAPIError
+
+        if self.async_client is None:
+            return await super().embed_async(texts)
+        self._check_available()
+        try:
+            return await asyncio.wait_for(self.async_client.embed(texts, model=self.model), self.timeout)
+        except asyncio.TimeoutError:
+            self._mark_failed()
+            raise TimeoutError(f"嵌入API超时（{self.timeout} 秒）")
+        except DashScopeAPIError as e:
+            error = EmbeddingAPIError(e.status, e.code, e.message)
+            if error.retryable:
+                self._mark_failed()
+            raise error
+        except Exception:
+            self._mark_failed()
+            raise
+
+
+class LocalEmbedder(Embedder):
+    """
+    本地嵌入模型的公共部分：文本按 batch_size 分批，多个批次在线程池中并行计算
+    （onnxruntime 和 numpy 在计算时释放GIL）。单个批次（例如查询）直接在当前线程计算。
+    子类实现 _embed_batch(texts)，返回单位化后的 float32 矩阵。
+    """
+    local = True
+
+    def __init__(self, model, batch_size=32, workers=2):
+        super().__init__(model)
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="local-embed")
+
+    def _embed_batch(self, texts):
+        raise NotImplementedError
+
+    def embed(self, texts):
+        if not isinstance(texts, list):
+            texts = [texts]
+        if len(texts) <= self.batch_size:
+            return self._embed_batch(texts).tolist()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        return np.concatenate(list(self._executor.map(self._embed_batch, batches))).tolist()
+
+    async def embed_async(self, texts):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.embed, texts)
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.where(norms > 0, norms, 1.0)).astype(np.float32)
+
+
+class HashingEmbedder(LocalEmbedder):
+    """
+    不需要下载模型的本地嵌入：词（参数、英文词、中文二元组，与关键词检索的分词相同）按哈希映射到 dim 维，
+    带符号累加、对数缩放后单位化。只能匹配字面相同的词，没有语义能力，本质上是另一种关键词检索，
+    与BM25融合等于把同一路关键词信号算两次，因此 app.py 在它作为本地模型时直接使用BM25检索（lexical = True）。
+    需要语义退路时请使用 ONNX 或 sentence-transformers 模型。
+    """
+    name = "本地哈希嵌入"
+    lexical = True
+
+    def __init__(self, model="hashing", dim=1024, batch_size=256, workers=1):
+        super().__init__(model, batch_size, workers)
+        self.dim = dim
+
+    def _embed_batch(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                h = zlib.crc32(token.encode("utf-8"))
+                matrix[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return normalize_rows(np.sign(matrix) * np.log1p(np.abs(matrix)))
+
+
+class OnnxEmbedder(LocalEmbedder):
+    """
+    ONNX 格式的句向量模型（例如导出为 ONNX 的 bge-small-zh），在 CPU 上用 onnxruntime 运行。
+    模型目录中需要 model.onnx 和 tokenizer.json；输出为逐词向量时按 attention_mask 做平均池化。
+    依赖 onnxruntime 和 tokenizers（pip install onnxruntime tokenizers）。
+    """
+    name = "本地ONNX嵌入"
+
+    def __init__(self, model, model_dir, max_length=256, batch_size=32, workers=2):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        super().__init__(model, batch_size, workers)
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model.onnx"), providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {item.name for item in self.session.get_inputs()}
+
+    def _embed_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        output = self.session.run(None, feeds)[0]
+        if output.ndim == 3:
+            mask = attention_mask[:, :, None].astype(np.float32)
+            output = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1.0)
+        return normalize_rows(output)
+
+
+class SentenceTransformerEmbedder(LocalEmbedder):
+    """
+    sentence-transformers 模型（pip install sentence-transformers），首次使用时下载模型。
+    """
+    name = "本地sentence-transformers嵌入"
+
+    def __init__(self, model, model_name, batch_size=32, workers=1):
+        from sentence_transformers import SentenceTransformer
+
+        super().__init__(model, batch_size, workers)
+        self.encoder = SentenceTransformer(model_name, device="cpu")
+
+    def _embed_batch(self, texts):
+        return normalize_rows(np.asarray(self.encoder.encode(texts, batch_size=self.batch_size), dtype=np.float32))
+
+
+def create_local_embedder(spec):
+    """
+    按配置创建本地嵌入模型：
+    - "hashing"：哈希嵌入，不需要模型文件
+    - "onnx:<模型目录>"：ONNX 模型
+    - "sentence-transformers:<模型名>"：sentence-transformers 模型
+    spec 同时作为模型标识写入本地向量库，更换后需要重新运行 build_vector_db.py。
+    """
+    kind, _, argument = spec.partition(":")
+    if kind == "hashing":
+        return HashingEmbedder(spec)
+    if kind == "onnx" and argument:
+        return OnnxEmbedder(spec, argument)
+    if kind == "sentence-transformers" and argument:
+        return SentenceTransformerEmbedder(spec, argument)
+    raise ValueError(f"未知的本地嵌入模型: {spec}")
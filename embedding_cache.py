@@ -0,0 +1,151 @@
+# embedding_cache.py
+# 查询向量缓存：内存LRU + SQLite持久化，重启后依然有效
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+
+def normalize_query(text):
+    """
+    规范化查询文本，让近似重复的问题命中同一条缓存。
+    全角转半角、转小写、合并空白、去掉结尾的标点。
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?？!！。.~～ ")
+
+
+class EmbeddingCache:
+    """
+    两级查询向量缓存。
+    - 第一级：内存中的 LRU（OrderedDict），容量由 max_memory_items 控制
+    - 第二级：SQLite 文件，容量由 max_disk_items 控制，超出时淘汰最久未使用的条目
+    - 缓存条目绑定嵌入模型名：更换模型后旧条目全部失效；超过 ttl_seconds 的条目同样失效
+    """
+
+    def __init__(self, db_path, model, max_memory_items=1024, max_disk_items=50000,
+                 ttl_seconds=30 * 24 * 3600):
+        self.db_path = db_path
+        self.model = model
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.ttl_seconds = ttl_seconds
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " query TEXT NOT NULL,"
+            " embedding BLOB NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, query))"
+        )
+        # 模型变化或过期的条目直接清理
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE model != ? OR created_at < ?",
+            (self.model, time.time() - self.ttl_seconds)
+        )
+        self._conn.commit()
+
+    # ============ 内存 LRU ============
+    def _memory_get(self, key):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        embedding, created_at = entry
+        if time.time() - created_at > self.ttl_seconds:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return embedding
+
+    def _memory_put(self, key, embedding, created_at):
+        self._memory[key] = (embedding, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    # ============ 对外接口 ============
+    def get(self, text):
+        """返回缓存的向量，未命中时返回 None"""
+        key = normalize_query(text)
+        with self._lock:
+            embedding = self._memory_get(key)
+            if embedding is not None:
+                self.stats["hits"] += 1
+                self.stats["memory_hits"] += 1
+                return embedding
+
+            row = self._conn.execute(
+                "SELECT embedding, created_at FROM embeddings WHERE model = ? AND query = ?",
+                (self.model, key)
+            ).fetchone()
+            if row is None or time.time() - row[1] > self.ttl_seconds:
+                self.stats["misses"] += 1
+                return None
+
+            embedding = array("f", row[0]).tolist()
+            self._conn.execute(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND query = ?",
+                (time.time(), self.model, key)
+            )
+            self._conn.commit()
+            self._memory_put(key, embedding, row[1])
+            self.stats["hits"] += 1
+            self.stats["disk_hits"] += 1
+            return embedding
+
+    def get_many(self, texts):
+        """批量查询，返回与 texts 等长的列表，未命中的位置为 None"""
+        return [self.get(text) for text in texts]
+
+    def put(self, text, embedding):
+        """写入一条查询向量（同时写入内存和磁盘）"""
+        key = normalize_query(text)
+        now = time.time()
+        blob = array("f", embedding).tobytes()
+        with self._lock:
+            self._memory_put(key, list(embedding), now)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (model, query, embedding, created_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (self.model, key, blob, now, now)
+            )
+            # 超出磁盘容量时淘汰最久未使用的条目
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_disk_items:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN ("
+                    " SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_disk_items,)
+                )
+            self._conn.commit()
+
+    def clear(self):
+        """清空所有缓存"""
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+
+    def get_stats(self):
+        """返回命中统计（包含命中率）"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_items"] = len(self._memory)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        return stats
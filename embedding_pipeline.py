@@ -0,0 +1,205 @@
+# embedding_pipeline.py
+# 构建数据库时的并发嵌入流水线：线程池、令牌桶限流、指数退避重试、断点续传
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 这些状态码视为临时错误，可以重试
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class EmbeddingAPIError(Exception):
+    """嵌入接口返回错误"""
+
+    def __init__(self, status_code, code, message):
+        super().__init__(f"嵌入API调用失败: {code}, {message}")
+        self.status_code = status_code
+        self.code = code
+        self.message = message
+
+    @property
+    def retryable(self):
+        return self.status_code in RETRYABLE_STATUS
+
+
+class TokenBucket:
+    """
+    令牌桶限流：每秒补充 rate 个令牌，最多积累 capacity 个，每个请求消耗一个令牌。
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class EmbeddingPipeline:
+    """
+    并发嵌入流水线。
+    - 按条数和总字符数把块打包成批次，尽量用满接口的批量上限
+    - 线程池并发请求，令牌桶限制整体请求速率
+    - 临时错误按指数退避重试，重试用完后整个批次记为失败；不可重试的错误把批次对半拆开重试，找出真正出错的块
+    - 每完成一个批次就写入检查点文件，中断后重新运行会跳过已完成的块；
+      检查点记录嵌入模型，更换模型后旧的检查点不再使用
+    """
+
+    def __init__(self, embed_func, workers=4, max_batch_size=10, max_batch_chars=80000,
+                 requests_per_second=10, max_retries=5, backoff_base=1.0, checkpoint_path=None, model=None):
+        self.embed_func = embed_func
+        self.model = model
+        self.workers = workers
+        self.max_batch_size = max_batch_size
+        self.max_batch_chars = max_batch_chars
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.checkpoint_path = checkpoint_path
+
+    # ============ 批次与检查点 ============
+    def make_batches(self, records):
+        """按条数和字符数上限打包批次"""
+        batches, batch, chars = [], [], 0
+        for record in records:
+            size = len(record["document"])
+            if batch and (len(batch) >= self.max_batch_size or chars + size > self.max_batch_chars):
+                batches.append(batch)
+                batch, chars = [], 0
+            batch.append(record)
+            chars += size
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def load_checkpoint(self):
+        """
+        读取检查点中已经完成嵌入的块（ID包含内容哈希，内容变了自然不会命中）。
+        检查点由其他嵌入模型生成时（向量空间不同，不能混用）清除检查点，全部重新嵌入。
+        """
+        done = {}
+        other_model = False
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                        if item.get("model") != self.model:
+                            other_model = True
+                            continue
+                        done[item["id"]] = item["embedding"]
+                    except (json.JSONDecodeError, KeyError):
+                        # 中断时最后一行可能不完整
+                        continue
+        if other_model:
+            print(f"检查点不是由嵌入模型 {self.model} 生成的，已清除")
+            self.clear_checkpoint()
+            done = {}
+        return done
+
+    def clear_checkpoint(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    # ============ 嵌入 ============
+    def _embed_with_retry(self, texts):
+        """调用嵌入函数；临时错误按指数退避重试，不可重试的错误直接抛出"""
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                return self.embed_func(texts)
+            except EmbeddingAPIError as e:
+                if not e.retryable or attempt == self.max_retries:
+                    raise
+            except Exception:
+                # 网络异常等，视为临时错误
+                if attempt == self.max_retries:
+                    raise
+            delay = self.backoff_base * (2 ** attempt)
+            time.sleep(delay + random.uniform(0, delay / 2))
+
+    def _embed_batch(self, batch):
+        """
+        嵌入一个批次，返回 (成功的 [(record, embedding)], 失败的 [(record, 错误信息)])。
+        只有不可重试的错误（某个块本身有问题，如内容不合法）才对半拆分重试，单个块仍失败才记为失败；
+        重试次数用完的临时错误（限流、服务端错误）和网络异常拆开也不会成功，整个批次记为失败，
+        下次运行时从检查点继续。
+        """
+        try:
+            embeddings = self._embed_with_retry([record["document"] for record in batch])
+            return list(zip(batch, embeddings)), []
+        except Exception as e:
+            if len(batch) == 1 or not isinstance(e, EmbeddingAPIError) or e.retryable:
+                return [], [(record, str(e)) for record in batch]
+            middle = len(batch) // 2
+            ok_left, failed_left = self._embed_batch(batch[:middle])
+            ok_right, failed_right = self._embed_batch(batch[middle:])
+            return ok_left + ok_right, failed_left + failed_right
+
+    def run(self, records, on_batch):
+        """
+        为 records 生成嵌入。每完成一个批次调用一次 on_batch(records, embeddings)（在调用线程中执行）。
+        返回报告：总块数、复用检查点的块数、失败的块、耗时和吞吐量（块/秒）。
+        """
+        start = time.perf_counter()
+        checkpoint = self.load_checkpoint()
+        resumed = [record for record in records if record["id"] in checkpoint]
+        pending = [record for record in records if record["id"] not in checkpoint]
+
+        if resumed:
+            print(f"从检查点恢复 {len(resumed)} 个已完成嵌入的块")
+            for i in range(0, len(resumed), self.max_batch_size):
+                batch = resumed[i:i + self.max_batch_size]
+                on_batch(batch, [checkpoint[record["id"]] for record in batch])
+
+        batches = self.make_batches(pending)
+        embedded, failed = 0, []
+        checkpoint_file = open(self.checkpoint_path, "a", encoding="utf-8") if self.checkpoint_path else None
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embed") as executor:
+                futures = [executor.submit(self._embed_batch, batch) for batch in batches]
+                for future in as_completed(futures):
+                    ok, batch_failed = future.result()
+                    failed.extend(batch_failed)
+                    if not ok:
+                        continue
+                    ok_records = [record for record, _ in ok]
+                    ok_embeddings = [embedding for _, embedding in ok]
+                    on_batch(ok_records, ok_embeddings)
+                    if checkpoint_file:
+                        for record, embedding in ok:
+                            checkpoint_file.write(json.dumps({"id": record["id"], "model": self.model, "embedding": embedding}) + "\n")
+                        checkpoint_file.flush()
+                    embedded += len(ok)
+                    print(f"已处理 {embedded + len(failed)} / {len(pending)} 个块")
+        finally:
+            if checkpoint_file:
+                checkpoint_file.close()
+
+        seconds = time.perf_counter() - start
+        if not failed:
+            self.clear_checkpoint()
+        return {
+            "total": len(records),
+            "resumed": len(resumed),
+            "embedded": embedded,
+            "failed": [(record["id"], error) for record, error in failed],
+            "batches": len(batches),
+            "seconds": seconds,
+            "chunks_per_sec": embedded / seconds if seconds > 0 else 0.0,
+        }
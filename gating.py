@@ -0,0 +1,47 @@
+# gating.py
+# 基于硬性规则的检索判断：命令名、关键词和社交用语的匹配器在导入时构建一次
+import re
+
+from command_index import CommandMatcher
+
+KNOWLEDGE_BASE_DIR = "knowledge_base" # 命令名直接读取知识库中的【命令】标题，与知识库内容保持一致
+
+# 判断一：知识库中的全部命令名
+COMMAND_MATCHER = CommandMatcher.from_knowledge_base(KNOWLEDGE_BASE_DIR)
+
+# 判断二：提问中会出现的高频词汇
+KEYWORD_PATTERN = re.compile("命令|指令|用法|语法|参数")
+
+# 判断三：社交或设置请求；英文词要求前后不是字母，避免 which、this 中的 hi 被误判
+SOCIAL_PATTERN = re.compile(r"你好|称呼|名字|早上好|晚上好|再见|(?<![a-z])(?:hi|hello|bye)(?![a-z])")
+
+
+def classify_question(user_question):
+    """
+    通过多重判断来决定是否需要去检索数据库，返回 (判断结果, 命中的命令名列表)。
+    判断结果：True 需要检索，False 不需要检索，None 无法判断（交给模型判断）
+    判断一：检查是否包含Linux命令名（命中的命令名可直接用于检索）
+    判断二：检查是否包含"命令"、"指令"、"用法"、"语法"、"参数"等关键词
+    判断三：检查是否存在社交或设置请求
+    """
+    user_question = user_question.strip().lower()
+
+    commands = COMMAND_MATCHER.find(user_question)
+    if commands:
+        return True, commands
+
+    if KEYWORD_PATTERN.search(user_question):
+        return True, []
+
+    if SOCIAL_PATTERN.search(user_question):
+        return False, []
+
+    # 无法判断则返回None，交给模型判断
+    return None, []
+
+
+def is_need_retrieve(user_question):
+    """
+    判断是否需要从数据库中检索信息，返回 True/False/None。
+    """
+    return classify_question(user_question)[0]
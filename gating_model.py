@@ -0,0 +1,167 @@
+# gating_model.py
+# 本地检索判断模型：字符n-gram + 逻辑回归，替代大部分"需要/不需要"的大模型判断
+# 单独训练（使用已构建的命令名索引）：python gating_model.py
+import os
+import random
+import re
+import zlib
+
+import numpy as np
+
+from embedding_cache import normalize_query
+
+NGRAM_RANGE = (1, 3) # 字符n-gram的范围
+HASH_DIM = 1 << 18 # 特征哈希的维度
+
+# 与Linux命令无关的问题（社交、设置、其他领域），作为"不需要"的训练样本
+NEGATIVE_SEEDS = [
+    "你好", "您好呀", "早上好", "晚上好", "再见", "拜拜", "谢谢你", "太感谢了", "你是谁",
+    "你叫什么名字", "以后叫我小明", "请称呼我老师", "你能做什么", "介绍一下你自己",
+    "今天天气怎么样", "明天会下雨吗", "讲个笑话", "给我讲个故事", "推荐一部电影",
+    "推荐几本好书", "今天吃什么", "附近有什么好吃的", "帮我写一首诗", "翻译一下这句话",
+    "1加1等于几", "帮我算一下房贷", "怎么学好英语", "如何提高写作水平", "怎么减肥",
+    "如何保持好心情", "怎么做红烧肉", "世界上最高的山是哪座", "中国的首都是哪里",
+    "Python怎么定义函数", "Java和C++有什么区别", "怎么学习前端开发", "什么是机器学习",
+    "给我写一个排序算法", "Windows怎么重装系统", "Excel怎么做表格", "手机怎么截图",
+    "Linux是谁发明的", "Linux的历史", "Linux和Windows哪个好", "学Linux有前途吗",
+    "你觉得我适合当程序员吗", "怎么准备面试", "帮我写一封求职信", "今天星期几",
+    "现在几点了", "我心情不好", "陪我聊聊天", "你喜欢什么颜色", "你会唱歌吗",
+    "说一句鼓励我的话", "周末去哪玩", "怎么养猫", "如何入门摄影", "股票怎么买",
+]
+
+NEGATIVE_TEMPLATES = ["{}", "{}？", "请问{}", "{}呢", "我想知道{}"]
+
+POSITIVE_TEMPLATES = [
+    "{}", "怎么{}", "如何{}", "linux怎么{}", "linux下如何{}", "用什么命令{}",
+    "想{}该怎么做", "有办法{}吗", "{}的方法", "请问怎样{}",
+]
+
+# 从条目中提取说明和常见用法中的注释，作为"需要"的训练样本
+DESCRIPTION_PATTERN = re.compile(r"【说明】([^\n【]*)")
+USAGE_NOTE_PATTERN = re.compile(r"[（(]([^（）()]{4,30})[）)]")
+
+
+def extract_features(text):
+    """提取字符n-gram的哈希特征（去重）"""
+    text = normalize_query(text)
+    features = set()
+    for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1):
+        for i in range(len(text) - n + 1):
+            features.add(zlib.crc32(text[i:i + n].encode("utf-8")) % HASH_DIM)
+    return np.fromiter(features, dtype=np.int64, count=len(features))
+
+
+def build_training_set(command_index, seed=42):
+    """
+    用命令名索引中的条目生成训练样本。
+    正样本：由命令说明和用法注释改写成的问题；负样本：社交、设置和其他领域的问题。
+    返回 (texts, labels)。
+    """
+    rng = random.Random(seed)
+    phrases = set()
+    for sections in command_index.sections.values():
+        for section in sections:
+            match = DESCRIPTION_PATTERN.search(section)
+            if match:
+                # 只取说明的第一句，去掉开头的命令名
+                sentence = re.split(r"[。；;]", match.group(1).strip())[0]
+                sentence = re.sub(r"^[a-zA-Z0-9_\- ]+(命令)?", "", sentence).strip(" ，,")
+                if len(sentence) >= 4:
+                    phrases.add(sentence)
+            for note in USAGE_NOTE_PATTERN.findall(section):
+                if re.search(r"[一-鿿]", note):
+                    phrases.add(note.strip())
+
+    texts, labels = [], []
+    for phrase in sorted(phrases):
+        for template in rng.sample(POSITIVE_TEMPLATES, 3):
+            texts.append(template.format(phrase))
+            labels.append(1)
+
+    # 负样本按模板扩充，使正负样本数量大致均衡
+    repeats = max(1, len(texts) // (len(NEGATIVE_SEEDS) * len(NEGATIVE_TEMPLATES)))
+    for seed_text in NEGATIVE_SEEDS:
+        for template in NEGATIVE_TEMPLATES:
+            for _ in range(repeats):
+                texts.append(template.format(seed_text))
+                labels.append(0)
+    return texts, labels
+
+
+class GatingModel:
+    """
+    基于字符n-gram哈希特征的逻辑回归二分类器。
+    predict 返回 (need, confidence)：need 表示是否需要检索，confidence 为模型对该判断的置信度。
+    """
+
+    def __init__(self, weights=None, bias=0.0):
+        self.weights = weights if weights is not None else np.zeros(HASH_DIM, dtype=np.float32)
+        self.bias = float(bias)
+
+    def train(self, texts, labels, epochs=300, learning_rate=1.0, l2=1e-4):
+        """全量梯度下降训练（稀疏特征用 bincount 计算，不构造稠密矩阵）"""
+        features = [extract_features(text) for text in texts]
+        sample_ids = np.concatenate([np.full(len(f), i) for i, f in enumerate(features)])
+        feature_ids = np.concatenate(features)
+        y = np.asarray(labels, dtype=np.float64)
+        n = len(texts)
+
+        weights = self.weights.astype(np.float64)
+        bias = self.bias
+        for _ in range(epochs):
+            scores = np.bincount(sample_ids, weights=weights[feature_ids], minlength=n) + bias
+            errors = 1.0 / (1.0 + np.exp(-scores)) - y
+            gradient = np.bincount(feature_ids, weights=errors[sample_ids], minlength=HASH_DIM) / n
+            weights -= learning_rate * (gradient + l2 * weights)
+            bias -= learning_rate * errors.mean()
+
+        self.weights = weights.astype(np.float32)
+        self.bias = bias
+        return self
+
+    def predict_proba(self, text):
+        """返回需要检索的概率"""
+        score = float(self.weights[extract_features(text)].sum()) + self.bias
+        return 1.0 / (1.0 + np.exp(-score))
+
+    def predict(self, text):
+        probability = float(self.predict_proba(text))
+        need = probability >= 0.5
+        return need, probability if need else 1.0 - probability
+
+    def save(self, path):
+        np.savez_compressed(path, weights=self.weights, bias=np.float64(self.bias))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["weights"], float(data["bias"]))
+
+
+def train_gating_model(command_index, path=None):
+    """用命令名索引训练判断模型，指定 path 时保存到文件"""
+    texts, labels = build_training_set(command_index)
+    model = GatingModel().train(texts, labels)
+    if path is None:
+        print(f"检索判断模型已训练完成：{len(texts)} 个样本")
+        return model
+    model.save(path)
+    print(f"检索判断模型已训练完成：{len(texts)} 个样本，已保存到 {path}")
+    return model
+
+
+if __name__ == "__main__":
+    from command_index import CommandIndex
+    from retriever import RetrievalService
+
+    CHROMA_DB_DIR = "db/chroma_db"
+    COLLECTION_NAME = "linux_commands"
+    COMMAND_INDEX_FILE = "db/command_index.json"
+    GATING_MODEL_FILE = "db/gating_model.npz"
+
+    if os.path.exists(COMMAND_INDEX_FILE):
+        index = CommandIndex.load(COMMAND_INDEX_FILE)
+    else:
+        # 旧版本构建的数据库没有索引文件，用库中的文本块构建
+        index = CommandIndex.from_chunks(RetrievalService(CHROMA_DB_DIR, COLLECTION_NAME).get_documents())
+    train_gating_model(index, GATING_MODEL_FILE)
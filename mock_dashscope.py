@@ -0,0 +1,189 @@
+# mock_dashscope.py
+# 本地模拟的 DashScope 服务，用于离线测试流式输出和性能，不消耗真实的API额度
+# 运行方式：python mock_dashscope.py --port 8765
+# 然后设置环境变量 DASHSCOPE_HTTP_BASE_URL=http://127.0.0.1:8765/api/v1 再运行 app.py
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GENERATION_PATH = "/api/v1/services/aigc/text-generation/generation"
+EMBEDDING_PATH = "/api/v1/services/embeddings/text-embedding/text-embedding"
+
+
+def fake_embedding(text, dim):
+    """根据文本哈希生成确定性的单位向量，相同文本得到相同向量"""
+    seed = int(hashlib.md5(text.encode("utf-8")).hexdigest(), 16)
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def fake_answer(text):
+    """生成模拟回答：判断类提示词回答"需要"，其余返回固定格式的回答"""
+    if "只能回答\"需要\"或\"不需要\"" in text:
+        return "需要"
+    return "这是本地模拟服务生成的回答。" + text.strip()[-40:]
+
+
+class MockDashScopeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 以下配置由 create_server 设置
+    first_token_delay = 0.2
+    token_delay = 0.02
+    embedding_delay = 0.05
+    embedding_dim = 1024
+    embedding_error_rate = 0.0
+    stats = None
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _count(self, key):
+        with self.stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        try:
+            request = self._read_json()
+        except json.JSONDecodeError:
+            self._send_json({"code": "InvalidParameter", "message": "bad json"}, status=400)
+            return
+
+        if self.path.startswith(GENERATION_PATH):
+            self._count("generation")
+            self._handle_generation(request)
+        elif self.path.startswith(EMBEDDING_PATH):
+            self._count("embedding")
+            self._handle_embedding(request)
+        else:
+            self._send_json({"code": "NotFound", "message": self.path}, status=404)
+
+    def _handle_embedding(self, request):
+        texts = request.get("input", {}).get("texts", [])
+        time.sleep(self.embedding_delay)
+        if random.random() < self.embedding_error_rate:
+            # 模拟限流错误，用于测试重试
+            self._count("embedding_throttled")
+            self._send_json({"code": "Throttling.RateQuota", "message": "Requests rate limit exceeded"}, status=429)
+            return
+        self._send_json({
+            "request_id": str(uuid.uuid4()),
+            "output": {"embeddings": [
+                {"text_index": i, "embedding": fake_embedding(text, self.embedding_dim)}
+                for i, text in enumerate(texts)
+            ]},
+            "usage": {"total_tokens": sum(len(text) for text in texts)}
+        })
+
+    def _handle_generation(self, request):
+        payload = request.get("input", {})
+        if "messages" in payload:
+            text = "\n".join(str(m.get("content", "")) for m in payload["messages"])
+        else:
+            text = payload.get("prompt", "")
+        answer = fake_answer(text)
+        parameters = request.get("parameters", {})
+        stream = self.headers.get("X-DashScope-SSE") == "enable"
+        incremental = parameters.get("incremental_output", False)
+        usage = {"input_tokens": len(text), "output_tokens": 0, "total_tokens": len(text)}
+
+        time.sleep(self.first_token_delay)
+        if not stream:
+            usage["output_tokens"] = len(answer)
+            usage["total_tokens"] += len(answer)
+            self._send_json({
+                "request_id": str(uuid.uuid4()),
+                "output": {"text": answer, "finish_reason": "stop", "choices": [
+                    {"finish_reason": "stop", "message": {"role": "assistant", "content": answer}}
+                ]},
+                "usage": usage
+            })
+            return
+
+        # 流式输出：每个字符作为一个token，按 SSE 格式逐条发送
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream;charset=UTF-8")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        request_id = str(uuid.uuid4())
+        for i, char in enumerate(answer):
+            if i:
+                time.sleep(self.token_delay)
+            last = i == len(answer) - 1
+            usage["output_tokens"] = i + 1
+            usage["total_tokens"] = len(text) + i + 1
+            content = char if incremental else answer[:i + 1]
+            event = {
+                "request_id": request_id,
+                "output": {"choices": [{
+                    "finish_reason": "stop" if last else "null",
+                    "message": {"role": "assistant", "content": content}
+                }]},
+                "usage": usage
+            }
+            data = json.dumps(event, ensure_ascii=False)
+            self.wfile.write(f"id:{i + 1}\nevent:result\n:HTTP_STATUS/200\ndata:{data}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.close_connection = True
+
+
+def create_server(host="127.0.0.1", port=8765, first_token_delay=0.2, token_delay=0.02,
+                  embedding_delay=0.05, embedding_dim=1024, embedding_error_rate=0.0):
+    """创建模拟服务（不启动），返回 ThreadingHTTPServer 实例"""
+    handler = type("ConfiguredMockHandler", (MockDashScopeHandler,), {
+        "first_token_delay": first_token_delay,
+        "token_delay": token_delay,
+        "embedding_delay": embedding_delay,
+        "embedding_dim": embedding_dim,
+        "embedding_error_rate": embedding_error_rate,
+        "stats": {},
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(**kwargs):
+    """在后台线程中启动模拟服务，返回 (server, base_url)"""
+    server = create_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/api/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟 DashScope 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="首个token延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="每个token之间的延迟（秒）")
+    parser.add_argument("--embedding-delay", type=float, default=0.05, help="嵌入请求延迟（秒）")
+    parser.add_argument("--embedding-dim", type=int, default=1024, help="嵌入向量维度")
+    parser.add_argument("--embedding-error-rate", type=float, default=0.0, help="嵌入请求返回429限流错误的概率")
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.first_token_delay, args.token_delay,
+                           args.embedding_delay, args.embedding_dim, args.embedding_error_rate)
+    print(f"模拟 DashScope 服务已启动：http://{args.host}:{args.port}/api/v1")
+    server.serve_forever()
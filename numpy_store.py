@@ -0,0 +1,154 @@
+# numpy_store.py
+# 内存向量检索后端：全部向量放在一个连续的矩阵中（以内存映射方式加载），精确 top-k 检索
+# 知识库只有几百个条目，一次矩阵乘法 + argpartition 比走 Chroma 的 SQLite + HNSW + 取文档更快
+import json
+import os
+
+import numpy as np
+
+from retriever import RetrievalBackend
+
+# 向量矩阵的存储类型：float32 精确；float16 体积减半；int8 每行按最大绝对值量化，体积为 float32 的四分之一
+STORE_DTYPES = ("float32", "float16", "int8")
+
+
+def _write_atomic(path, write):
+    """先写临时文件再替换，正在内存映射旧文件的进程不受影响"""
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def save_vector_store(directory, ids, documents, embeddings, dtype="float32", model=None):
+    """
+    保存向量库。目录中包含：
+    - embeddings.npy：单位化后的向量矩阵（按 dtype 存储）
+    - scales.npy：int8 量化时每行的缩放系数
+    - documents.json：ID列表和文本列表
+    - meta.json：存储类型、维度和生成向量的嵌入模型（model），最后写入
+    """
+    if dtype not in STORE_DTYPES:
+        raise ValueError(f"不支持的存储类型: {dtype}，可选 {', '.join(STORE_DTYPES)}")
+    os.makedirs(directory, exist_ok=True)
+
+    matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms > 0, norms, 1.0)
+
+    scales = np.ones(len(ids), dtype=np.float32)
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        matrix = np.round(matrix / scales[:, None]).astype(np.int8)
+    else:
+        matrix = matrix.astype(dtype)
+
+    # np.save 会自动补 .npy 后缀，这里传入文件对象避免临时文件名被改掉
+    def save_array(array):
+        def write(tmp_path):
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+        return write
+
+    _write_atomic(os.path.join(directory, "embeddings.npy"), save_array(matrix))
+    _write_atomic(os.path.join(directory, "scales.npy"), save_array(scales))
+
+    def write_documents(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"ids": list(ids), "documents": list(documents)}, f, ensure_ascii=False)
+    _write_atomic(os.path.join(directory, "documents.json"), write_documents)
+
+    def write_meta(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dtype": dtype, "dim": int(matrix.shape[1]) if len(ids) else 0, "count": len(ids), "model": model}, f)
+    _write_atomic(os.path.join(directory, "meta.json"), write_meta)
+
+
+def export_chroma_collection(db_dir, collection_name, directory, dtype="float32"):
+    """把 Chroma 集合中的全部向量和文本导出为向量库"""
+    import chromadb
+
+    client = chromadb.PersistentClient(path=db_dir)
+    result = client.get_collection(name=collection_name).get(include=["embeddings", "documents"])
+    save_vector_store(directory, result["ids"], result["documents"], result["embeddings"], dtype)
+    return len(result["ids"])
+
+
+class NumpyRetrievalService(RetrievalBackend):
+    """
+    numpy 检索后端，适合小规模知识库。
+    - 向量矩阵以内存映射方式加载，多个进程共享同一份页缓存
+    - 查询为精确检索：一次矩阵乘法算出全部余弦相似度，argpartition 取 top-k，支持批量查询
+    - 向量库不存在时（旧版本构建的数据库）从 Chroma 集合导出
+    返回结果与 Chroma 格式相同，distances 为余弦距离（1 - 余弦相似度）。
+    """
+    name = "向量库（numpy）"
+
+    def __init__(self, directory, stamp_file=None, chroma_db_dir=None, collection_name=None, dtype="float32"):
+        super().__init__(stamp_file)
+        self.directory = directory
+        self.chroma_db_dir = chroma_db_dir
+        self.collection_name = collection_name
+        self.dtype = dtype
+
+        self._matrix = None
+        self._scales = None
+        self._ids = []
+        self._documents = []
+        self._positions = {}
+        self.meta = {}
+
+    def _load(self):
+        meta_file = os.path.join(self.directory, "meta.json")
+        if not os.path.exists(meta_file) and self.chroma_db_dir:
+            count = export_chroma_collection(self.chroma_db_dir, self.collection_name, self.directory, self.dtype)
+            print(f"已从 Chroma 集合导出 {count} 个向量到 {self.directory}")
+
+        with open(os.path.join(self.directory, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(self.directory, "documents.json"), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self._ids, self._documents = data["ids"], data["documents"]
+        self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        self._matrix = np.load(os.path.join(self.directory, "embeddings.npy"), mmap_mode="r")
+        self._scales = np.load(os.path.join(self.directory, "scales.npy"), mmap_mode="r")
+
+    def _warmup(self):
+        """把内存映射的矩阵读一遍，页面进入缓存"""
+        if len(self._ids):
+            self._search([np.asarray(self._matrix[0], dtype=np.float32)], 1)
+
+    def _count(self):
+        return len(self._ids)
+
+    def _search(self, query_embeddings, n_results):
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1.0)
+
+        n_results = min(n_results, len(self._ids))
+        if n_results == 0:
+            return {"ids": [[] for _ in queries], "documents": [[] for _ in queries], "distances": [[] for _ in queries]}
+
+        # float16/int8 矩阵在乘法时转换为 float32；int8 再乘以每行的缩放系数
+        similarities = queries @ np.asarray(self._matrix, dtype=np.float32).T
+        if self._matrix.dtype == np.int8:
+            similarities *= self._scales
+
+        top = np.argpartition(-similarities, n_results - 1, axis=1)[:, :n_results]
+        top_scores = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        return {
+            "ids": [[self._ids[i] for i in row] for row in top],
+            "documents": [[self._documents[i] for i in row] for row in top],
+            "distances": (1.0 - top_scores).tolist(),
+        }
+
+    def _get_records(self):
+        return list(self._ids), list(self._documents)
+
+    def _get_by_ids(self, ids):
+        return {doc_id: self._documents[self._positions[doc_id]] for doc_id in ids if doc_id in self._positions}
@@ -0,0 +1,175 @@
+# prompt_builder.py
+# 回答提示词的组装：固定的系统提示词放在最前面（服务端可以缓存这段前缀），
+# 历史对话使用 messages 格式，检索到的条目按问题裁剪字段，整体不超过token预算
+import re
+
+from chunker import parse_fields
+from command_index import COMMAND_HEADER_PATTERN
+from conversation_memory import estimate_tokens, truncate_to_tokens
+
+# 系统提示词对所有请求完全相同，不含任何随请求变化的内容
+SYSTEM_PROMPT = """你是一个专业的Linux命令学习助手，专门为用户学习Linux命令提供帮助。
+
+当用户消息中提供了【参考信息】（根据用户查询从知识库中检索到的相关信息）时，请根据知识库内容为用户解答问题。要求：
+1. 严格基于知识库中的信息回答，不要添加知识库中没有的内容
+2. 回答要清晰、简洁、专业，适合Linux学习者理解
+3. 如果知识库中包含命令示例，请完整展示并解释每个参数的作用
+4. 如果知识库中包含多个相关信息，请整合成一个完整的回答
+5. 在回答末尾标注信息来源（如：根据Linux命令手册/根据知识库文档）
+6. 如果用户询问的命令有安全风险或需要注意事项，请特别提醒
+7. 保持教育性和实用性，帮助用户真正理解命令的使用方法和注意事项
+8. 遵守用户在历史对话中提出的要求
+
+当没有【参考信息】时，为通用知识回答模式：
+<system_info>
+- 请基于你的训练知识回答Linux相关问题
+- 重点回答技术准确性，避免猜测不确定的信息
+- 如果问题超出Linux范围，请友好引导回Linux主题
+- 保持专业、教育性的语气
+</system_info>
+要求：
+1. 仅回答与Linux命令、系统管理、Shell脚本相关的技术问题
+2. 确保技术细节的准确性，特别是命令语法、参数和使用场景
+3. 提供实用的示例代码，并解释关键部分
+4. 明确标注这是基于通用知识的回答，而非来自特定知识库
+5. 如果对某些细节不确定，请说明并建议用户查阅官方文档
+6. 对于复杂命令，分步骤解释使用方法
+7. 提醒用户在生产环境中使用命令前要充分测试
+8. 遵守用户在历史对话中提出的要求"""
+
+# 问题在问参数（如 -z、--exclude、"参数"、"选项"）时，只需要条目的常见用法
+FLAG_QUESTION_PATTERN = re.compile(r"(?<![\w-])--?[a-zA-Z]|参数|选项")
+FLAG_FIELDS = ("命令", "常见用法")
+# 问题在问风险或注意事项时，只需要说明、注意事项和其他（知识库中不少警告写在【其他】里）
+NOTICE_QUESTION_PATTERN = re.compile(r"注意|风险|危险|小心|慎用")
+NOTICE_FIELDS = ("命令", "说明", "注意事项", "其他")
+FIELD_ORDER = ("命令", "说明", "常见用法", "注意事项", "其他") # 条目中字段的顺序
+
+MIN_CONTEXT_TOKENS = 1000 # 历史对话过长时，至少为参考信息保留的token数
+
+
+def select_fields(question):
+    """
+    根据问题决定需要保留条目的哪些字段，返回None表示保留全部内容。
+    同时问参数和风险时（如"rm -rf 有什么风险"）取两者的并集，问风险时注意事项和其他总是保留。
+    """
+    fields = set()
+    if FLAG_QUESTION_PATTERN.search(question):
+        fields.update(FLAG_FIELDS)
+    if NOTICE_QUESTION_PATTERN.search(question):
+        fields.update(NOTICE_FIELDS)
+    # 按条目中字段的顺序输出
+    return tuple(name for name in FIELD_ORDER if name in fields) or None
+
+
+def trim_section(section, fields):
+    """
+    只保留条目中的指定字段（内容为空的字段省略）。一个文本块包含多个命令时逐个处理；
+    没有【命令】结构的文本，或者除命令名外一个需要的字段都没有时，保留原文。
+    """
+    if not fields:
+        return section
+    starts = [match.start() for match in COMMAND_HEADER_PATTERN.finditer(section)]
+    if not starts:
+        return section
+
+    parts = [section[:starts[0]].strip()] if section[:starts[0]].strip() else []
+    for i, start in enumerate(starts):
+        entry = section[start:starts[i + 1] if i + 1 < len(starts) else len(section)].strip()
+        parsed = parse_fields(entry)
+        selected = [name for name in fields if parsed.get(name)]
+        if not [name for name in selected if name != "命令"]:
+            parts.append(entry)
+            continue
+        parts.append("\n".join(f"【{name}】{parsed[name]}" for name in selected))
+    return "\n\n".join(parts)
+
+
+def build_user_message(user_question, context_str, judge_response, history_summary):
+    """最后一条用户消息：较早对话摘要、参考信息和当前问题"""
+    summary_str = f"【较早对话摘要】\n{history_summary}\n\n" if history_summary else ""
+    if context_str:
+        return f"""{summary_str}【参考信息】
+{context_str}
+
+【当前问题】
+{user_question}
+
+现在请基于知识库内容给出专业解答："""
+
+    # judge_response 为 False 表示判断为不需要检索，没有进行检索
+    if judge_response is False:
+        retrieve_prompt = "用户的问题似乎与Linux命令无关，将基于通用知识进行回答。"
+    else:
+        retrieve_prompt = "结果检索，知识库中没有找到与用户问题相关的具体信息。"
+    return f"""{summary_str}{retrieve_prompt}
+
+【当前问题】
+{user_question}
+
+现在请基于你的通用Linux知识给出专业解答，并在开头说明"{retrieve_prompt}以下基于通用Linux知识解答："："""
+
+
+def build_messages(user_question, contexts, judge_response, history_tuples=None, history_summary="",
+                   token_budget=6000):
+    """
+    组装发送给大模型的 messages，返回 (messages, 统计信息)。
+    顺序：固定的系统提示词 -> 最近几轮对话（user/assistant交替）-> 本次的用户消息。
+    预算分配：系统提示词和问题必须保留；历史对话过长时先舍弃较早的轮次，为参考信息至少保留
+    MIN_CONTEXT_TOKENS；参考信息按检索排名依次放入，放不下的部分截断或舍弃。
+    """
+    history_tuples = list(history_tuples or [])
+    fields = select_fields(user_question)
+
+    fixed_tokens = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(build_user_message(user_question, "", judge_response, ""))
+    summary_tokens = estimate_tokens(history_summary) if history_summary else 0
+
+    def history_cost():
+        return summary_tokens + sum(estimate_tokens(u) + estimate_tokens(a) for u, a in history_tuples)
+
+    reserve = MIN_CONTEXT_TOKENS if contexts else 0
+    while history_tuples and fixed_tokens + history_cost() + reserve > token_budget:
+        history_tuples.pop(0)
+    if history_summary and fixed_tokens + history_cost() + reserve > token_budget:
+        history_summary, summary_tokens = "", 0
+
+    # 参考信息：先按问题裁剪字段，再按剩余预算截断
+    context_budget = token_budget - fixed_tokens - history_cost()
+    untrimmed_tokens = sum(estimate_tokens(context) for context in contexts)
+    kept = []
+    for context in contexts:
+        section = trim_section(context, fields)
+        cost = estimate_tokens(section)
+        if cost > context_budget:
+            if context_budget > 100:
+                kept.append(truncate_to_tokens(section, context_budget))
+            break
+        kept.append(section)
+        context_budget -= cost
+    context_str = "\n\n".join(kept)
+
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    for user_msg, ai_msg in history_tuples:
+        messages.append({"role": "user", "content": user_msg})
+        messages.append({"role": "assistant", "content": ai_msg})
+    messages.append({"role": "user", "content": build_user_message(user_question, context_str, judge_response, history_summary)})
+
+    stats = {
+        "total_tokens": sum(estimate_tokens(message["content"]) for message in messages),
+        "system_tokens": estimate_tokens(SYSTEM_PROMPT),
+        "history_tokens": history_cost(),
+        "history_turns": len(history_tuples),
+        "context_tokens": estimate_tokens(context_str),
+        "context_tokens_untrimmed": untrimmed_tokens,
+        "sections": len(kept),
+        "fields": "、".join(fields) if fields else "全部",
+    }
+    return messages, stats
+
+
+def format_prompt_stats(stats):
+    """一行日志：本次提示词各部分的token数（估计值）"""
+    return (f"提示词 {stats['total_tokens']} tokens（系统 {stats['system_tokens']}，"
+            f"历史 {stats['history_tokens']}/{stats['history_turns']}轮，"
+            f"参考信息 {stats['context_tokens']}，裁剪前 {stats['context_tokens_untrimmed']}，"
+            f"{stats['sections']}个条目，字段：{stats['fields']}）")
@@ -0,0 +1,242 @@
+# retriever.py
+# 向量检索服务层：进程内只打开一次数据库，供所有请求共享
+# RetrievalBackend 定义检索后端的公共接口，RetrievalService 为 Chroma 实现
+import os
+import threading
+import time
+
+
+class RetrievalBackend:
+    """
+    检索后端的公共部分，app.py 通过 RETRIEVAL_BACKEND 选择具体实现。
+    - 进程内只加载一次，查询可并发执行；重新加载时等待进行中的查询结束后再替换
+    - build_vector_db.py 重建数据库后会更新构建标记文件，检测到后自动重新加载
+    - 记录加载、预热和查询耗时，便于观察性能
+    子类实现 _load、_warmup、_count、_search、_get_records 和 _get_by_ids。
+    """
+    name = "检索后端"
+
+    def __init__(self, stamp_file=None):
+        self.stamp_file = stamp_file
+        self._loaded = False
+        self._stamp = None
+
+        # 简单的读写锁：查询是读者，打开/重新加载是写者
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+
+        self.stats = {
+            "open_ms": 0.0,
+            "warmup_ms": 0.0,
+            "reloads": 0,
+            "queries": 0,
+            "query_ms_total": 0.0,
+            "query_ms_max": 0.0,
+        }
+
+    # ============ 子类实现 ============
+    def _load(self):
+        """（持有写锁）加载数据，重新加载时也会调用"""
+        raise NotImplementedError
+
+    def _warmup(self):
+        """（持有写锁）预热，让第一个查询不承担额外开销"""
+
+    def _count(self):
+        raise NotImplementedError
+
+    def _search(self, query_embeddings, n_results):
+        """（持有读锁）返回与 Chroma 查询结果格式相同的字典：ids、documents、distances"""
+        raise NotImplementedError
+
+    def _get_records(self):
+        """（持有读锁）返回 (ID列表, 文本列表)"""
+        raise NotImplementedError
+
+    def _get_by_ids(self, ids):
+        """（持有读锁）返回 {ID: 文本}"""
+        raise NotImplementedError
+
+    # ============ 读写锁 ============
+    def _acquire_read(self):
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            self._readers += 1
+
+    def _release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def _acquire_write(self):
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            self._writing = True
+            while self._readers > 0:
+                self._cond.wait()
+
+    def _release_write(self):
+        with self._cond:
+            self._writing = False
+            self._cond.notify_all()
+
+    # ============ 打开与重新加载 ============
+    def _read_stamp(self):
+        if not self.stamp_file or not os.path.exists(self.stamp_file):
+            return None
+        return os.path.getmtime(self.stamp_file)
+
+    def _open_locked(self):
+        """在持有写锁的情况下加载数据并预热"""
+        start = time.perf_counter()
+        self._stamp = self._read_stamp()
+        self._load()
+        self._loaded = True
+        self.stats["open_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        self._warmup()
+        self.stats["warmup_ms"] = (time.perf_counter() - start) * 1000
+
+        print(f"{self.name}已加载：打开 {self.stats['open_ms']:.1f} ms，"
+              f"预热 {self.stats['warmup_ms']:.1f} ms，共 {self._count()} 个文本块")
+
+    def open(self):
+        """打开数据库（已打开时不做任何事）"""
+        if self._loaded:
+            return
+        self._acquire_write()
+        try:
+            if not self._loaded:
+                self._open_locked()
+        finally:
+            self._release_write()
+
+    def reload(self):
+        """在不重启进程的情况下重新加载数据库"""
+        self._acquire_write()
+        try:
+            self._open_locked()
+            self.stats["reloads"] += 1
+        finally:
+            self._release_write()
+
+    def reload_if_rebuilt(self):
+        """构建标记文件比当前数据新时重新加载"""
+        stamp = self._read_stamp()
+        if stamp is not None and stamp != self._stamp:
+            print("检测到向量数据库已重建，正在重新加载...")
+            self.reload()
+
+    # ============ 查询 ============
+    def query(self, query_embeddings, n_results=3):
+        """
+        用查询向量检索，返回与 Chroma 格式相同的查询结果（每个查询向量一组结果）。
+        query_embeddings 可以是单个向量，也可以是向量列表（批量查询）。
+        """
+        self.open()
+        self.reload_if_rebuilt()
+
+        # 单个向量的第一个元素是数字（列表或一维数组），批量查询时是向量
+        first = query_embeddings[0] if len(query_embeddings) else None
+        if first is not None and not isinstance(first, (list, tuple)) and getattr(first, "ndim", 0) == 0:
+            query_embeddings = [query_embeddings]
+
+        self._acquire_read()
+        try:
+            start = time.perf_counter()
+            results = self._search(query_embeddings, n_results)
+            elapsed = (time.perf_counter() - start) * 1000
+        finally:
+            self._release_read()
+
+        with self._cond:
+            self.stats["queries"] += 1
+            self.stats["query_ms_total"] += elapsed
+            self.stats["query_ms_max"] = max(self.stats["query_ms_max"], elapsed)
+        return results
+
+    def get_documents(self):
+        """返回全部文本块"""
+        return self.get_records()[1]
+
+    def get_records(self):
+        """返回全部文本块的 (ID列表, 文本列表)"""
+        self.open()
+        self._acquire_read()
+        try:
+            return self._get_records()
+        finally:
+            self._release_read()
+
+    def get_documents_by_ids(self, ids):
+        """按ID取文本块，返回 {ID: 文本}"""
+        if not ids:
+            return {}
+        self.open()
+        self._acquire_read()
+        try:
+            return self._get_by_ids(list(ids))
+        finally:
+            self._release_read()
+
+    def get_stats(self):
+        """返回耗时统计（包含平均查询耗时）"""
+        with self._cond:
+            stats = dict(self.stats)
+        stats["query_ms_avg"] = stats["query_ms_total"] / stats["queries"] if stats["queries"] else 0.0
+        return stats
+
+
+class RetrievalService(RetrievalBackend):
+    """
+    Chroma 检索后端：启动时打开一次 PersistentClient 和集合句柄，并预热 HNSW 索引。
+    适合大规模知识库。
+    """
+    name = "向量数据库"
+
+    def __init__(self, db_dir, collection_name, stamp_file=None):
+        super().__init__(stamp_file)
+        self.db_dir = db_dir
+        self.collection_name = collection_name
+        self._client = None
+        self._collection = None
+
+    def _load(self):
+        # chromadb 导入较慢、占用内存较多，只在使用 Chroma 后端时导入
+        import chromadb
+        from chromadb.api.client import SharedSystemClient
+
+        if self._client is not None:
+            # Chroma 按路径缓存底层系统，必须清理后才能读到重建后的文件
+            SharedSystemClient.clear_system_cache()
+        self._client = chromadb.PersistentClient(path=self.db_dir)
+        self._collection = self._client.get_collection(name=self.collection_name)
+
+    def _warmup(self):
+        """用库中已有的一条向量做一次查询，把 HNSW 段加载进内存"""
+        sample = self._collection.get(limit=1, include=["embeddings"])
+        embeddings = sample.get("embeddings")
+        if embeddings is not None and len(embeddings) > 0:
+            self._collection.query(query_embeddings=[list(embeddings[0])], n_results=1)
+
+    def _count(self):
+        return self._collection.count()
+
+    def _search(self, query_embeddings, n_results):
+        return self._collection.query(
+            query_embeddings=[list(embedding) for embedding in query_embeddings],
+            n_results=n_results
+        )
+
+    def _get_records(self):
+        result = self._collection.get(include=["documents"])
+        return result["ids"], result["documents"]
+
+    def _get_by_ids(self, ids):
+        result = self._collection.get(ids=ids, include=["documents"])
+        return dict(zip(result["ids"], result["documents"]))
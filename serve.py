@@ -0,0 +1,297 @@
+# serve.py
+# 多进程服务模式：一个 ASGI 前端（FastAPI + uvicorn，挂载 Gradio 界面）和多个工作进程
+# - 前端只负责界面、HTTP接口和转发，检索判断、检索、组装提示词和调用大模型都在工作进程中进行
+#   （Gradio 的排队状态保存在进程内，界面本身只能运行在一个进程中）
+# - 工作进程从同一个只读快照（见 snapshot.py）以内存映射方式加载向量库、关键词索引和命令名索引，
+#   页缓存由所有进程共享，增加工作进程时每个进程的内存基本不变
+# - build_vector_db.py 发布新快照后，各工作进程在下一次查询时切换到新版本，不需要重启
+# - 同一个会话的问题总是交给同一个工作进程，对话摘要缓存可以命中；工作进程异常退出时自动重启
+# 用法：python serve.py [--workers 4] [--host 127.0.0.1] [--port 7860]
+# 注意：工作进程以 spawn 方式启动，会重新导入本文件，因此较重的模块（gradio、fastapi、app）只在函数中导入
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from contextlib import asynccontextmanager
+
+HOST = "127.0.0.1"
+PORT = 7860
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1) # 工作进程数
+WORKER_CONCURRENCY = 32 # 每个工作进程同时处理的问题数
+SUPERVISE_INTERVAL = 1.0 # 检查工作进程是否存活的间隔（秒）
+
+
+# ==================== 工作进程 ====================
+def worker_main(worker_id, jobs, results, concurrency):
+    """工作进程入口：预热快照中的索引，然后循环处理前端转发的问题"""
+    import app
+
+    app.warm_up()
+    print(f"工作进程 {worker_id} 已就绪（pid {os.getpid()}，快照 {app.snapshots.version() or '无'}）")
+    asyncio.run(worker_loop(app, jobs, results, concurrency))
+
+
+async def worker_loop(app, jobs, results, concurrency):
+    """
+    每次最多同时处理 concurrency 个问题，处理不过来时不再取新问题，新问题在本进程的队列中等待
+    （问题按会话固定分配给工作进程，不会转给其他工作进程）。
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    def on_done(task):
+        tasks.discard(task)
+        semaphore.release()
+
+    while True:
+        await semaphore.acquire()
+        job = await asyncio.to_thread(jobs.get)
+        if job is None:
+            break
+        task = asyncio.create_task(run_job(app, job, results))
+        tasks.add(task)
+        task.add_done_callback(on_done)
+
+    await asyncio.gather(*tasks)
+    await app.async_client.close()
+
+
+async def run_job(app, job, results):
+    """
+    回答一个问题：逐段把新生成的文本发回前端，结束时附上各阶段耗时（前端汇总成指标）。
+    消息格式：(问题编号, "delta" / "done" / "error", 内容)
+    """
+    job_id, user_question, history_tuples, session_id = job
+    sent = ""
+    try:
+        with app.tracer.trace("worker") as trace:
+            async for partial_answer in app.get_answer_stream_async(user_question, history_tuples, session_id):
+                results.put((job_id, "delta", partial_answer[len(sent):]))
+                sent = partial_answer
+        results.put((job_id, "done", trace.spans))
+    except Exception as e:
+        results.put((job_id, "error", f"❌ 发生错误: {str(e)}"))
+
+
+# ==================== 前端 ====================
+def process_memory_mb(pid):
+    """
+    进程的 RSS 和 PSS（MB）。PSS 把共享页按共享进程数分摊，能看出内存映射的快照是否被共享。
+    只在 Linux 上可用，其他系统返回空字典。
+    """
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                key = line.split(":")[0]
+                if key in ("Rss", "Pss"):
+                    memory[key.lower() + "_mb"] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return memory
+
+
+class WorkerPool:
+    """
+    管理工作进程：按会话选择工作进程并转发问题，把工作进程发回的文本转交给对应的请求。
+    - 每个工作进程有自己的问题队列，所有工作进程共用一个结果队列
+    - 结果队列由一个后台线程读取，再通过 call_soon_threadsafe 交给事件循环
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, concurrency=WORKER_CONCURRENCY):
+        self.workers = workers
+        self.concurrency = concurrency
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue()
+        self._slots = [None] * workers # [(进程, 问题队列)]
+        self._pending = {} # 问题编号 -> (工作进程编号, asyncio.Queue)
+        self._ids = itertools.count(1)
+        self._round_robin = itertools.count()
+        self._loop = None
+        self._closing = False
+        self.restarts = 0
+
+    def start(self, loop):
+        self._loop = loop
+        for i in range(self.workers):
+            self._spawn(i)
+        threading.Thread(target=self._dispatch, name="worker-results", daemon=True).start()
+        threading.Thread(target=self._supervise, name="worker-supervisor", daemon=True).start()
+        print(f"已启动 {self.workers} 个工作进程")
+
+    def close(self):
+        self._closing = True
+        for process, jobs in self._slots:
+            jobs.put(None)
+        for process, jobs in self._slots:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._results.put(None)
+
+    def _spawn(self, i):
+        self._slots[i] = self._start_worker(i)
+
+    def _start_worker(self, i):
+        jobs = self._context.Queue()
+        process = self._context.Process(
+            target=worker_main,
+            args=(i, jobs, self._results, self.concurrency),
+            name=f"worker-{i}",
+            daemon=True
+        )
+        process.start()
+        return process, jobs
+
+    def _dispatch(self):
+        while True:
+            message = self._results.get()
+            if message is None:
+                return
+            job_id, kind, payload = message
+            entry = self._pending.get(job_id)
+            if entry is not None:
+                self._loop.call_soon_threadsafe(entry[1].put_nowait, (kind, payload))
+
+    def _supervise(self):
+        while not self._closing:
+            time.sleep(SUPERVISE_INTERVAL)
+            for i, (process, jobs) in enumerate(self._slots):
+                if not process.is_alive() and not self._closing:
+                    print(f"工作进程 {i} 已退出（退出码 {process.exitcode}），正在重启...")
+                    slot = self._start_worker(i)
+                    asyncio.run_coroutine_threadsafe(self._replace_worker(i, slot), self._loop).result()
+                    self.restarts += 1
+
+    async def _replace_worker(self, worker, slot):
+        """
+        （在事件循环中执行）结束交给已退出进程的全部问题，再换上新进程。
+        问题也在事件循环中分配，两步之间不会有新问题分给该工作进程，新进程接到的问题不受影响。
+        """
+        for index, queue in list(self._pending.values()):
+            if index == worker:
+                queue.put_nowait(("error", "❌ 工作进程异常退出，请重试"))
+        self._slots[worker] = slot
+
+    def _pick(self, session_id):
+        """同一个会话固定交给同一个工作进程，没有会话ID时轮流分配"""
+        if session_id:
+            return zlib.crc32(session_id.encode("utf-8")) % self.workers
+        return next(self._round_robin) % self.workers
+
+    async def answer_stream(self, user_question, history_tuples=None, session_id=None):
+        """
+        与 app.get_answer_stream_async 的参数和产出相同，实际在工作进程中回答。
+        """
+        import app
+
+        job_id = next(self._ids)
+        index = self._pick(session_id)
+        queue = asyncio.Queue()
+        self._pending[job_id] = (index, queue)
+        self._slots[index][1].put((job_id, user_question, list(history_tuples or []), session_id))
+
+        answer = ""
+        try:
+            while True:
+                kind, payload = await queue.get()
+                if kind == "delta":
+                    answer += payload
+                    yield answer
+                elif kind == "done":
+                    # 工作进程记录的各阶段耗时汇总到前端的指标中
+                    for name, ms, error in payload:
+                        app.tracer.observe(name, ms, error)
+                    return
+                else:
+                    app.tracer.record_error("worker", payload)
+                    yield payload
+                    return
+        finally:
+            self._pending.pop(job_id, None)
+
+    def get_stats(self):
+        """各工作进程的状态和内存占用"""
+        workers = []
+        for i, (process, jobs) in enumerate(self._slots):
+            worker = {"id": i, "pid": process.pid, "alive": process.is_alive()}
+            worker.update(process_memory_mb(process.pid))
+            workers.append(worker)
+        return {
+            "workers": workers,
+            "in_flight": len(self._pending),
+            "restarts": self.restarts,
+        }
+
+
+def create_server(pool):
+    """创建前端：FastAPI 应用，挂载 Gradio 界面、健康检查、指标和问答接口"""
+    import gradio as gr
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse
+    from pydantic import BaseModel
+
+    import app
+
+    class AnswerRequest(BaseModel):
+        question: str
+        history: list[tuple[str, str]] = []
+        session_id: str | None = None
+
+    @asynccontextmanager
+    async def lifespan(api):
+        pool.start(asyncio.get_running_loop())
+        yield
+        pool.close()
+
+    api = FastAPI(lifespan=lifespan)
+
+    @api.get("/healthz")
+    async def healthz():
+        stats = pool.get_stats()
+        return {
+            "workers_alive": sum(1 for worker in stats["workers"] if worker["alive"]),
+            "workers": pool.workers,
+            "snapshot": app.snapshots.version(),
+        }
+
+    @api.get("/metrics")
+    async def metrics():
+        return PlainTextResponse(app.tracer.format_prometheus())
+
+    @api.get("/metrics.json")
+    async def metrics_json():
+        return {"stages": app.tracer.snapshot(), "pool": pool.get_stats(), "snapshot": app.snapshots.version()}
+
+    @api.post("/api/answer")
+    async def answer(request: AnswerRequest):
+        """非流式问答接口，便于脚本调用"""
+        result = ""
+        async for result in pool.answer_stream(request.question, request.history, request.session_id):
+            pass
+        return {"answer": result}
+
+    return gr.mount_gradio_app(api, app.create_demo(pool.answer_stream), path="/")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Linux命令小助手多进程服务")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="工作进程数")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="每个工作进程同时处理的问题数")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    server = create_server(WorkerPool(max(1, args.workers), max(1, args.concurrency)))
+    print(f"\n🚀 启动Web界面：http://{args.host}:{args.port}")
+    uvicorn.run(server, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# snapshot.py
+# 只读数据快照：build_vector_db.py 构建完成后，把检索所需的全部文件（向量库、关键词索引、命令名索引、检索判断模型）
+# 复制到一个新的版本目录，再原子地替换 CURRENT 指针文件。
+# 快照目录发布后不再修改，多个进程以内存映射方式共享同一份文件；切换版本只需替换指针，进行中的查询不受影响。
+#
+# 目录结构：
+#   db/snapshots/CURRENT              当前版本号
+#   db/snapshots/<版本号>/vector_store/  numpy 向量库
+#   db/snapshots/<版本号>/vector_store_local/  本地嵌入模型的向量库（可选，见 embedders.py）
+#   db/snapshots/<版本号>/bm25_index/    关键词检索索引
+#   db/snapshots/<版本号>/command_index/ 命令名索引（内存映射格式）
+#   db/snapshots/<版本号>/gating_model.npz
+import os
+import shutil
+import time
+
+from numpy_store import NumpyRetrievalService
+
+CURRENT_FILE = "CURRENT"
+
+
+def publish_snapshot(root, write, keep=3):
+    """
+    发布一个新快照：write(目录) 把文件写入临时目录，完成后改名为版本目录，最后替换 CURRENT。
+    只保留最新的 keep 个版本（当前版本始终保留）。返回新的版本号。
+    """
+    os.makedirs(root, exist_ok=True)
+    version = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+    staging = os.path.join(root, version + ".tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    write(staging)
+    os.replace(staging, os.path.join(root, version))
+
+    pointer = os.path.join(root, CURRENT_FILE)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer + ".tmp", pointer)
+
+    prune_snapshots(root, keep)
+    return version
+
+
+def list_snapshots(root):
+    """按版本号（即发布时间）从旧到新返回全部快照"""
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root)
+                  if not name.endswith(".tmp") and os.path.isdir(os.path.join(root, name)))
+
+
+def prune_snapshots(root, keep=3):
+    """
+    删除较旧的快照。Linux 上正在内存映射旧文件的进程不受影响；
+    Windows 上被占用的文件无法删除，跳过，下次发布时再删。
+    """
+    current = read_current(root)
+    for version in list_snapshots(root)[:-keep] if keep > 0 else []:
+        if version != current:
+            shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+
+
+def read_current(root):
+    """当前版本号，没有发布过快照时返回None"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class SnapshotPointer:
+    """
+    当前快照的位置。CURRENT 的修改时间不变时直接使用缓存的版本号，每次只需一次 stat。
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.current_file = os.path.join(root, CURRENT_FILE)
+        self._mtime = None
+        self._version = None
+
+    def current(self):
+        """当前快照目录，没有快照时返回None"""
+        try:
+            mtime = os.path.getmtime(self.current_file)
+        except OSError:
+            return None
+        if mtime != self._mtime:
+            self._version = read_current(self.root)
+            self._mtime = mtime
+        return os.path.join(self.root, self._version) if self._version else None
+
+    def version(self):
+        self.current()
+        return self._version
+
+    def exists(self):
+        return self.current() is not None
+
+
+class SnapshotRetrievalService(NumpyRetrievalService):
+    """
+    从当前快照加载的 numpy 检索后端：CURRENT 作为构建标记文件，版本切换后下一次查询时自动重新加载。
+    subdir 为快照中的向量库目录。
+    """
+    name = "向量库（快照）"
+
+    def __init__(self, pointer, subdir="vector_store"):
+        super().__init__(None, stamp_file=pointer.current_file)
+        self.pointer = pointer
+        self.subdir = subdir
+
+    def _load(self):
+        snapshot_dir = self.pointer.current()
+        if snapshot_dir is None:
+            raise FileNotFoundError(f"没有可用的快照: {self.pointer.root}")
+        self.directory = os.path.join(snapshot_dir, self.subdir)
+        super()._load()
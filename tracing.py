@@ -0,0 +1,213 @@
+# tracing.py
+# 分阶段耗时追踪：每个请求记录各阶段（判断、检索、嵌入、生成等）的耗时，
+# 进程内按阶段统计直方图（p50/p95/p99），可以通过 /metrics 接口查看，或在日志中逐请求输出
+import contextvars
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 当前请求的追踪记录；asyncio 任务和 asyncio.to_thread 会自动继承
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Histogram:
+    """
+    单个阶段的耗时统计：总次数、出错次数、平均值和最大值，
+    分位数按最近 reservoir_size 次的耗时计算。
+    """
+
+    def __init__(self, reservoir_size=4096):
+        self.values = deque(maxlen=reservoir_size)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms, error=False):
+        self.values.append(ms)
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        if error:
+            self.errors += 1
+
+    def summary(self):
+        values = sorted(self.values)
+
+        def percentile(q):
+            return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": self.total_ms / self.count if self.count else 0.0,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": self.max_ms,
+        }
+
+
+class Trace:
+    """一个请求的追踪记录：依次记录的 (阶段, 耗时ms, 是否出错)"""
+    _ids = itertools.count(1)
+
+    def __init__(self, name):
+        self.id = next(self._ids)
+        self.name = name
+        self.spans = []
+        self.start = time.perf_counter()
+
+    def format(self, total_ms):
+        stages = " | ".join(f"{name} {ms:.1f}" + ("!" if error else "") for name, ms, error in self.spans)
+        return f"[trace {self.id}] {self.name} {total_ms:.1f} ms：{stages}"
+
+
+class Tracer:
+    """
+    追踪器。
+    - trace(name)：一个请求的根节点，结束时记录总耗时，并（log_traces=True 时）打印一行各阶段耗时；
+      嵌套使用时内层的阶段并入外层，只由最外层打印
+    - span(name)：记录一个阶段的耗时，抛出异常时计为出错
+    - observe(name, ms)：直接记录一个耗时（如首字延迟），同样计入当前请求
+    - record_error(name, error)：记录被捕获处理的错误（带请求编号打印，便于对照日志）
+    同步代码和异步代码都可以使用。
+    """
+
+    def __init__(self, log_traces=True, reservoir_size=4096):
+        self.log_traces = log_traces
+        self.reservoir_size = reservoir_size
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, name):
+        """（持有锁）取阶段的直方图，不存在时创建"""
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = Histogram(self.reservoir_size)
+        return histogram
+
+    def observe(self, name, ms, error=False):
+        with self._lock:
+            self._histogram(name).observe(ms, error)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append((name, ms, error))
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000, error)
+
+    @contextmanager
+    def trace(self, name="request"):
+        trace = Trace(name)
+        previous = _current_trace.get()
+        # 不使用 token 恢复：异步生成器可能在另一个上下文中结束
+        _current_trace.set(trace)
+        error = False
+        try:
+            yield trace
+        except Exception:
+            error = True
+            raise
+        finally:
+            total_ms = (time.perf_counter() - trace.start) * 1000
+            _current_trace.set(previous)
+            if previous is not None:
+                previous.spans.extend(trace.spans)
+            self.observe(name, total_ms, error)
+            if self.log_traces and previous is None:
+                print(trace.format(total_ms))
+
+    def record_error(self, name, error):
+        """记录一个被捕获的错误：计入该阶段的出错次数（不计耗时）"""
+        with self._lock:
+            self._histogram(name).errors += 1
+        trace = _current_trace.get()
+        prefix = f"[trace {trace.id}] " if trace is not None else ""
+        print(f"{prefix}{name} 出错: {error}")
+
+    def snapshot(self):
+        """各阶段的统计信息 {阶段: {count, errors, avg_ms, p50_ms, p95_ms, p99_ms, max_ms}}"""
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in sorted(self._histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def format_prometheus(self, prefix="linux_assistant"):
+        """Prometheus 文本格式的指标"""
+        lines = [
+            f"# TYPE {prefix}_stage_latency_ms summary",
+            f"# TYPE {prefix}_stage_errors_total counter",
+        ]
+        for name, summary in self.snapshot().items():
+            for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+                lines.append(f'{prefix}_stage_latency_ms{{stage="{name}",quantile="{quantile}"}} {summary[key]:.3f}')
+            lines.append(f'{prefix}_stage_latency_ms_sum{{stage="{name}"}} {summary["avg_ms"] * summary["count"]:.3f}')
+            lines.append(f'{prefix}_stage_latency_ms_count{{stage="{name}"}} {summary["count"]}')
+            lines.append(f'{prefix}_stage_errors_total{{stage="{name}"}} {summary["errors"]}')
+        return "\n".join(lines) + "\n"
+
+    def format_table(self):
+        """便于在终端查看的表格"""
+        # 中文表头每个字占两列宽，宽度相应减少
+        rows = [f"{'阶段':<16}{'次数':>6}{'出错':>4}{'平均ms':>8}{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}{'最大ms':>8}"]
+        for name, s in self.snapshot().items():
+            rows.append(f"{name:<18}{s['count']:>8}{s['errors']:>6}{s['avg_ms']:10.1f}{s['p50_ms']:10.1f}"
+                        f"{s['p95_ms']:10.1f}{s['p99_ms']:10.1f}{s['max_ms']:10.1f}")
+        return "\n".join(rows)
+
+
+def start_metrics_server(tracer, host="127.0.0.1", port=9861, extra_stats=None):
+    """
+    在后台线程中启动指标接口：
+    - GET /metrics：Prometheus 文本格式
+    - GET /metrics.json：JSON 格式（extra_stats 为返回其他统计信息的函数，结果放在 "stats" 字段）
+    端口被占用等原因无法启动时只打印提示并返回None，不影响主程序。
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = tracer.format_prometheus().encode("utf-8")
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path == "/metrics.json":
+                data = {"stages": tracer.snapshot()}
+                if extra_stats is not None:
+                    data["stats"] = extra_stats()
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                content_type = "application/json; charset=utf-8"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"⚠️ 指标接口启动失败（{host}:{port}）：{e}，可通过环境变量 METRICS_PORT 更换端口")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"指标接口已启动：http://{host}:{server.server_address[1]}/metrics")
+    return server